@@ -91,5 +91,6 @@ def main(configs, train=train, Runner=Runner):
     runner, 
     routine_config, 
   )
+  close_buffers(agents)
 
   do_logging('Training completed', level='info')
@@ -1,5 +1,7 @@
 import os
+import copy
 import importlib
+from concurrent.futures import ThreadPoolExecutor
 import ray
 
 from core.builder import ElementsBuilder
@@ -7,6 +9,7 @@ from core.names import ANCILLARY, DL_LIB
 from core.typing import get_basic_model_name
 from core.utils import configure_gpu, set_seed, save_code_for_seed
 from envs.utils import divide_env_output
+from tools.run import store_episode_info
 from tools.log import do_logging
 from tools.utils import modify_config, flatten_dict
 from tools.timer import Timer, timeit, Every
@@ -32,23 +35,36 @@ def init_running_stats(agents, runner: Runner, n_steps=None):
 
 
 @timeit
-def env_run(agents, runner: Runner, routine_config, prepare_buffer=None, name='real'):
+def env_run(agents, runner: Runner, routine_config, prepare_buffer=None, 
+            name='real', train_steps=None):
+  env_output = collect(agents, runner, routine_config, name, train_steps)
+  if prepare_buffer is not None:
+    prepare_buffers(agents, env_output, routine_config, prepare_buffer)
+
+  return agents[-1].get_env_step()
+
+
+def collect(agents, runner: Runner, routine_config, name='real', 
+            train_steps=None, store_info=True, eps_callbacks=[]):
   env_output = runner.run(
     agents, 
     n_steps=routine_config.n_steps, 
     name=name, 
-    store_info=True
+    store_info=store_info, 
+    eps_callbacks=eps_callbacks, 
+    train_steps=train_steps, 
   )
-  if prepare_buffer is not None:
-    agent_env_outputs = divide_env_output(env_output)
-    for agent, eo in zip(agents, agent_env_outputs):
-      prepare_buffer(agent, eo, routine_config.compute_return_at_once)
-
   env_steps_per_run = runner.get_steps_per_run(routine_config.n_steps)
   for agent in agents:
     agent.add_env_step(env_steps_per_run)
 
-  return agent.get_env_step()
+  return env_output
+
+
+def prepare_buffers(agents, env_output, routine_config, prepare_buffer):
+  agent_env_outputs = divide_env_output(env_output)
+  for agent, eo in zip(agents, agent_env_outputs):
+    prepare_buffer(agent, eo, routine_config.compute_return_at_once)
 
 
 @timeit
@@ -133,6 +149,13 @@ def log(agent):
   log_agent(agent, env_step, train_step)
 
 
+def close_buffers(agents):
+  """ Releases resources of buffers, e.g., writers of episodes """
+  for agent in agents:
+    if hasattr(agent.buffer, 'close'):
+      agent.buffer.close()
+
+
 @timeit
 def build_agent(config, env_stats, aid=0, rename_model_name=True, 
                 save_monitor_stats_to_disk=True, save_config=True):
@@ -175,6 +198,10 @@ def train(
   pkg = get_package(root_dir, 'algo', algo)
   prepare_buffer = importlib.import_module(f'{pkg}.run').prepare_buffer
 
+  if routine_config.get('pipeline'):
+    pipelined_train(agents, runner, routine_config, prepare_buffer, to_record)
+    return
+
   while env_step < routine_config.MAX_STEPS:
     env_step = env_run(agents, runner, routine_config, prepare_buffer)
     ego_optimize(agents)
@@ -184,11 +211,66 @@ def train(
       eval_and_log(agents, runner, routine_config)
 
 
+def pipelined_train(agents, runner: Runner, routine_config, prepare_buffer, to_record):
+  """ Collects the next rollout on a background thread while training on 
+  the previous one
+
+  Actors act with snapshots of the models, which are synchronized before 
+  each rollout, so the policy lag is one iteration. Buffers are prepared 
+  on the main thread after training, i.e., once the previous batch has 
+  been consumed. The train step of the snapshot is stored with the data 
+  and reported as policy_lag. Episode stats are stored on the main thread 
+  too, as agents' monitors are not thread-safe.
+  """
+  models = [agent.actor.model for agent in agents]
+  for agent in agents:
+    agent.actor.model = copy.deepcopy(agent.model)
+
+  def sync_snapshots():
+    for agent in agents:
+      agent.actor.model.set_weights(agent.model.get_weights())
+    return [agent.get_train_step() for agent in agents]
+
+  def collect_in_background(train_steps):
+    infos = []
+    # timed as env_run, so that fps reflects the collection alone
+    with Timer('env_run'):
+      env_output = collect(agents, runner, routine_config, 
+        train_steps=train_steps, store_info=False, 
+        eps_callbacks=[lambda info: infos.append(info)])
+    return env_output, infos
+
+  try:
+    with ThreadPoolExecutor(max_workers=1) as executor:
+      train_steps = sync_snapshots()
+      env_step = env_run(agents, runner, routine_config, prepare_buffer, 
+                         train_steps=train_steps)
+      while env_step < routine_config.MAX_STEPS:
+        train_steps = sync_snapshots()
+        future = executor.submit(collect_in_background, train_steps)
+        ego_optimize(agents)
+        env_output, infos = future.result()
+        for info in infos:
+          store_episode_info(agents, runner.env_stats(), info)
+        prepare_buffers(agents, env_output, routine_config, prepare_buffer)
+        env_step = agents[-1].get_env_step()
+        time2record = to_record(env_step)
+
+        if time2record:
+          sync_snapshots()
+          eval_and_log(agents, runner, routine_config)
+  finally:
+    for agent, model in zip(agents, models):
+      agent.actor.model = model
+
+
 def main(configs, train=train, Runner=Runner):
   configs = configure_gpu(configs)
   config = configs[0]
   if config.routine.compute_return_at_once:
     config.buffer.sample_keys += ['advantage', 'v_target']
+  if config.routine.get('pipeline'):
+    config.buffer.sample_keys += ['train_step']
   seed = config.get('seed')
   set_seed(seed, config.dllib)
 
@@ -219,5 +301,6 @@ def main(configs, train=train, Runner=Runner):
 
   routine_config = config.routine.copy()
   train(agents, runner, routine_config)
+  close_buffers(agents)
 
   do_logging('Training completed', level='info')
@@ -1,8 +1,25 @@
+import functools
+import threading
+
 from core.typing import AttrDict, dict2AttrDict
 from core.elements.model import Model
 
 
+def synchronized(func):
+  """ Runs a method of a buffer while holding its lock, so that 
+  sampling on a prefetching thread never interleaves with writes """
+  @functools.wraps(func)
+  def wrapper(self, *args, **kwargs):
+    with self.lock:
+      return func(self, *args, **kwargs)
+  return wrapper
+
+
 class Buffer:
+  # whether sampling is safe against concurrent writes, as required by 
+  # prefetching, i.e., whether all its reads and writes are synchronized
+  is_synchronized = False
+
   def __init__(
     self, 
     config: AttrDict,
@@ -14,6 +31,7 @@ class Buffer:
     self.env_stats = dict2AttrDict(env_stats, to_copy=True)
     self.model = model
     self.aid = aid
+    self.lock = threading.RLock()
 
     self.obs_keys = env_stats.obs_keys[self.aid]
     self.state_keys, self.state_type, \
@@ -0,0 +1,88 @@
+import collections
+import queue
+import threading
+import time
+
+from tools.log import do_logging
+
+
+class Prefetcher:
+  """ Keeps up to n_batches batches sampled from buffer ready in a queue
+
+  Sampling and the optional process_fn, e.g., tensor conversion, run on
+  a daemon thread. Priority updates are forwarded to the same thread
+  and applied in the order they are submitted, before the next batch
+  is sampled, so sampling and priority updates never interleave.
+  Batches already in the queue lag at most n_batches priority updates
+  behind.
+  """
+  def __init__(self, buffer, n_batches=2, process_fn=None, sleep_time=.01):
+    self._buffer = buffer
+    self._queue = queue.Queue(maxsize=n_batches)
+    self._process_fn = process_fn
+    self._sleep_time = sleep_time
+
+    self._pending_priorities = collections.deque()
+    self._error = None
+    self._stop_event = threading.Event()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def __len__(self):
+    return self._queue.qsize()
+
+  def sample(self):
+    """ Returns the next prefetched batch, or None if the buffer is
+    not ready to be sampled and no batch is available """
+    if self._error is not None:
+      raise self._error
+    if self._queue.empty() and not self._is_buffer_ready():
+      return None
+    while True:
+      try:
+        return self._queue.get(timeout=1)
+      except queue.Empty:
+        if self._error is not None:
+          raise self._error
+        if not self._thread.is_alive():
+          raise RuntimeError('Prefetching thread terminated unexpectedly')
+
+  def update_priorities(self, priorities, idxes):
+    self._pending_priorities.append((priorities, idxes))
+
+  def stop(self):
+    self._stop_event.set()
+    self._thread.join()
+    self._apply_priorities()
+
+  """ Implementation """
+  def _is_buffer_ready(self):
+    if hasattr(self._buffer, 'ready_to_sample'):
+      return self._buffer.ready_to_sample()
+    return True
+
+  def _apply_priorities(self):
+    while self._pending_priorities:
+      priorities, idxes = self._pending_priorities.popleft()
+      self._buffer.update_priorities(priorities, idxes)
+
+  def _run(self):
+    try:
+      while not self._stop_event.is_set():
+        self._apply_priorities()
+        data = self._buffer.sample()
+        if data is None:
+          time.sleep(self._sleep_time)
+          continue
+        if self._process_fn is not None:
+          data = self._process_fn(data)
+        while not self._stop_event.is_set():
+          try:
+            self._queue.put(data, timeout=self._sleep_time)
+            break
+          except queue.Full:
+            # keep priorities fresh while waiting for the consumer
+            self._apply_priorities()
+    except Exception as e:
+      do_logging(f'Prefetching terminated with error: {e}', level='error')
+      self._error = e
@@ -1,6 +1,10 @@
+import numpy as np
+
+from core.elements.prefetcher import Prefetcher
 from core.elements.trainer import Trainer
 from core.typing import AttrDict, dict2AttrDict
 from tools.timer import Timer
+from tools.tree_ops import tree_map
 
 
 class TrainingLoop:
@@ -19,6 +23,9 @@ class TrainingLoop:
     for k, v in kwargs.items():
       setattr(self, k, v)
 
+    # prefetching is enabled by setting prefetch.n_batches > 0
+    self._prefetcher = None
+
     self.post_init()
 
   def post_init(self):
@@ -73,7 +80,12 @@ class TrainingLoop:
 
   def sample_data(self, batch_size=None, record_data=True):
     with Timer('sample_data'):
-      data = self.buffer.sample(batch_size=batch_size)
+      if batch_size is None and self.config.get('prefetch', {}).get('n_batches'):
+        if self._prefetcher is None:
+          self._prefetcher = self._build_prefetcher()
+        data = self._prefetcher.sample()
+      else:
+        data = self.buffer.sample(batch_size=batch_size)
     if record_data:
       self.training_data = data
     if data is None:
@@ -90,7 +102,58 @@ class TrainingLoop:
     stats = self.trainer.train(data, **kwargs)
     return stats
 
+  def update_priorities(self, priorities, idxes):
+    """ Updates priorities of a prioritized buffer, deferred to the 
+    prefetching thread if prefetching is enabled """
+    if self._prefetcher is None:
+      self.buffer.update_priorities(priorities, idxes)
+    else:
+      self._prefetcher.update_priorities(priorities, idxes)
+
+  def stop_prefetching(self):
+    if self._prefetcher is not None:
+      self._prefetcher.stop()
+      self._prefetcher = None
+
   def change_buffer(self, buffer):
+    self.stop_prefetching()
     old_buffer = self.buffer
     self.buffer = buffer
     return old_buffer
+
+  def _build_prefetcher(self):
+    config = self.config.prefetch
+    if not getattr(self.buffer, 'is_synchronized', False):
+      raise ValueError(
+        'prefetch requires a buffer whose sampling is synchronized with '
+        f'writes, but got {type(self.buffer).__name__}')
+    if config.get('to_tensor'):
+      if not hasattr(self.trainer, 'tpdv'):
+        raise ValueError(
+          'prefetch.to_tensor is only supported by torch trainers, '
+          f'but got {type(self.trainer).__name__}')
+      process_fn = self._get_tensor_converter(config.get('pin_memory', False))
+    else:
+      process_fn = None
+    return Prefetcher(self.buffer, config.n_batches, process_fn=process_fn)
+
+  def _get_tensor_converter(self, pin_memory=False):
+    """ Converts sampled data to tensors on the trainer's device ahead of time """
+    import torch
+    from th.tools.th_utils import to_tensor
+    tpdv = dict(self.trainer.tpdv)
+    if pin_memory:
+      tpdv['non_blocking'] = True
+    # keys consumed as numpy arrays, e.g., to update priorities
+    numpy_keys = ('idxes', 'train_step')
+
+    def convert(data):
+      for k, v in data.items():
+        if k in numpy_keys:
+          continue
+        if pin_memory:
+          v = tree_map(lambda x: torch.from_numpy(x).pin_memory() 
+            if isinstance(x, np.ndarray) else x, v)
+        data[k] = to_tensor(v, tpdv)
+      return data
+    return convert
@@ -8,8 +8,9 @@ from tools.pickle import save, restore, save_params, restore_params
 from core.names import *
 from core.typing import ModelPath, AttrDict
 from tools.display import print_dict, print_dict_info
-from tools.rms import RunningMeanStd, combine_rms, normalize, StatsWithVarCount
-from tools.utils import yield_from_tree_with_indices, batch_dicts
+from tools.rms import RunningMeanStd, combine_rms, combine_rms_list, \
+  normalize, StatsWithVarCount
+from tools.utils import batch_dicts
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +31,30 @@ def combine_rms_stats(rms_stats1: RMSStats, rms_stats2: RMSStats):
   return RMSStats(obs_rms, reward_rms)
 
 
+def combine_rms_stats_list(rms_stats_list: List[RMSStats]):
+  """ Combines many RMSStats, e.g., those from all runners, with one 
+  vectorized merge per statistics """
+  if len(rms_stats_list) == 0:
+    return None
+  first = rms_stats_list[0]
+  if first.obs is None:
+    obs_rms = None
+  else:
+    obs_rms = []
+    for i, rms in enumerate(first.obs):
+      obs_rms.append({
+        k: combine_rms_list([stats.obs[i][k] for stats in rms_stats_list]) 
+          or rms[k]
+        for k in rms.keys()
+      })
+  if first.reward:
+    reward_rms = combine_rms_list([stats.reward for stats in rms_stats_list]) \
+      or first.reward
+  else:
+    reward_rms = None
+  return RMSStats(obs_rms, reward_rms)
+
+
 def rms2dict(rms: RMSStats):
   stats = {}
   if rms.obs:
@@ -232,32 +257,27 @@ class ObsRunningMeanStd:
   """ Processing Data with RMS """
   def update(self, obs, name=None, mask=None, feature_mask=None, axis=None):
     if self._normalize_obs:
-      if not isinstance(obs, dict):
-        if name is None:
-          name = OBS
-        if name not in self._masked_names:
-          mask = None
-        assert name in self.rms, (name, list(self.rms))
-        fm = feature_mask[name] if self._use_feature_mask \
-          and feature_mask is not None else None
-        self.rms[name].update(obs, mask=mask, feature_mask=fm, axis=axis)
-      else:
-        if name is None:
-          for k in self._obs_names:
-            assert not obs[k].dtype == np.uint8, f'Unexpected normalization on {name} of type uint8.'
-            rms_mask = mask if name in self._masked_names else None
-            assert k in self.rms, (k, list(self.rms))
-            fm = feature_mask[k] if self._use_feature_mask \
-              and feature_mask is not None else None
-            self.rms[k].update(obs[k], mask=rms_mask, feature_mask=fm, axis=axis)
-        else:
-          assert not obs[name].dtype == np.uint8, f'Unexpected normalization on {name} of type uint8.'
-          if name not in self._masked_names:
-            mask = None
-          assert name in self.rms, (name, list(self.rms))
-          fm = feature_mask[name] if self._use_feature_mask \
-            and feature_mask is not None else None
-          self.rms[name].update(obs[name], mask=mask, feature_mask=fm, axis=axis)
+      for k, x, m, fm in self.get_update_items(obs, name, mask, feature_mask):
+        self.rms[k].update(x, mask=m, feature_mask=fm, axis=axis)
+
+  def get_update_items(self, obs, name=None, mask=None, feature_mask=None):
+    """ Yields (name, obs, mask, feature mask) to update the RMS of each 
+    observation in obs """
+    if not isinstance(obs, dict):
+      names = [OBS if name is None else name]
+    elif name is None:
+      names = self._obs_names
+    else:
+      names = [name]
+    for k in names:
+      x = obs[k] if isinstance(obs, dict) else obs
+      if isinstance(obs, dict):
+        assert not x.dtype == np.uint8, f'Unexpected normalization on {k} of type uint8.'
+      assert k in self.rms, (k, list(self.rms))
+      m = mask if k in self._masked_names else None
+      fm = feature_mask[k] if self._use_feature_mask \
+        and feature_mask is not None else None
+      yield k, x, m, fm
 
   def update_from_stats(self, rms: dict):
     for k, v in rms.items():
@@ -389,9 +409,37 @@ class RMS:
         obs, name, mask=mask, feature_mask=feature_mask, axis=axis)
     else:
       assert indices is not None and len(indices) == self.n_obs, (indices, self.n_obs)
-      for rms, (o, m) in zip(self.obs_rms, yield_from_tree_with_indices(
-            (obs, mask), indices, split_axis, keep_none=True)):
-        rms.update(o, name, mask=m, feature_mask=feature_mask, axis=axis)
+      if not self.is_obs_normalized:
+        return
+      # all groups share the configuration of the first one
+      for k, x, m, fm in self.obs_rms[0].get_update_items(
+          obs, name, mask, feature_mask):
+        self._update_obs_rms_by_groups(
+          k, x, indices, split_axis, mask=m, feature_mask=fm, axis=axis)
+
+  def _update_obs_rms_by_groups(self, name, x, indices, split_axis, 
+                                mask=None, feature_mask=None, axis=None):
+    """ Updates the RMSs of all groups for one observation. If the split 
+    axis is kept in the stats, moments are computed once over x and 
+    split afterwards. Otherwise, only x and mask are split. """
+    rms0 = self.obs_rms[0].rms[name]
+    rms_axis = rms0.axis if axis is None else (
+      (axis,) if isinstance(axis, int) else tuple(axis))
+    if rms_axis is not None and split_axis >= len(rms_axis):
+      mean, var, count = rms0.compute_moments(
+        x, mask=mask, feature_mask=feature_mask, axis=rms_axis)
+      if count == 0:
+        return
+      stats_axis = split_axis - len(rms_axis)
+      for obs_rms, idx in zip(self.obs_rms, indices):
+        obs_rms.rms[name].update_from_moments(
+          np.take(mean, idx, stats_axis), np.take(var, idx, stats_axis), count)
+    else:
+      for obs_rms, idx in zip(self.obs_rms, indices):
+        m = None if mask is None or split_axis >= mask.ndim \
+          else np.take(mask, idx, split_axis)
+        obs_rms.rms[name].update(np.take(x, idx, split_axis), mask=m, 
+          feature_mask=feature_mask, axis=axis)
 
   def normalize_obs(self, obs, is_next=False):
     new_obs = obs.copy()
@@ -444,7 +492,8 @@ class RMS:
       mask=reward_mask, axis=axis)
 
   def update_from_stats_list(self, rms_stats_list: List[RMSStats]):
-    for rms_stats in rms_stats_list:
+    rms_stats = combine_rms_stats_list(rms_stats_list)
+    if rms_stats is not None:
       self.update_from_stats(rms_stats)
 
   def update_from_stats(self, rms_stats: RMSStats):
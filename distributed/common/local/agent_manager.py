@@ -38,7 +38,9 @@ class AgentManager(ManagerBase):
   def get_agents(self):
     return self.agents
 
-  def destroy_agents(self):
+  def destroy_agents(self, timeout=10):
+    ids = [a.close_buffer.remote() for a in self.agents]
+    ray.wait(ids, num_returns=len(ids), timeout=timeout)
     for a in self.agents:
       ray.kill(a)
     self.agents = None
@@ -3,6 +3,7 @@ from typing import List, Union
 import numpy as np
 import ray
 
+from ..remote.inference_server import InferenceServer
 from ..remote.parameter_server import ParameterServer
 from ..remote.runner import MultiAgentRunner
 from tools.log import do_logging
@@ -23,6 +24,7 @@ class RunnerManager(ManagerBase):
     self.monitor = monitor
     self.RemoteRunner = MultiAgentRunner.as_remote(**ray_config)
     self.runners = None
+    self.inference_server = None
 
   """ Runner Management """
   def build_runners(
@@ -42,6 +44,14 @@ class RunnerManager(ManagerBase):
     else:
       config = configs
       configs = AttrDict2dict(configs)
+    if config.runner.get('inference_server', False) and not evaluation:
+      RemoteServer = InferenceServer.as_remote(
+        **config.ray_config.get('inference_server', {}))
+      self.inference_server = RemoteServer.remote(
+        configs, 
+        n_runners=config.runner.n_runners, 
+        max_latency=config.runner.get('max_inference_latency', .005), 
+      )
     self.runners: List[MultiAgentRunner] = [
       self.RemoteRunner.remote(
         i,
@@ -50,7 +60,8 @@ class RunnerManager(ManagerBase):
         parameter_server=self.parameter_server, 
         remote_buffers=remote_buffers, 
         active_models=active_models, 
-        monitor=self.monitor)
+        monitor=self.monitor, 
+        inference_server=self.inference_server)
       for i in range(config.runner.n_runners)
     ]
   
@@ -58,10 +69,16 @@ class RunnerManager(ManagerBase):
   def n_runners(self):
     return len(self.runners) if hasattr(self, 'runners') else 0
 
-  def destroy_runners(self):
+  def destroy_runners(self, timeout=10):
+    # runners may have died, so they are waited for only up to timeout
+    ids = [r.close_shared_memory.remote() for r in self.runners]
+    ray.wait(ids, num_returns=len(ids), timeout=timeout)
     for r in self.runners:
       ray.kill(r)
     self.runners = None
+    if self.inference_server is not None:
+      ray.kill(self.inference_server)
+      self.inference_server = None
 
   def get_total_steps(self):
     return self._remote_call(self.runners, 'get_total_steps', wait=True)
@@ -7,7 +7,9 @@ from core.names import *
 from core.typing import ModelStats, ModelWeights
 from tools.log import do_logging
 from tools.timer import Timer
+from tools.tree_ops import tree_map
 from distributed.common.remote.base import RayBase
+from distributed.common.weights import WeightSender
 from .monitor import Monitor
 from .parameter_server import ParameterServer
 
@@ -38,6 +40,11 @@ class Agent(RayBase):
     )
     self.strategy: Strategy = elements.strategy
     self.buffer = elements.buffer
+    # time and bytes of the last publishing of weights
+    self._publish_stats = {}
+    self.train_signal = False
+    # publishes model weights during training
+    self._sender = WeightSender(self._send_model_weights)
 
   """ Model Management """
   def get_model_path(self):
@@ -59,24 +66,45 @@ class Agent(RayBase):
       self.aid, model_weights, model_weights.weights[TRAIN_STEP]
     )
     if wait:
-      ray.get(ids)
+      self._publish_stats = ray.get(ids)
       # do_logging(f'Weights published with train step {model_weights.weights["train_step"]}', flush=True)
 
+  def _publish_model_weights(self):
+    """ Hands the model weights over to the sender, replacing those not 
+    sent yet. Optimizer weights are left out as runners do not need them """
+    weights = self.strategy.get_weights(
+      opt_weights=False, aux_stats=False, train_step=True, env_step=False)
+    # torch state dicts refer to parameters updated in place by training
+    weights[MODEL] = tree_map(
+      lambda x: x.clone() if hasattr(x, 'clone') else x, weights[MODEL])
+    model_weights = ModelWeights(self.get_model_path(), weights)
+    self._sender.put(model_weights)
+
+  def _send_model_weights(self, model_weights: ModelWeights):
+    return ray.get(self.parameter_server.update_and_prepare_strategy.remote(
+      self.aid, model_weights, model_weights.weights[TRAIN_STEP]
+    ))
+
   """ Training """
   def start_training(self):
     self.train_signal = True
+    self._sender.start()
     self._training_thread = threading.Thread(target=self._training, daemon=True)
     self._training_thread.start()
 
   def stop_training(self):
     self.train_signal = False
     self._training_thread.join()
+    # pending weights are sent before the sender stops
+    self._sender.stop()
+    # the parameter server keeps the optimizer weights for saving
+    self.publish_weights(wait=True)
 
   def _training(self):
     while self.train_signal:
       stats = self.strategy.train()
       if stats:
-        self.publish_weights()
+        self._publish_model_weights()
         self._send_train_stats(stats)
 
     do_logging('Training terminated')
@@ -84,6 +112,8 @@ class Agent(RayBase):
   def _send_train_stats(self, stats):
     stats[TRAIN_STEP] = self.strategy.get_train_step()
     stats.update(Timer.all_stats())
+    stats.update(self._publish_stats)
+    stats.update(self._sender.stats)
     model_stats = ModelStats(self.get_model_path(), stats)
     self.monitor.store_train_stats.remote(model_stats)
 
@@ -106,9 +136,18 @@ class Agent(RayBase):
   def merge_data(self, rid, data, n):
     self.buffer.merge_data(rid, data, n)
 
+  def get_shared_memory_slots(self, rid, structure, specs):
+    return self.buffer.get_shared_memory_slots(rid, structure, specs)
+
   def clear_buffer(self):
     self.buffer.clear()
 
+  def close_buffer(self):
+    """ Releases resources of the buffer, e.g., its shared memory, 
+    before the agent is destroyed """
+    if hasattr(self.buffer, 'close'):
+      self.buffer.close()
+
   def is_buffer_ready(self):
     return self.buffer.ready()
 
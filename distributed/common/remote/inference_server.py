@@ -0,0 +1,191 @@
+import asyncio
+import collections
+from typing import Dict, List, Union
+import numpy as np
+
+from core.builder import ElementsBuilder
+from core.names import MODEL
+from core.typing import ModelPath, ModelWeights, dict2AttrDict
+from envs.func import get_env_stats
+from envs.typing import EnvOutput
+from tools.tree_ops import tree_flatten, tree_map, tree_unflatten
+from distributed.common.remote.base import RayBase
+from distributed.common.weights import WeightTransfer, decompress_model_weights
+
+
+class InferenceServer(RayBase):
+  """ Acts for the agents of all runners on a node
+
+  The server holds each snapshot of weights once, identified by its 
+  object id, so runners playing different versions of a model do not 
+  interfere. Snapshots are released when no runner uses them. Requests 
+  of the same agent, snapshot and method from different runners are 
+  gathered until all n_runners runners have sent theirs or max_latency 
+  seconds have passed since the first one. Then a single batched 
+  forward pass is run and the outputs are scattered back. Memory states 
+  are kept for each runner and model, and concatenated for the batched 
+  pass.
+  """
+  def __init__(
+    self,
+    configs: Union[List[dict], dict],
+    n_runners: int,
+    max_latency: float=.005,
+  ):
+    if isinstance(configs, list):
+      configs = [dict2AttrDict(c) for c in configs]
+      config = configs[0]
+    else:
+      config = dict2AttrDict(configs)
+      configs = [config]
+    super().__init__(config=config)
+
+    self.n_runners = n_runners
+    self.max_latency = max_latency
+    self.weight_transfer = config.parameter_server.get(
+      'weight_transfer', WeightTransfer.FULL)
+
+    env_config = dict2AttrDict(config.env, to_copy=True)
+    env_config.n_runners = 1
+    self.env_stats = get_env_stats(env_config)
+    self.n_agents = self.env_stats.n_agents
+    if len(configs) == 1:
+      configs = [dict2AttrDict(config, to_copy=True) for _ in range(self.n_agents)]
+    assert len(configs) == self.n_agents, (len(configs), self.n_agents)
+
+    builder = ElementsBuilder(config, self.env_stats)
+    self.agents = []
+    for config in configs:
+      elements = builder.build_acting_agent_from_scratch(
+        config,
+        env_stats=self.env_stats,
+        build_monitor=False,
+        to_restore=False
+      )
+      self.agents.append(elements.agent)
+
+    # object id -> ModelWeights for each agent
+    self._weights: List[Dict[str, ModelWeights]] = [{} for _ in range(self.n_agents)]
+    # rid -> object id of the weights each runner uses for each agent
+    self._runner_oids: List[Dict[int, str]] = [{} for _ in range(self.n_agents)]
+    # object id whose weights are set to each agent
+    self._current = [None for _ in range(self.n_agents)]
+    # (aid, object id, evaluation, method) -> [(rid, env output, future)]
+    self._requests = collections.defaultdict(list)
+    # (aid, rid, model path) -> memory states
+    self._states = {}
+
+  async def set_model_weights(self, aid: int, rid: int, mids: List):
+    """ Sets the weights runner rid uses for agent aid. The id of 
+    ModelWeights is received in a list, so that it is not resolved by 
+    ray unless the weights are new to the server """
+    mid = mids[0]
+    oid = mid.hex()
+    if oid not in self._weights[aid]:
+      model_weights: ModelWeights = await mid
+      assert MODEL in model_weights.weights, list(model_weights.weights)
+      weights = model_weights.weights.copy()
+      if hasattr(weights[MODEL], '__await__'):
+        weights[MODEL] = await weights[MODEL]
+      weights[MODEL] = decompress_model_weights(weights[MODEL], self.weight_transfer)
+      self._weights[aid][oid] = ModelWeights(model_weights.model, weights)
+    model = self._weights[aid][oid].model
+    prev_oid = self._runner_oids[aid].get(rid)
+    if prev_oid in self._weights[aid] and self._weights[aid][prev_oid].model != model:
+      self._states.pop((aid, rid, self._weights[aid][prev_oid].model), None)
+    self._runner_oids[aid][rid] = oid
+    self._release_weights(aid)
+    return model
+
+  async def infer(
+    self,
+    aid: int,
+    rid: int,
+    oid: str,
+    env_output: EnvOutput,
+    evaluation: bool=False,
+    method: str=None,
+  ):
+    """ Returns the outputs of agent aid running the weights of object 
+    id oid on env_output of runner rid, i.e., agent(env_output) if 
+    method is None, or getattr(agent, method)(env_output) otherwise """
+    key = (aid, oid, evaluation, method)
+    future = asyncio.get_running_loop().create_future()
+    requests = self._requests[key]
+    requests.append((rid, env_output, future))
+    if len(requests) >= self.n_runners:
+      self._flush(key, requests)
+    elif len(requests) == 1:
+      asyncio.get_running_loop().call_later(
+        self.max_latency, self._flush, key, requests)
+    return await future
+
+  def reset_states(self, rid: int=None):
+    if rid is None:
+      self._states = {}
+    else:
+      for k in [k for k in self._states if k[1] == rid]:
+        del self._states[k]
+
+  """ Implementation """
+  def _flush(self, key, requests):
+    # requests may have been flushed when they are complete
+    if self._requests.get(key) is not requests:
+      return
+    del self._requests[key]
+    aid, oid, evaluation, method = key
+    rids, env_outputs, futures = zip(*requests)
+    try:
+      agent, model = self._set_strategy(aid, oid)
+      sizes = [len(o.reset) for o in env_outputs]
+      bounds = np.cumsum([0] + sizes)
+      env_output = _concat(env_outputs)
+      agent.set_states(self._get_states(agent, aid, model, rids, sizes))
+      if method is None:
+        outs = agent(env_output, evaluation=evaluation)
+      else:
+        outs = getattr(agent, method)(env_output)
+      self._set_states(agent.get_states(), aid, model, rids, bounds)
+      for f, start, end in zip(futures, bounds[:-1], bounds[1:]):
+        f.set_result(_slice(outs, start, end))
+    except Exception as e:
+      for f in futures:
+        f.set_exception(e)
+
+  def _set_strategy(self, aid, oid):
+    agent = self.agents[aid]
+    model_weights = self._weights[aid][oid]
+    if self._current[aid] != oid:
+      agent.set_strategy(model_weights)
+      self._current[aid] = oid
+    return agent, model_weights.model
+
+  def _release_weights(self, aid):
+    """ Releases weights no runner uses """
+    used = set(self._runner_oids[aid].values())
+    for oid in [oid for oid in self._weights[aid] if oid not in used]:
+      del self._weights[aid][oid]
+
+  def _get_states(self, agent, aid, model, rids, sizes):
+    states = [self._states.get((aid, rid, model)) for rid in rids]
+    if all(s is None for s in states):
+      return None
+    states = [agent.model.get_initial_state(n) if s is None else s
+      for s, n in zip(states, sizes)]
+    return _concat(states)
+
+  def _set_states(self, state, aid, model, rids, bounds):
+    if state is None:
+      return
+    for rid, start, end in zip(rids, bounds[:-1], bounds[1:]):
+      self._states[(aid, rid, model)] = _slice(state, start, end)
+
+
+def _slice(tree, start, end):
+  return tree_map(lambda x: x[start:end] if np.ndim(x) > 0 else x, tree)
+
+
+def _concat(trees):
+  leaves, structure = zip(*[tree_flatten(t) for t in trees])
+  leaves = [None if v[0] is None else np.concatenate(v) for v in zip(*leaves)]
+  return tree_unflatten(structure[0], leaves)
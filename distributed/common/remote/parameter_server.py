@@ -21,6 +21,7 @@ from tools import yaml_op
 from distributed.common.names import *
 from distributed.common.typing import *
 from distributed.common.remote.payoff import PayoffManager
+from distributed.common.weights import WeightSnapshots, WeightTransfer
 from distributed.common.utils import divide_runners, reset_policy_head
 
 
@@ -68,6 +69,11 @@ class ParameterServer(RayBase):
     self.pool_path = os.path.join(self.pool_dir, f'{self.pool_name}.yaml')
 
     self._params: List[Dict[ModelPath, Dict]] = [{} for _ in range(self.n_agents)]
+    # weights are published to runners through versioned snapshots
+    self._snapshots = WeightSnapshots(
+      self.config.get('weight_transfer', WeightTransfer.FULL), 
+      self.config.get('max_weight_snapshots', 16)
+    )
     self.prepared_strategies: List[List[ModelWeights]] = \
       [[None for _ in range(self.n_agents)] for _ in range(self.n_runners)]
     self._reset_ready()
@@ -182,6 +188,7 @@ class ParameterServer(RayBase):
         n_online_runners=self._n_online_runners, 
         n_agent_runners=self._n_agent_runners, 
       )
+    stats.update(self.payoff_manager.get_cache_stats())
 
     return stats
 
@@ -261,7 +268,7 @@ class ParameterServer(RayBase):
               for k in [MODEL, TRAIN_STEP, ANCILLARY]
               if k in self._params[i][m]
             }
-          mids.append(ray.put(ModelWeights(m, weights)))
+          mids.append(self._snapshots.put(m, weights))
       return mids
 
     def get_historical_mids(aid, mid, model_weights: ModelWeights):
@@ -292,10 +299,10 @@ class ParameterServer(RayBase):
         self._ready[rid] = True
 
     def prepare_models(aid, model_weights: ModelWeights):
-      model_weights.weights.pop(OPTIMIZER)
+      model_weights.weights.pop(OPTIMIZER, None)
       model_weights.weights[ANCILLARY] = \
         self._params[aid][model_weights.model].get(ANCILLARY, RMSStats({}, None))
-      mid = ray.put(model_weights)
+      mid = self._snapshots.put(model_weights.model, model_weights.weights)
 
       # prepare the most recent model for online runners
       prepare_recent_models(aid, mid, self._n_online_runners)
@@ -304,7 +311,8 @@ class ParameterServer(RayBase):
         prepare_historical_models(aid, mid, model_weights)
 
     assert self._models['active'][aid] == model_weights.model, (self._models['active'], model_weights.model)
-    assert set(model_weights.weights) == set([MODEL, OPTIMIZER, TRAIN_STEP]), list(model_weights.weights)
+    # optimizer weights are only sent when they are to be saved
+    assert set(model_weights.weights) - set([OPTIMIZER]) == set([MODEL, TRAIN_STEP]), list(model_weights.weights)
     assert aid == get_aid(model_weights.model.model_name), (aid, model_weights.model)
     
     self._params[aid][model_weights.model].update(model_weights.weights)
@@ -312,6 +320,10 @@ class ParameterServer(RayBase):
     prepare_models(aid, model_weights)
     # do_logging(f'Receiving weights of train step {model_weights.weights["train_step"]}')
 
+    stats = self._snapshots.get_stats()
+    stats['publish/version'] = self._snapshots.get_version(model_weights.model)
+    return stats
+
   def update_aux_stats(self, aid, model_weights: ModelWeights):
     assert len(model_weights.weights) == 1, list(model_weights.weights)
     assert ANCILLARY in model_weights.weights, list(model_weights.weights)
@@ -510,6 +522,14 @@ class ParameterServer(RayBase):
     self.payoff_manager.update_payoffs(models, scores)
     self.payoff_manager.save(to_print=False)
 
+  def update_payoffs_batch(
+    self, 
+    models_batch: List[List[ModelPath]], 
+    scores_batch: List[List[List[float]]]
+  ):
+    self.payoff_manager.update_payoffs_batch(models_batch, scores_batch)
+    self.payoff_manager.save(to_print=False)
+
   def _update_opp_distributions(self, aid, model: ModelPath):
     assert isinstance(model, ModelPath), model
     payoffs, weights, self._opp_dist[model] = self.payoff_manager.\
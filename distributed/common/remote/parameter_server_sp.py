@@ -25,6 +25,7 @@ from tools import yaml_op
 from distributed.common.names import *
 from distributed.common.typing import *
 from distributed.common.remote.payoff import PayoffManager
+from distributed.common.weights import WeightSnapshots, WeightTransfer
 from distributed.common.utils import *
 
 
@@ -80,6 +81,11 @@ class SPParameterServer(RayBase):
     self.pool_path = os.path.join(self.pool_dir, f'{self.pool_name}.yaml')
 
     self._params: Dict[ModelPath, Dict] = {}
+    # weights are published to runners through versioned snapshots
+    self._snapshots = WeightSnapshots(
+      self.config.get('weight_transfer', WeightTransfer.FULL), 
+      self.config.get('max_weight_snapshots', 16)
+    )
     self.prepared_strategies: List[List[ModelWeights]] = \
       [[None for _ in range(2)] for _ in range(self.n_runners)]
     self._reset_ready()
@@ -201,6 +207,7 @@ class SPParameterServer(RayBase):
         n_online_runners=self._n_online_runners, 
         n_agent_runners=self._n_agent_runners, 
       )
+    stats.update(self.payoff_manager.get_cache_stats())
 
     return stats
 
@@ -255,7 +262,8 @@ class SPParameterServer(RayBase):
   ):
     assert aid == 0, aid
     assert self._models[ModelType.ACTIVE] == model_weights.model, (self._models[ModelType.ACTIVE], model_weights.model)
-    assert set(model_weights.weights) == set([MODEL, OPTIMIZER, TRAIN_STEP]), list(model_weights.weights)
+    # optimizer weights are only sent when they are to be saved
+    assert set(model_weights.weights) - set([OPTIMIZER]) == set([MODEL, TRAIN_STEP]), list(model_weights.weights)
     assert aid == get_aid(model_weights.model.model_name), (aid, model_weights.model)
     
     self._params[model_weights.model].update(model_weights.weights)
@@ -264,6 +272,10 @@ class SPParameterServer(RayBase):
     self._prepare_models(model_weights)
     assert all(self._ready), self._ready
 
+    stats = self._snapshots.get_stats()
+    stats['publish/version'] = self._snapshots.get_version(model_weights.model)
+    return stats
+
   def _put_model_weights(self, model):
     if model in self._rule_strategies:
       # rule-based strategy
@@ -277,7 +289,7 @@ class SPParameterServer(RayBase):
         for k in [MODEL, TRAIN_STEP, ANCILLARY]
         if k in self._params[model]
       }
-    mid = ray.put(ModelWeights(model, weights))
+    mid = self._snapshots.put(model, weights)
     return mid
 
   def _get_historical_mids(self, mid, model):
@@ -301,10 +313,10 @@ class SPParameterServer(RayBase):
       self._ready[rid] = True
 
   def _prepare_models(self, model_weights: ModelWeights):
-    model_weights.weights.pop(OPTIMIZER)
+    model_weights.weights.pop(OPTIMIZER, None)
     model_weights.weights[ANCILLARY] = \
       self._params[model_weights.model].get(ANCILLARY, RMSStats([], None))
-    mid = ray.put(model_weights)
+    mid = self._snapshots.put(model_weights.model, model_weights.weights)
 
     # prepare the most recent models for online runners
     self._prepare_recent_models(mid)
@@ -499,6 +511,14 @@ class SPParameterServer(RayBase):
     self.payoff_manager.update_payoffs(models, scores)
     self.payoff_manager.save(to_print=False)
 
+  def update_payoffs_batch(
+    self, 
+    models_batch: List[List[ModelPath]], 
+    scores_batch: List[List[List[float]]]
+  ):
+    self.payoff_manager.update_payoffs_batch(models_batch, scores_batch)
+    self.payoff_manager.save(to_print=False)
+
   def _compute_opp_distributions(self, model: ModelPath):
     assert isinstance(model, ModelPath), model
     payoffs, weights, opp_dists = self.payoff_manager.\
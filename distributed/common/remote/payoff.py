@@ -25,19 +25,25 @@ class PayoffManager:
       self.payoff_table = SelfPlayPayoffTableWithModel(
         step_size=self.config.step_size, 
         dir=model_dir, 
-        name=name
+        name=name, 
+        compact_interval=self.config.get('compact_interval', 100), 
       )
     else:
       self.payoff_table = PayoffTableWithModel(
         n_agents=self.n_agents, 
         step_size=self.config.step_size, 
         dir=model_dir, 
-        name=name
+        name=name, 
+        compact_interval=self.config.get('compact_interval', 100), 
       )
 
     self.sampling_strategy = select_sampling_strategy(
       **self.config.sampling_strategy,
     )
+    # (aid, model, prioritize_unmet) -> (payoff version, opponent distribution)
+    self._opp_dist_cache = {}
+    self.n_cache_hits = 0
+    self.n_cache_misses = 0
 
   def size(self, aid: int=0):
     if self.self_play:
@@ -87,6 +93,15 @@ class PayoffManager:
     assert len(models) == self.n_agents, (models, self.n_agents)
     self.payoff_table.update(models, scores)
 
+  def update_payoffs_batch(
+    self, 
+    models_batch: List[List[ModelPath]], 
+    scores_batch: List[Union[List[float], List[List[float]]]]
+  ):
+    for models in models_batch:
+      assert len(models) == self.n_agents, (models, self.n_agents)
+    self.payoff_table.update_batch(models_batch, scores_batch)
+
   def get_payoffs_for_model(self, aid: int, model: ModelPath):
     if self.self_play:
       assert aid == 0, aid
@@ -101,7 +116,40 @@ class PayoffManager:
     model: ModelPath, 
     prioritize_unmet: bool=True
   ):
-    """ Get the distribution of payoffs for model of the agent of aid """
+    """ Get the distribution of payoffs for model of the agent of aid 
+
+    Results are cached until the payoffs of model change
+    """
+    if self.self_play:
+      assert aid == 0, aid
+      version = self.payoff_table.get_payoff_version(model)
+    else:
+      version = self.payoff_table.get_payoff_version(aid, model)
+    key = (aid, model, prioritize_unmet)
+    cached = self._opp_dist_cache.get(key)
+    if cached is not None and cached[0] == version:
+      self.n_cache_hits += 1
+      results = cached[1]
+    else:
+      self.n_cache_misses += 1
+      results = self._compute_opponent_distribution(aid, model, prioritize_unmet)
+      self._opp_dist_cache[key] = (version, results)
+    # callers may modify the results in place
+    return tuple(x.copy() for x in results)
+
+  def get_cache_stats(self):
+    return AttrDict(
+      opp_dist_cache_hits=self.n_cache_hits, 
+      opp_dist_cache_misses=self.n_cache_misses, 
+    )
+
+  """ Implementations """
+  def _compute_opponent_distribution(
+    self, 
+    aid: int, 
+    model: ModelPath, 
+    prioritize_unmet: bool
+  ):
     if self.self_play:
       assert aid == 0, aid
       payoffs, weights, dists = self.sampling_strategy(
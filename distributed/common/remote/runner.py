@@ -13,9 +13,12 @@ from core.typing import ModelStats, ModelWeights, ModelPath, dict2AttrDict
 from envs.func import create_env
 from envs.typing import EnvOutput
 from envs.utils import divide_env_output
+from replay.ds.shared_memory import SharedMemoryWriter, get_specs
 from tools.pickle import set_weights_for_agent
+from tools.tree_ops import tree_flatten
 from tools.timer import Timer, timeit
 from distributed.common.remote.base import RayBase
+from distributed.common.weights import WeightTransfer, resolve_model_weights
 from .parameter_server import ParameterServer
 from .monitor import Monitor
 
@@ -33,6 +36,7 @@ class MultiAgentRunner(RayBase):
     remote_buffers: List[RayBase]=None, 
     active_models: List[ModelPath]=None, 
     monitor: Monitor=None,
+    inference_server: RayBase=None, 
   ):
     if isinstance(configs, list):
       configs = [dict2AttrDict(c) for c in configs]
@@ -73,6 +77,14 @@ class MultiAgentRunner(RayBase):
     self.current_models: List[ModelPath] = [None for _ in range(self.n_agents)]
     self.is_agent_active: List[bool] = [False for _ in range(self.n_agents)]
     self.monitor: Monitor = monitor
+    # agents whose actions are inferred by the inference server
+    self.inference_server = inference_server
+    self.is_agent_served: List[bool] = [False for _ in range(self.n_agents)]
+    # object ids of the weights set to agents, which are versioned 
+    # snapshots shared by runners, see WeightSnapshots
+    self.strategy_ids: List[str] = [None for _ in range(self.n_agents)]
+    self.weight_transfer = config.parameter_server.get(
+      'weight_transfer', WeightTransfer.FULL)
 
     self.env_output = self.env.output()
     if self.self_play:
@@ -108,6 +120,9 @@ class MultiAgentRunner(RayBase):
     self.agents: List[Agent] = []
     self.buffers: List[Buffer] = []
     self.rms: List[RMS] = []
+    # transport of data to remote buffers, object or shm
+    self.transport = config.buffer.get('transport', 'object')
+    self._shm_writers = [SharedMemoryWriter() for _ in range(self.n_agents)]
 
     for aid, config in enumerate(configs):
       config.model.seed += self.id * SEED_MULTIPLIER
@@ -181,6 +196,14 @@ class MultiAgentRunner(RayBase):
     self.run_signal = False
     self._running_thread.join()
 
+  def close_shared_memory(self):
+    """ Releases the shared memory of remote buffers before the runner 
+    is destroyed """
+    if getattr(self, 'run_signal', False):
+      self.stop_running()
+    for writer in self._shm_writers:
+      writer.close()
+
   def run_loop(self):
     mids = None
     while self.run_signal:
@@ -191,13 +214,36 @@ class MultiAgentRunner(RayBase):
   def run_with_model_weights(self, mids: List[ModelWeights]):
     @timeit
     def set_strategies(mids):
+      server_ids = []
       for aid, mid in enumerate(mids):
+        if mid.hex() == self.strategy_ids[aid]:
+          # the agent already holds this version of weights
+          self.is_agent_active[aid] = self.current_models[aid] in self.active_models
+          continue
+        # model weights are a reference in the snapshot, resolved only if used
         model_weights = ray.get(mid)
         self.is_agent_active[aid] = model_weights.model in self.active_models
         self.current_models[aid] = model_weights.model
+        self.strategy_ids[aid] = mid.hex()
         assert set(model_weights.weights).issubset(set([MODEL, ANCILLARY, TRAIN_STEP])) or set(model_weights.weights) == set(['aid', 'iid', 'path']), set(model_weights.weights)
+        self.is_agent_served[aid] = self.inference_server is not None \
+          and MODEL in model_weights.weights
+        if self.is_agent_served[aid]:
+          # model weights are held by the inference server, the 
+          # local agent keeps the rest for data processing. Only the 
+          # forward passes are centralized: the local model is still 
+          # built, for buffers and in case the agent is not served later
+          server_ids.append(
+            self.inference_server.set_model_weights.remote(aid, self.id, [mid]))
+          model_weights = ModelWeights(model_weights.model, {
+            k: v for k, v in model_weights.weights.items() if k != MODEL})
+        elif MODEL in model_weights.weights:
+          model_weights.weights[MODEL] = resolve_model_weights(
+            model_weights.weights[MODEL], self.weight_transfer)
         self.agents[aid].set_strategy(model_weights, env=self.env)
         # do_logging(f'Runner {self.id} receives weights of train step {model_weights.weights["train_step"]}')
+      # weights must reach the server before requests
+      ray.get(server_ids)
       if self.self_play:
         self.is_agent_active = [True, False]
       assert any(self.is_agent_active), (self.active_models, self.current_models)
@@ -286,23 +332,53 @@ class MultiAgentRunner(RayBase):
       model = ModelPath(config['root_dir'], config['model_name'])
       set_weights_for_agent(agent, model, name=name)
       self.current_models[aid] = model
+      self.is_agent_served[aid] = False
+      self.strategy_ids[aid] = None
 
   def set_weights_from_model_paths(self, model_paths: List[ModelPath], name='params'):
     assert len(model_paths) == len(self.current_models) == self.n_agents, (model_paths, self.current_models)
     for aid, (model, agent) in enumerate(zip(model_paths, self.agents)):
       set_weights_for_agent(agent, model, name=name)
       self.current_models[aid] = model
+      self.is_agent_served[aid] = False
+      self.strategy_ids[aid] = None
 
   def set_running_steps(self, n_steps):
     self.n_steps = n_steps
 
   """ Implementations """
+  @timeit
+  def _infer(self, aids, agent_env_outs: List[EnvOutput], method=None):
+    """ Returns the outputs of agents aids, i.e., agent(env_out) if 
+    method is None, or getattr(agent, method)(env_out) otherwise. 
+    Requests of served agents are sent to the inference server first, 
+    so they are batched with other runners' while the others run locally """
+    ids = {
+      aid: self.inference_server.infer.remote(
+        aid, self.id, self.strategy_ids[aid], agent_env_outs[aid], 
+        evaluation=self.evaluation, method=method)
+      for aid in aids if self.is_agent_served[aid]
+    }
+    outs = {}
+    for aid in aids:
+      if aid not in ids:
+        agent = self.agents[aid]
+        if method is None:
+          outs[aid] = agent(agent_env_outs[aid], evaluation=self.evaluation)
+        else:
+          outs[aid] = getattr(agent, method)(agent_env_outs[aid])
+    outs.update(zip(ids, ray.get(list(ids.values()))))
+    return [outs[aid] for aid in aids]
+
   def _reset_local_buffers(self):
     [b.reset() for b in self.buffers]
 
   def _reset(self):
     self.env_output = self.env.reset()
     self._reset_local_buffers()
+    if any(self.is_agent_served):
+      # memory states kept by the server are stale after resetting all envs
+      ray.get(self.inference_server.reset_states.remote(self.id))
     return self.env_output
 
   def _run_impl_ma(self, stop_fn, to_store_data: bool=False):
@@ -310,10 +386,7 @@ class MultiAgentRunner(RayBase):
     def agents_infer(agents: List[Agent], agent_env_outs: List[EnvOutput]):
       assert len(agent_env_outs)  == len(agents), (len(agent_env_outs), len(agents))
       action, terms = [], []
-      for aid in range(self.n_agents):
-        agent = agents[aid]
-        env_out = agent_env_outs[aid]
-        a, t = agent(env_out, evaluation=self.evaluation)
+      for a, t in self._infer(range(self.n_agents), agent_env_outs):
         action.append(a)
         terms.append(t)
       return action, terms
@@ -370,7 +443,8 @@ class MultiAgentRunner(RayBase):
           if self.is_agent_active[aid]:
             assert buffer.is_full(), len(buffer)
             if self.algo_type == 'onpolicy':
-              value = agent.compute_value(prev_agent_env_output[aid])
+              value, = self._infer(
+                [aid], prev_agent_env_output, method='compute_value')
               rid, data, n = buffer.retrieve_all_data({
                 'value': value,
                 'state_reset': out.reset
@@ -379,10 +453,7 @@ class MultiAgentRunner(RayBase):
               rid, data, n = buffer.retrieve_all_data()
             self._update_rms_from_batch(aid, data)
             data = self._normalize_data(agent.actor, data)
-            if self.self_play:
-              self.remote_buffers[0].merge_data.remote(rid, data, n)
-            else:
-              self.remote_buffers[aid].merge_data.remote(rid, data, n)
+            self._send_data_to_remote_buffer(aid, rid, data, n)
             sent = True
       else:
         sent = True
@@ -407,13 +478,11 @@ class MultiAgentRunner(RayBase):
     @timeit
     def agents_infer(agents: List[Agent], agent_env_outs: List[EnvOutput]):
       assert len(agent_env_outs)  == len(agents), (len(agent_env_outs), len(agents))
+      aids = [aid for aid, o in enumerate(agent_env_outs) if len(o.obs) != 0]
+      outs = dict(zip(aids, self._infer(aids, agent_env_outs)))
       action, terms = [], []
-      for aid, (agent, o) in enumerate(zip(agents, agent_env_outs)):
-        if len(o.obs) == 0:
-          action.append([])
-          terms.append([])
-          continue
-        a, t = agent(o, evaluation=self.evaluation)
+      for aid in range(self.n_agents):
+        a, t = outs.get(aid, ([], []))
         action.append(a)
         terms.append(t)
       return action, terms
@@ -533,10 +602,7 @@ class MultiAgentRunner(RayBase):
             rid, data, n = buffer.retrieve_all_data()
             self._update_rms_from_batch(aid, data)
             data = self._normalize_data(self.agents[aid].actor, data)
-            if self.self_play:
-              self.remote_buffers[0].merge_data.remote(rid, data, n)
-            else:
-              self.remote_buffers[aid].merge_data.remote(rid, data, n)
+            self._send_data_to_remote_buffer(aid, rid, data, n)
             # assert np.all(np.any(data.action_mask, -1))
 
     step = 0
@@ -624,6 +690,25 @@ class MultiAgentRunner(RayBase):
 
     return len(done_env_ids)
 
+  @timeit
+  def _send_data_to_remote_buffer(self, aid, rid, data, n):
+    remote_buffer = self.remote_buffers[0 if self.self_play else aid]
+    if self.transport == 'shm':
+      # write data into the shared memory of the remote buffer and 
+      # send only the slot, avoiding serialization and copies of data
+      leaves, structure = tree_flatten(data)
+      writer = self._shm_writers[aid]
+      if not writer.is_connected():
+        info = ray.get(remote_buffer.get_shared_memory_slots.remote(
+          rid, structure, get_specs(leaves)))
+        try:
+          writer.connect(info)
+        except FileNotFoundError:
+          raise RuntimeError(
+            'Shared memory transport requires runners to be on the same node as the learner')
+      data = writer.write(leaves)
+    remote_buffer.merge_data.remote(rid, data, n)
+
   def _send_aux_stats(self, aid):
     aux_stats = self.rms[aid].get_rms_stats()
     self.rms[aid].reset_rms_stats()
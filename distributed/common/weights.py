@@ -0,0 +1,196 @@
+import collections
+import threading
+import time
+import numpy as np
+import ray
+
+from core.names import MODEL
+from core.typing import ModelPath, ModelWeights
+from tools.log import do_logging
+from tools.tree_ops import tree_flatten, tree_map
+
+
+class WeightTransfer:
+  FULL = 'full'
+  FP16 = 'fp16'
+
+
+class WeightSnapshots:
+  """ Versioned snapshots of model weights in the object store
+
+  A model is put into the object store only when its weights differ
+  from those of its last snapshot, so all runners playing a model share
+  one object per version and may skip setting weights whose object
+  they already hold. Weights are compared by the identity of their
+  values, which are replaced rather than modified in place by the
+  parameter server. At most max_snapshots models are kept, the least
+  recently published are released first, while their versions are kept
+  so that they keep increasing when models are published again.
+
+  Model weights are put as a separate object referred to by the 
+  snapshot, so that resolving a snapshot does not deserialize them. 
+  Those who use them resolve them by resolve_model_weights.
+  """
+  def __init__(self, transfer=WeightTransfer.FULL, max_snapshots=16):
+    assert transfer in (WeightTransfer.FULL, WeightTransfer.FP16), transfer
+    self.transfer = transfer
+    self.max_snapshots = max_snapshots
+    # model -> (values of weights, object id)
+    self._snapshots = collections.OrderedDict()
+    # model -> version of its latest snapshot
+    self._versions = collections.defaultdict(int)
+    self._stats = collections.defaultdict(float)
+
+  def put(self, model: ModelPath, weights: dict):
+    """ Returns the object id of the snapshot of weights of model """
+    values = dict(weights)
+    if model in self._snapshots:
+      self._snapshots.move_to_end(model)
+      prev_values, mid = self._snapshots[model]
+      if _is_same(prev_values, values):
+        self._stats['n_reused'] += 1
+        return mid
+
+    start = time.time()
+    nbytes = 0
+    if MODEL in weights:
+      weights = weights.copy()
+      model_weights = compress_model_weights(weights[MODEL], self.transfer)
+      nbytes = compute_nbytes(model_weights)
+      weights[MODEL] = ray.put(model_weights)
+    mid = ray.put(ModelWeights(model, weights))
+    self._snapshots[model] = (values, mid)
+    self._versions[model] += 1
+    self._snapshots.move_to_end(model)
+    while len(self._snapshots) > self.max_snapshots:
+      self._snapshots.popitem(last=False)
+
+    self._stats['time'] += time.time() - start
+    self._stats['bytes'] += nbytes
+    self._stats['n_published'] += 1
+    return mid
+
+  def get_version(self, model: ModelPath):
+    return self._versions.get(model, 0)
+
+  def clear(self):
+    self._snapshots.clear()
+
+  def get_stats(self):
+    """ Returns and resets the time and bytes of publishing """
+    stats = {f'publish/{k}': v for k, v in self._stats.items()}
+    self._stats = collections.defaultdict(float)
+    return stats
+
+
+class WeightSender:
+  """ Sends weights by send_fn on a background thread
+
+  Only the latest weights are sent: weights put while others are being 
+  sent replace those waiting to be sent. Errors raised by send_fn are 
+  logged and counted without stopping the thread. Weights waiting when 
+  stop is called are sent before it returns.
+  """
+  def __init__(self, send_fn):
+    self._send_fn = send_fn
+    self._cond = threading.Condition()
+    self._pending = None
+    self._n_coalesced = 0
+    self._n_errors = 0
+    self._running = False
+    self._thread = None
+    self.stats = {}
+
+  def start(self):
+    assert self._thread is None, 'Sender has already started'
+    self._running = True
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def put(self, weights):
+    with self._cond:
+      if self._pending is not None:
+        self._n_coalesced += 1
+      self._pending = weights
+      self._cond.notify()
+
+  def stop(self):
+    if self._thread is None:
+      return
+    with self._cond:
+      self._running = False
+      self._cond.notify()
+    self._thread.join()
+    self._thread = None
+
+  def _run(self):
+    while True:
+      with self._cond:
+        self._cond.wait_for(lambda: self._pending is not None or not self._running)
+        weights = self._pending
+        n_coalesced = self._n_coalesced
+        self._pending = None
+        self._n_coalesced = 0
+      if weights is None:
+        break
+      try:
+        stats = dict(self._send_fn(weights) or {})
+      except Exception as e:
+        self._n_errors += 1
+        do_logging(f'Failed to send weights: {e}', level='error')
+        stats = dict(self.stats)
+      stats['publish/n_coalesced'] = n_coalesced
+      stats['publish/n_errors'] = self._n_errors
+      self.stats = stats
+
+    do_logging('Sending terminated')
+
+
+def compress_model_weights(weights, transfer=WeightTransfer.FP16):
+  """ Casts float32 weights to float16 for transfer """
+  if transfer == WeightTransfer.FULL:
+    return weights
+  return tree_map(lambda x: _cast(x, np.float32, np.float16), weights)
+
+
+def decompress_model_weights(weights, transfer=WeightTransfer.FP16):
+  """ Restores float32 weights sent by compress_model_weights """
+  if transfer == WeightTransfer.FULL:
+    return weights
+  return tree_map(lambda x: _cast(x, np.float16, np.float32), weights)
+
+
+def resolve_model_weights(weights, transfer=WeightTransfer.FP16):
+  """ Resolves model weights of a snapshot put by WeightSnapshots """
+  if isinstance(weights, ray.ObjectRef):
+    weights = ray.get(weights)
+  return decompress_model_weights(weights, transfer)
+
+
+def compute_nbytes(weights):
+  leaves, _ = tree_flatten(weights)
+  nbytes = 0
+  for x in leaves:
+    if hasattr(x, 'nbytes'):
+      nbytes += x.nbytes
+    elif hasattr(x, 'element_size'):
+      nbytes += x.element_size() * x.nelement()
+  return nbytes
+
+
+""" Implementation """
+def _is_same(values, other_values):
+  return set(values) == set(other_values) and all(
+    v is other_values[k] for k, v in values.items())
+
+
+def _cast(x, src_dtype, dst_dtype):
+  if hasattr(x, 'is_floating_point'):
+    # torch tensors
+    import torch
+    src_dtype = getattr(torch, np.dtype(src_dtype).name)
+    dst_dtype = getattr(torch, np.dtype(dst_dtype).name)
+    return x.to(dst_dtype) if x.dtype == src_dtype else x
+  if getattr(x, 'dtype', None) == src_dtype:
+    return np.asarray(x).astype(dst_dtype)
+  return x
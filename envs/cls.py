@@ -113,6 +113,8 @@ class VecEnvBase:
     self._stats = self.env.stats()
     self._stats['n_runners'] = 1
     self._stats['n_envs'] = self.n_envs
+    # (env ids, outputs) sent but not received yet
+    self._ready = []
 
   def __getattr__(self, name):
     if name.startswith("_"):
@@ -137,14 +139,30 @@ class VecEnvBase:
     else:
       return out
 
+  def send(self, actions, env_ids=None):
+    """ Steps envs env_ids with actions batched in the same order. 
+    Envs are stepped in place, so recv always finds them ready """
+    env_ids = self._get_idxes(env_ids)
+    outs = self.step(actions, convert_batch=False, idxes=env_ids)
+    self._ready.append((env_ids, outs))
+
+  def recv(self, min_ready=None, convert_batch=True):
+    """ Returns ids and outputs of all envs stepped by send """
+    assert self._ready, 'No env has been sent actions'
+    env_ids, outs = zip(*self._ready)
+    self._ready = []
+    env_ids = np.concatenate(env_ids).astype(np.int64)
+    out = self.process_output(sum(outs, []), convert_batch=convert_batch)
+    return env_ids, out
+
   def combine_actions(self, actions):
     new_actions = [batch_dicts(a) for a in zip(*actions)]
     return new_actions
 
-  def divide_actions(self, actions):
+  def divide_actions(self, actions, n_envs=None):
     new_actions = [
       [{k: v if v.shape == () else v[i] for k, v in action.items()} for action in actions]
-      for i in range(self.n_envs)
+      for i in range(n_envs or self.n_envs)
     ]
     return new_actions
 
@@ -163,10 +181,11 @@ class VecEnv(VecEnvBase):
     out = self.process_output(out, convert_batch=convert_batch)
     return out
 
-  def step(self, actions, convert_batch=True, **kwargs):
-    actions = self.divide_actions(actions)
-    assert len(self.envs) == len(actions), (len(self.envs), len(actions))
-    outs = [e.step(a) for e, a in zip(self.envs, actions)]
+  def step(self, actions, convert_batch=True, idxes=None, **kwargs):
+    idxes = self._get_idxes(idxes)
+    actions = self.divide_actions(actions, len(idxes))
+    assert len(idxes) == len(actions), (len(idxes), len(actions))
+    outs = [self.envs[i].step(a) for i, a in zip(idxes, actions)]
     out = self.process_output(outs, convert_batch=convert_batch)
     return out
 
@@ -268,10 +287,11 @@ class MASimVecEnv(VecEnvBase):
 
     return self.process_output(out, convert_batch=convert_batch)
 
-  def step(self, actions, convert_batch=True, **kwargs):
+  def step(self, actions, convert_batch=True, idxes=None, **kwargs):
+    idxes = self._get_idxes(idxes)
     if isinstance(actions, (tuple, list)):
       actions = zip(*actions)
-    outs = [e.step(a) for e, a in zip(self.envs, actions)]
+    outs = [self.envs[i].step(a) for i, a in zip(idxes, actions)]
 
     return self.process_output(outs, convert_batch=convert_batch)
 
@@ -31,7 +31,11 @@ def create_env(
   no_remote=False, 
   reset_at_init=True
 ):
-  """ Creates an Env/VecEnv from config """
+  """ Creates an Env/VecEnv from config 
+  
+  Envs of a VecEnv are stepped in n_workers subprocesses if 
+  config.vec_env is 'subproc'
+  """
   config = config.copy()
   config.setdefault('seed', 1)
   config.setdefault('eid', config.seed)
@@ -51,7 +55,12 @@ def create_env(
         EnvType = VecEnv
     else:
       EnvType = Env
-    env = EnvType(config, env_fn, agents=agents)
+    if config.get('vec_env') == 'subproc' and EnvType in (VecEnv, MASimVecEnv):
+      # envs are stepped by subprocesses, see SubprocVecEnv
+      from envs.subproc_env import SubprocVecEnv
+      env = SubprocVecEnv(EnvType, config, env_fn)
+    else:
+      env = EnvType(config, env_fn, agents=agents)
   else:
     from envs.ray_env import RayVecEnv
     EnvType = VecEnv
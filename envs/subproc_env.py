@@ -0,0 +1,309 @@
+import collections
+import multiprocessing as mp
+from multiprocessing.connection import wait
+import traceback
+import numpy as np
+
+from core.typing import AttrDict2dict, dict2AttrDict
+from envs.cls import *
+from envs.utils import batch_env_output
+from tools.shared_memory import SharedArrays, get_specs
+from tools.tree_ops import tree_flatten, tree_unflatten
+from tools.utils import batch_dicts, convert_batch_with_func
+
+
+def _worker(conn, EnvType, config, env_fn):
+  env = EnvType(dict2AttrDict(config), env_fn)
+  # method name -> (shared arrays, rows of the worker)
+  outputs = {}
+  try:
+    while True:
+      cmd, name, args, kwargs = conn.recv()
+      try:
+        if cmd == 'call':
+          out = getattr(env, name)(*args, **kwargs)
+        elif cmd == 'shm_call':
+          out = getattr(env, name)(*args, **kwargs)
+          if name in outputs:
+            shm, rows = outputs[name]
+            leaves, _ = tree_flatten(out)
+            assert len(leaves) == len(shm.arrays), (name, len(leaves), len(shm.arrays))
+            for x, v in zip(shm.arrays, leaves):
+              x[rows] = v
+            out = None
+        elif cmd == 'connect':
+          handle, rows = args
+          outputs[name] = (SharedArrays.attach(handle), slice(*rows))
+          out = None
+        elif cmd == 'getattr':
+          out = getattr(env, name)
+        elif cmd == 'close':
+          env.close()
+          conn.send((True, None))
+          break
+        else:
+          raise ValueError(f'Unknown command: {cmd}')
+        conn.send((True, out))
+      except Exception:
+        conn.send((False, traceback.format_exc()))
+  except (KeyboardInterrupt, EOFError):
+    pass
+  finally:
+    for shm, _ in outputs.values():
+      shm.close()
+
+
+class SubprocVecEnv:
+  """ A VecEnv whose envs are stepped by n_workers subprocesses
+
+  Each worker owns a contiguous group of envs. Outputs of step, reset,
+  output and prev_obs for all envs are written by the workers into
+  shared memory laid out as the batched outputs, e.g., EnvOutput, so
+  the parent receives them without pickling. The shared arrays are
+  allocated after the first call of each method, whose outputs are
+  sent through pipes. Other methods and calls on a subset of envs,
+  e.g., info(idxes), are forwarded through pipes.
+
+  send and recv step envs asynchronously: recv returns as soon as
+  the envs of enough workers are ready, so slow envs do not hold back
+  the others. Readiness is tracked per worker, and n_workers=n_envs
+  gives per-env granularity.
+  """
+  def __init__(self, EnvType, config, env_fn=make_env):
+    config = AttrDict2dict(config)
+    self.env_type = 'VecEnv'
+    self.name = config['env_name']
+    self.n_envs = config.pop('n_envs', 1)
+    n_workers = min(config.pop('n_workers', None) or mp.cpu_count(), self.n_envs)
+    ctx = mp.get_context(config.pop('start_method', 'spawn'))
+    config.pop('vec_env', None)
+    config.setdefault('seed', 1)
+    config.setdefault('eid', config['seed'])
+
+    bounds = np.linspace(0, self.n_envs, n_workers+1).astype(np.int64)
+    self._rows = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+    self._worker_ids = np.repeat(np.arange(n_workers), np.diff(bounds))
+    self._local_ids = np.arange(self.n_envs) - bounds[self._worker_ids]
+
+    self._conns = []
+    self._processes = []
+    for start, end in self._rows:
+      config_i = config.copy()
+      config_i['n_envs'] = end - start
+      config_i['seed'] += start
+      config_i['eid'] += start
+      parent_conn, child_conn = ctx.Pipe()
+      p = ctx.Process(
+        target=_worker,
+        args=(child_conn, EnvType, config_i, env_fn),
+        daemon=True
+      )
+      p.start()
+      child_conn.close()
+      self._conns.append(parent_conn)
+      self._processes.append(p)
+
+    # method name -> (shared arrays, structure of outputs)
+    self._outputs = {}
+    # worker id -> ids of envs being stepped by send
+    self._pending = {}
+    self.max_episode_steps = self._getattr('max_episode_steps')
+    self._send(0, 'call', 'stats')
+    self._stats = self._recv(0)
+    self._stats['n_runners'] = 1
+    self._stats['n_envs'] = self.n_envs
+    self._closed = False
+
+  @property
+  def n_workers(self):
+    return len(self._conns)
+
+  def __getattr__(self, name):
+    # only picklable attributes of the first env group are accessible
+    if name.startswith("_"):
+      raise AttributeError(
+        "attempted to get missing private attribute '{}'".format(name)
+      )
+    return self._getattr(name)
+
+  def stats(self):
+    return dict2AttrDict(self._stats)
+
+  def random_action(self, *args, **kwargs):
+    actions = self._call_all('random_action')
+    return [batch_dicts(a, np.concatenate) for a in zip(*actions)]
+
+  def reset(self, idxes=None, convert_batch=True, **kwargs):
+    if idxes is None and convert_batch:
+      return self._shm_call('reset')
+    out = self._call_envs('reset', idxes, convert_batch=False)
+    return self._process_output(out, convert_batch)
+
+  def step(self, actions, convert_batch=True, **kwargs):
+    if not isinstance(actions, (list, tuple)):
+      actions = [actions]
+    actions = [[
+      {k: v if np.ndim(v) == 0 else v[start:end] for k, v in a.items()}
+      for a in actions] for start, end in self._rows]
+    if convert_batch:
+      return self._shm_call('step', actions)
+    out = self._call_all('step', actions, convert_batch=False)
+    return sum(out, [])
+
+  def send(self, actions, env_ids=None):
+    """ Starts stepping envs env_ids with actions batched in the same 
+    order without waiting for them. Envs of a worker being stepped 
+    can not be sent actions until they are received """
+    env_ids = np.arange(self.n_envs) if env_ids is None else np.asarray(env_ids)
+    if not isinstance(actions, (list, tuple)):
+      actions = [actions]
+    worker_ids = self._worker_ids[env_ids]
+    for wid in np.unique(worker_ids).tolist():
+      assert wid not in self._pending, \
+        f'Envs {self._pending[wid]} of worker {wid} are still being stepped'
+      mask = worker_ids == wid
+      worker_actions = [
+        {k: v if np.ndim(v) == 0 else v[mask] for k, v in a.items()}
+        for a in actions]
+      self._send(wid, 'call', 'step', worker_actions, 
+        convert_batch=False, idxes=self._local_ids[env_ids[mask]].tolist())
+      self._pending[wid] = env_ids[mask]
+
+  def recv(self, min_ready=None, convert_batch=True):
+    """ Waits until at least min_ready envs being stepped are ready, 
+    and returns ids and outputs of all ready envs. All envs being 
+    stepped are waited for if min_ready is None """
+    assert self._pending, 'No env has been sent actions'
+    n_pending = sum(len(ids) for ids in self._pending.values())
+    min_ready = n_pending if min_ready is None else min(min_ready, n_pending)
+    conn2wid = {id(self._conns[wid]): wid for wid in self._pending}
+    env_ids, outs = [], []
+    while len(env_ids) < min_ready:
+      for conn in wait([self._conns[wid] for wid in self._pending]):
+        wid = conn2wid[id(conn)]
+        outs += self._recv(wid)
+        env_ids += self._pending.pop(wid).tolist()
+    env_ids = np.array(env_ids, dtype=np.int64)
+    return env_ids, self._process_output(outs, convert_batch)
+
+  def manual_reset(self):
+    self._call_all('manual_reset')
+
+  def score(self, idxes=None, **kwargs):
+    return self._call_envs('score', idxes)
+
+  def epslen(self, idxes=None, **kwargs):
+    return self._call_envs('epslen', idxes)
+
+  def mask(self, idxes=None):
+    return np.stack(self._call_envs('mask', idxes))
+
+  def game_over(self):
+    return np.concatenate(self._call_all('game_over'))
+
+  def prev_obs(self, idxes=None, convert_batch=True):
+    if idxes is None and convert_batch:
+      return self._shm_call('prev_obs')
+    obs = self._call_envs('prev_obs', idxes, convert_batch=False)
+    if convert_batch:
+      obs = [convert_batch_with_func(o) for o in zip(*obs)]
+    return obs
+
+  def info(self, idxes=None, convert_batch=False):
+    info = self._call_envs('info', idxes)
+    if convert_batch:
+      info = batch_dicts(info)
+    return info
+
+  def prev_output(self, idxes=None, convert_batch=True):
+    out = self._call_envs('prev_output', idxes, convert_batch=False)
+    return self._process_output(out, convert_batch)
+
+  def output(self, idxes=None, convert_batch=True):
+    if idxes is None and convert_batch:
+      return self._shm_call('output')
+    out = self._call_envs('output', idxes, convert_batch=False)
+    return self._process_output(out, convert_batch)
+
+  def get_screen(self, size=None, convert_batch=True):
+    imgs = sum(self._call_all('get_screen', size=size, convert_batch=False), [])
+    if convert_batch:
+      imgs = np.stack(imgs)
+    return imgs
+
+  def close(self):
+    if self._closed:
+      return
+    self._closed = True
+    for wid in self._pending:
+      self._conns[wid].recv()
+    self._pending = {}
+    for conn in self._conns:
+      conn.send(('close', None, (), {}))
+    for conn in self._conns:
+      conn.recv()
+    for p in self._processes:
+      p.join()
+    for shm, _ in self._outputs.values():
+      shm.close()
+    self._outputs = {}
+
+  """ Implementation """
+  def _process_output(self, out, convert_batch):
+    if convert_batch:
+      return batch_env_output(out)
+    return out
+
+  def _send(self, wid, cmd, name, *args, **kwargs):
+    self._conns[wid].send((cmd, name, args, kwargs))
+
+  def _recv(self, wid):
+    success, out = self._conns[wid].recv()
+    if not success:
+      raise RuntimeError(f'Env worker {wid} failed:\n{out}')
+    return out
+
+  def _getattr(self, name):
+    self._send(0, 'getattr', name)
+    return self._recv(0)
+
+  def _call_all(self, name, worker_args=None, cmd='call', **kwargs):
+    """ Calls name of all workers. The i-th worker receives the i-th
+    element of worker_args as the positional argument if provided """
+    assert not self._pending, f'Envs {self._pending} are still being stepped'
+    for wid in range(self.n_workers):
+      args = () if worker_args is None else (worker_args[wid],)
+      self._send(wid, cmd, name, *args, **kwargs)
+    return [self._recv(wid) for wid in range(self.n_workers)]
+
+  def _call_envs(self, name, idxes, **kwargs):
+    """ Returns the list of outputs of envs idxes in order """
+    if idxes is None:
+      idxes = range(self.n_envs)
+    elif isinstance(idxes, int):
+      idxes = [idxes]
+    groups = collections.defaultdict(list)
+    for i in idxes:
+      groups[self._worker_ids[i]].append(int(self._local_ids[i]))
+    for wid, local_idxes in groups.items():
+      self._send(wid, 'call', name, idxes=local_idxes, **kwargs)
+    outs = {wid: list(self._recv(wid)) for wid in groups}
+    return [outs[self._worker_ids[i]].pop(0) for i in idxes]
+
+  def _shm_call(self, name, worker_args=None):
+    """ Calls name of all workers, whose outputs are laid out in
+    shared memory after the first call """
+    outs = self._call_all(name, worker_args, cmd='shm_call')
+    if name not in self._outputs:
+      leaves, structure = zip(*[tree_flatten(o) for o in outs])
+      leaves = [np.concatenate(v) for v in zip(*leaves)]
+      shm = SharedArrays(get_specs(leaves))
+      self._outputs[name] = (shm, structure[0])
+      for wid, rows in enumerate(self._rows):
+        self._send(wid, 'connect', name, shm.handle, rows)
+      for wid in range(self.n_workers):
+        self._recv(wid)
+      return tree_unflatten(structure[0], leaves)
+    shm, structure = self._outputs[name]
+    # copies stay valid after the next call overwrites shared memory
+    return tree_unflatten(structure, [x.copy() for x in shm.arrays])
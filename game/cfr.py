@@ -0,0 +1,373 @@
+import collections
+from typing import Dict
+import numpy as np
+
+from game.tabular_games import CHANCE
+
+
+class GameTree:
+  """ A game tree enumerated into flat arrays
+
+  Nodes are numbered in breadth-first order, so nodes of each depth
+  are contiguous and children of a node are contiguous and ordered as
+  their parents. Actions of each information set occupy contiguous
+  slots, in which regrets and strategies are stored.
+
+  Attributes:
+    parent: the parent of each node, -1 for the root
+    depth_bounds: nodes of depth d are in [depth_bounds[d], depth_bounds[d+1])
+    player: the player acting at each node, negative for chance and
+      terminal nodes
+    owner: the player acting at the parent of each node, n_players
+      if the parent is a chance node
+    slot: the slot of the action leading to each node from a decision
+      node, -1 otherwise
+    chance_prob: the probability of each node given its chance parent,
+      1 otherwise
+    returns: the returns of terminal nodes, zero for others
+    infoset_offset, infoset_size: the first slot and the number of
+      actions of each information set
+    slot_infoset: the information set of each slot
+  """
+  def __init__(self, game):
+    self.n_players = game.num_players()
+    parent, depth, player, slot, chance_prob, returns, infoset = \
+      [], [], [], [], [], [], []
+    # (player, information state) -> information set id
+    infoset_ids = {}
+    self.infoset_keys = []
+    self.infoset_actions = []
+    self.infoset_player = []
+    self.infoset_offset = []
+    self.infoset_depth = []
+    n_slots = 0
+
+    def add_node(p, d, s, prob):
+      parent.append(p)
+      depth.append(d)
+      slot.append(s)
+      chance_prob.append(prob)
+
+    queue = collections.deque([(0, game.new_initial_state())])
+    add_node(-1, 0, -1, 1.)
+    while queue:
+      node, state = queue.popleft()
+      assert not state.is_simultaneous_node(), 'Simultaneous games are not supported'
+      d = depth[node] + 1
+      if state.is_terminal():
+        player.append(state.current_player())
+        infoset.append(-1)
+        returns.append(state.returns())
+        continue
+      returns.append([0.] * self.n_players)
+      if state.is_chance_node():
+        player.append(CHANCE)
+        infoset.append(-1)
+        for a, p in state.chance_outcomes():
+          queue.append((len(parent), state.child(a)))
+          add_node(node, d, -1, p)
+        continue
+      pid = state.current_player()
+      player.append(pid)
+      actions = state.legal_actions(pid)
+      key = (pid, state.information_state_string(pid))
+      if key not in infoset_ids:
+        infoset_ids[key] = len(self.infoset_keys)
+        self.infoset_keys.append(key)
+        self.infoset_actions.append(actions)
+        self.infoset_player.append(pid)
+        self.infoset_offset.append(n_slots)
+        self.infoset_depth.append(depth[node])
+        n_slots += len(actions)
+      iid = infoset_ids[key]
+      assert self.infoset_actions[iid] == actions, (key, actions)
+      infoset.append(iid)
+      for i, a in enumerate(actions):
+        queue.append((len(parent), state.child(a)))
+        add_node(node, d, self.infoset_offset[iid] + i, 1.)
+
+    self.n_nodes = len(parent)
+    self.n_slots = n_slots
+    self.n_infosets = len(self.infoset_keys)
+    self.parent = np.array(parent, np.int64)
+    self.player = np.array(player, np.int64)
+    self.infoset = np.array(infoset, np.int64)
+    self.slot = np.array(slot, np.int64)
+    self.chance_prob = np.array(chance_prob, np.float64)
+    self.returns = np.array(returns, np.float64)
+    self.infoset_player = np.array(self.infoset_player, np.int64)
+    self.infoset_offset = np.array(self.infoset_offset, np.int64)
+    self.infoset_size = np.array([len(a) for a in self.infoset_actions], np.int64)
+    self.infoset_depth = np.array(self.infoset_depth, np.int64)
+    self.slot_infoset = np.repeat(np.arange(self.n_infosets), self.infoset_size)
+
+    depth = np.array(depth, np.int64)
+    self.depth_bounds = np.searchsorted(depth, np.arange(depth[-1] + 2))
+    parent_player = self.player[np.maximum(self.parent, 0)]
+    self.owner = np.where(parent_player == CHANCE, self.n_players, parent_player)
+    self.owner[0] = self.n_players
+    self.is_decision_child = self.slot >= 0
+    self.is_chance_child = (parent_player == CHANCE) & (self.parent >= 0)
+    # information sets of each depth are complete within the depth
+    decision_nodes = np.flatnonzero(self.infoset >= 0)
+    self.is_depth_aligned = np.all(
+      self.infoset_depth[self.infoset[decision_nodes]] == depth[decision_nodes])
+
+  @property
+  def n_depths(self):
+    return len(self.depth_bounds) - 1
+
+  def layers(self):
+    return [np.arange(s, e) for s, e in
+      zip(self.depth_bounds[:-1], self.depth_bounds[1:])]
+
+  def edge_prob(self, strategy: np.ndarray):
+    """ The probability of reaching each node from its parent """
+    return np.where(self.is_decision_child, strategy[self.slot], self.chance_prob)
+
+  def uniform_strategy(self):
+    return 1. / self.infoset_size[self.slot_infoset]
+
+  def normalize(self, x: np.ndarray):
+    """ Normalizes non-negative x in each information set, the uniform
+    strategy is used where x sums to zero """
+    total = np.add.reduceat(x, self.infoset_offset)[self.slot_infoset]
+    with np.errstate(invalid='ignore', divide='ignore'):
+      return np.where(total > 0, x / total, self.uniform_strategy())
+
+  def to_policy(self, strategy: np.ndarray) -> Dict[str, Dict[int, float]]:
+    """ Maps information states to the action probabilities """
+    return {
+      key[1]: dict(zip(actions, strategy[offset:offset+len(actions)].tolist()))
+      for key, actions, offset in zip(
+        self.infoset_keys, self.infoset_actions, self.infoset_offset)
+    }
+
+
+class CFR:
+  """ Tabular counterfactual regret minimization on a GameTree
+
+  Each iteration runs a forward pass computing reach probabilities and
+  a backward pass computing values, both vectorized over the nodes of
+  each depth, and accumulates regrets of all slots with one bincount.
+  After iteration t, positive and negative cumulative regrets are
+  scaled by t^alpha/(t^alpha+1) and t^beta/(t^beta+1), and current
+  strategies are averaged with weights t^gamma, as in
+  game.meta_solver.RegretMatching. With alternating, players update
+  their regrets in turn against the latest strategies of the others.
+  With chance_sampling, one outcome of every chance node is sampled
+  per iteration, and only the sampled subtree is traversed (MCCFR).
+  """
+  def __init__(
+    self,
+    tree: GameTree,
+    alpha=np.inf,
+    beta=np.inf,
+    gamma=0,
+    alternating=False,
+    chance_sampling=False,
+    seed=None
+  ):
+    self.tree = tree
+    self.alpha = alpha
+    self.beta = beta
+    self.gamma = gamma
+    self.alternating = alternating
+    self.chance_sampling = chance_sampling
+    self._rng = np.random.default_rng(seed)
+
+    self.regrets = np.zeros(tree.n_slots)
+    self.strategy = tree.uniform_strategy()
+    self.strategy_sum = np.zeros(tree.n_slots)
+    self.t = 0
+    self._layers = tree.layers()
+
+  def iterate(self, n_iterations=1):
+    for _ in range(n_iterations):
+      self.t += 1
+      weight = self.t**self.gamma
+      layers = self._sample_layers() if self.chance_sampling else self._layers
+      if self.alternating:
+        for pid in range(self.tree.n_players):
+          self._update(layers, weight, pid)
+      else:
+        self._update(layers, weight)
+
+  def average_strategy(self):
+    return self.tree.normalize(self.strategy_sum)
+
+  def average_policy(self):
+    return self.tree.to_policy(self.average_strategy())
+
+  def exploitability(self):
+    return compute_exploitability(self.tree, self.average_strategy())
+
+  """ Implementation """
+  def _update(self, layers, weight, pid=None):
+    tree = self.tree
+    edge_prob = tree.edge_prob(self.strategy)
+    if self.chance_sampling:
+      # sampled outcomes are weighted by their probabilities over the
+      # sampling probabilities
+      edge_prob[tree.is_chance_child] = 1
+    reach = _forward(tree, edge_prob, layers)
+    values = _backward(tree, edge_prob, layers)
+
+    edges = np.concatenate(layers[1:])
+    edges = edges[tree.is_decision_child[edges]]
+    if pid is not None:
+      edges = edges[tree.owner[edges] == pid]
+    parents = tree.parent[edges]
+    owners = tree.owner[edges]
+    slots = tree.slot[edges]
+    opp_reach = _opponent_reach(reach[:, parents], owners)
+    regrets = opp_reach * (values[edges, owners] - values[parents, owners])
+    self.regrets += np.bincount(slots, regrets, tree.n_slots)
+    self.strategy_sum += weight * np.bincount(
+      slots, reach[owners, parents] * self.strategy[slots], tree.n_slots)
+
+    r = self.regrets
+    r = np.where(r > 0, _discount(self.t, self.alpha) * r, _discount(self.t, self.beta) * r)
+    if pid is None:
+      self.regrets = r
+    else:
+      updated = tree.infoset_player[tree.slot_infoset] == pid
+      self.regrets = np.where(updated, r, self.regrets)
+    self.strategy = tree.normalize(np.maximum(self.regrets, 0))
+
+  def _sample_layers(self):
+    """ Samples one child of every chance node and returns the nodes of
+    each depth in the sampled subtree """
+    tree = self.tree
+    chance_children = np.flatnonzero(tree.is_chance_child)
+    parents = tree.parent[chance_children]
+    u = self._rng.random(tree.n_nodes)[parents]
+    cum = np.cumsum(tree.chance_prob[chance_children])
+    starts = np.flatnonzero(np.r_[True, parents[1:] != parents[:-1]])
+    lengths = np.diff(np.r_[starts, len(parents)])
+    cum -= np.repeat(cum[starts] - tree.chance_prob[chance_children][starts], lengths)
+    lower = cum - tree.chance_prob[chance_children]
+    # guards against rounding errors of the cumulative sums
+    cum[np.r_[parents[1:] != parents[:-1], True]] = np.inf
+    chosen = (lower <= u) & (u < cum)
+
+    active = np.zeros(tree.n_nodes, bool)
+    active[0] = True
+    kept = np.ones(tree.n_nodes, bool)
+    kept[chance_children] = chosen
+    layers = [self._layers[0]]
+    for nodes in self._layers[1:]:
+      nodes = nodes[kept[nodes] & active[tree.parent[nodes]]]
+      active[nodes] = True
+      layers.append(nodes)
+    return layers
+
+
+def build_game_tree(game):
+  """ Enumerates game, a pyspiel.Game or game.tabular_games.TabularGame """
+  return GameTree(game)
+
+
+def select_cfr(name: str, tree: GameTree, **kwargs):
+  if name == 'cfr':
+    return CFR(tree, **kwargs)
+  elif name == 'cfr+':
+    return CFR(tree, beta=-np.inf, gamma=1, alternating=True, **kwargs)
+  elif name == 'dcfr':
+    return CFR(tree, alpha=1.5, beta=0, gamma=2, alternating=True, **kwargs)
+  elif name == 'mccfr':
+    return CFR(tree, chance_sampling=True, **kwargs)
+  else:
+    raise NotImplementedError(name)
+
+
+def compute_values(tree: GameTree, strategy: np.ndarray):
+  """ Returns the expected returns of all players """
+  return _backward(tree, tree.edge_prob(strategy), tree.layers())[0]
+
+
+def compute_best_response_values(tree: GameTree, strategy: np.ndarray):
+  """ Returns the values of best responses of all players to the
+  strategies of the others """
+  assert tree.is_depth_aligned, \
+    'Best responses require information sets within a depth'
+  layers = tree.layers()
+  edge_prob = tree.edge_prob(strategy)
+  reach = _forward(tree, edge_prob, layers)
+  br_values = []
+  for pid in range(tree.n_players):
+    values = tree.returns[:, pid].copy()
+    for children in reversed(layers[1:]):
+      prob = edge_prob[children]
+      own = tree.owner[children] == pid
+      if np.any(own):
+        edges = children[own]
+        parents = tree.parent[edges]
+        slots = tree.slot[edges]
+        opp_reach = _opponent_reach(reach[:, parents], pid)
+        q = np.bincount(slots, opp_reach * values[edges], tree.n_slots)
+        prob[own] = slots == _argmax(tree, q)[tree.slot_infoset[slots]]
+      _reduce_to_parents(tree, children, prob * values[children], values)
+    br_values.append(values[0])
+  return np.array(br_values)
+
+
+def compute_nash_conv(tree: GameTree, strategy: np.ndarray):
+  br_values = compute_best_response_values(tree, strategy)
+  return float(np.sum(br_values - compute_values(tree, strategy)))
+
+
+def compute_exploitability(tree: GameTree, strategy: np.ndarray):
+  return compute_nash_conv(tree, strategy) / tree.n_players
+
+
+""" Implementation """
+def _forward(tree: GameTree, edge_prob, layers):
+  """ Computes reach probabilities of all players and chance """
+  reach = np.zeros((tree.n_players + 1, tree.n_nodes))
+  reach[:, 0] = 1
+  for nodes in layers[1:]:
+    r = reach[:, tree.parent[nodes]]
+    r[tree.owner[nodes], np.arange(nodes.size)] *= edge_prob[nodes]
+    reach[:, nodes] = r
+  return reach
+
+
+def _backward(tree: GameTree, edge_prob, layers):
+  """ Computes the values of all players at each node """
+  values = tree.returns.copy()
+  for children in reversed(layers[1:]):
+    _reduce_to_parents(
+      tree, children, edge_prob[children, None] * values[children], values)
+  return values
+
+
+def _reduce_to_parents(tree: GameTree, children, x, values):
+  """ Sets values of parents to sums of x over their children """
+  if children.size == 0:
+    return
+  parents = tree.parent[children]
+  starts = np.flatnonzero(np.r_[True, parents[1:] != parents[:-1]])
+  values[parents[starts]] = np.add.reduceat(x, starts, axis=0)
+
+
+def _opponent_reach(reach, pid):
+  """ Computes products of reach probabilities of chance and all
+  players but pid, which is a scalar or an array of columns of reach """
+  mask = np.arange(reach.shape[0])[:, None] != pid
+  return np.prod(np.where(mask, reach, 1), axis=0)
+
+
+def _argmax(tree: GameTree, x):
+  """ Returns the first slot of the maximum of x in each information set """
+  max_x = np.maximum.reduceat(x, tree.infoset_offset)[tree.slot_infoset]
+  slots = np.where(x == max_x, np.arange(tree.n_slots), tree.n_slots)
+  return np.minimum.reduceat(slots, tree.infoset_offset)
+
+
+def _discount(t, p):
+  if p == np.inf:
+    return 1
+  elif p == -np.inf:
+    return 0
+  return t**p / (t**p + 1)
@@ -0,0 +1,278 @@
+from typing import List
+import numpy as np
+
+
+def compute_strategy_utilities(
+  payoffs: List[np.ndarray],
+  strategies: List[np.ndarray]
+):
+  """ Compute the utilities of all pure strategies of each agent
+  against the strategies of the others
+
+  Returns:
+    A list of utilities, whose k-th element has shape (|S_k|,)
+  """
+  n_agents = len(strategies)
+  utilities = []
+  for aid, payoff in enumerate(payoffs):
+    u = payoff
+    # contracting trailing axes first keeps the leading axes in place
+    for i in reversed(range(n_agents)):
+      if i != aid:
+        u = np.tensordot(u, strategies[i], axes=([i], [0]))
+    utilities.append(u)
+  return utilities
+
+
+def compute_nash_conv(payoffs: List[np.ndarray], strategies: List[np.ndarray]):
+  """ Compute the sum of the gains of all agents from best responding """
+  utilities = compute_strategy_utilities(payoffs, strategies)
+  return float(sum(np.max(u) - s @ u for u, s in zip(utilities, strategies)))
+
+
+def expand_strategies(strategies: List[np.ndarray], ns: tuple, eps=.01):
+  """ Expand strategies to games with more strategies per agent
+
+  New strategies are appended with zero probability, and eps of each
+  strategy is mixed with the uniform one so that all strategies are
+  played.
+  """
+  expanded = []
+  for s, n in zip(strategies, ns):
+    assert s.size <= n, (s.size, n)
+    s = np.pad(s, (0, n - s.size))
+    expanded.append((1 - eps) * s + eps / n)
+  return expanded
+
+
+class MetaSolver:
+  """ Base class of iterative solvers of the meta-game
+
+  compute returns the average strategies of n_iterations iterations
+  starting from init_strategies, or from the uniform strategies if
+  they are not provided. With warm_start, the solver resumes from the
+  state of the last call instead, i.e., its iterates, averages and 
+  iteration count, expanded to the strategies added since then.
+  """
+  def __init__(self, n_iterations=1000, warm_start=False):
+    self.n_iterations = n_iterations
+    self.warm_start = warm_start
+    self.reset()
+
+  def reset(self):
+    self.strategies = None
+    self._state = None
+
+  def compute(
+    self,
+    payoffs: List[np.ndarray],
+    init_strategies: List[np.ndarray]=None
+  ):
+    ns = payoffs[0].shape
+    assert len(payoffs) == len(ns), (len(payoffs), ns)
+    for p in payoffs:
+      assert p.shape == ns, (p.shape, ns)
+    payoffs = [np.asarray(p, dtype=np.float64) for p in payoffs]
+    if init_strategies is None and self.warm_start and self._state is not None:
+      state = self._expand_state(self._state, ns)
+    else:
+      if init_strategies is None:
+        init_strategies = [np.ones(n) / n for n in ns]
+      strategies = [np.array(s, dtype=np.float64) for s in init_strategies]
+      state = self._init_state(strategies)
+
+    self._state = self._solve(payoffs, state)
+    self.strategies = self._get_average_strategies(self._state)
+    return self.strategies
+
+  def _init_state(self, strategies: List[np.ndarray]):
+    return dict(strategies=strategies, t=0)
+
+  def _expand_state(self, state: dict, ns: tuple):
+    raise NotImplementedError
+
+  def _solve(self, payoffs: List[np.ndarray], state: dict):
+    raise NotImplementedError
+
+  def _get_average_strategies(self, state: dict):
+    raise NotImplementedError
+
+
+class RegretMatching(MetaSolver):
+  """ Discounted regret matching
+
+  After iteration t, positive and negative cumulative regrets are
+  scaled by t^alpha/(t^alpha+1) and t^beta/(t^beta+1), and strategies
+  are averaged with weights t^gamma. The defaults give vanilla regret
+  matching, beta=-inf and gamma=1 give regret matching+ as in CFR+, and
+  alpha=1.5, beta=0, gamma=2 give discounted CFR.
+  """
+  def __init__(
+    self,
+    n_iterations=1000,
+    alpha=np.inf,
+    beta=np.inf,
+    gamma=0,
+    warm_start=False
+  ):
+    super().__init__(n_iterations, warm_start)
+    self.alpha = alpha
+    self.beta = beta
+    self.gamma = gamma
+
+  def _init_state(self, strategies):
+    state = super()._init_state(strategies)
+    state['regrets'] = [np.zeros_like(s) for s in strategies]
+    state['avg_strategies'] = [np.zeros_like(s) for s in strategies]
+    state['total_weight'] = 0
+    return state
+
+  def _expand_state(self, state, ns):
+    # new strategies start with no regret and no weight in the average
+    regrets = [_pad(r, n) for r, n in zip(state['regrets'], ns)]
+    return dict(
+      strategies=[_regret_to_strategy(r) for r in regrets],
+      t=state['t'],
+      regrets=regrets,
+      avg_strategies=[_pad(s, n) for s, n in zip(state['avg_strategies'], ns)],
+      total_weight=state['total_weight'],
+    )
+
+  def _solve(self, payoffs, state):
+    strategies = state['strategies']
+    regrets = state['regrets']
+    avg_strategies = state['avg_strategies']
+    total_weight = state['total_weight']
+    t0 = state['t']
+    for t in range(t0+1, t0+self.n_iterations+1):
+      utilities = compute_strategy_utilities(payoffs, strategies)
+      weight = t**self.gamma
+      total_weight += weight
+      pos_discount = _discount(t, self.alpha)
+      neg_discount = _discount(t, self.beta)
+      for aid, (u, s) in enumerate(zip(utilities, strategies)):
+        avg_strategies[aid] += weight * s
+        r = regrets[aid] + u - s @ u
+        regrets[aid] = np.where(r > 0, pos_discount * r, neg_discount * r)
+      strategies = [_regret_to_strategy(r) for r in regrets]
+
+    return dict(
+      strategies=strategies,
+      t=t0+self.n_iterations,
+      regrets=regrets,
+      avg_strategies=avg_strategies,
+      total_weight=total_weight,
+    )
+
+  def _get_average_strategies(self, state):
+    if state['total_weight'] == 0:
+      return list(state['strategies'])
+    return [s / state['total_weight'] for s in state['avg_strategies']]
+
+
+class ReplicatorDynamics(MetaSolver):
+  """ Discrete-time replicator dynamics in the exponential form, i.e.,
+  x_i <- x_i exp(step_size * (u_i - x @ u)) normalized """
+  def __init__(self, n_iterations=1000, step_size=.1, warm_start=False):
+    super().__init__(n_iterations, warm_start)
+    self.step_size = step_size
+
+  def _init_state(self, strategies):
+    state = super()._init_state(strategies)
+    state['avg_strategies'] = [np.zeros_like(s) for s in strategies]
+    return state
+
+  def _expand_state(self, state, ns):
+    # the dynamics never put mass on strategies with zero probability,
+    # so new strategies are mixed in by expand_strategies
+    return dict(
+      strategies=[s if s.size == n else expand_strategies([s], (n,))[0]
+        for s, n in zip(state['strategies'], ns)],
+      t=state['t'],
+      avg_strategies=[_pad(s, n) for s, n in zip(state['avg_strategies'], ns)],
+    )
+
+  def _solve(self, payoffs, state):
+    strategies = state['strategies']
+    avg_strategies = state['avg_strategies']
+    for _ in range(self.n_iterations):
+      utilities = compute_strategy_utilities(payoffs, strategies)
+      for aid, (u, s) in enumerate(zip(utilities, strategies)):
+        avg_strategies[aid] += s
+        logits = np.log(np.maximum(s, 1e-300)) + self.step_size * (u - np.max(u))
+        s = np.exp(logits - np.max(logits))
+        strategies[aid] = s / np.sum(s)
+
+    return dict(
+      strategies=strategies,
+      t=state['t']+self.n_iterations,
+      avg_strategies=avg_strategies,
+    )
+
+  def _get_average_strategies(self, state):
+    if state['t'] == 0:
+      return list(state['strategies'])
+    return [s / state['t'] for s in state['avg_strategies']]
+
+
+class FictitiousPlay(MetaSolver):
+  """ Fictitious play, where all agents best respond to the average
+  strategies of the others simultaneously """
+  def _expand_state(self, state, ns):
+    # new strategies have not been played
+    return dict(
+      strategies=[_pad(s, n) for s, n in zip(state['strategies'], ns)],
+      t=state['t'],
+    )
+
+  def _solve(self, payoffs, state):
+    strategies = state['strategies']
+    t0 = state['t']
+    for t in range(t0+1, t0+self.n_iterations+1):
+      utilities = compute_strategy_utilities(payoffs, strategies)
+      for aid, (u, s) in enumerate(zip(utilities, strategies)):
+        best_response = np.zeros_like(s)
+        best_response[np.argmax(u)] = 1
+        strategies[aid] = s + (best_response - s) / (t + 1)
+
+    return dict(strategies=strategies, t=t0+self.n_iterations)
+
+  def _get_average_strategies(self, state):
+    return list(state['strategies'])
+
+
+def select_meta_solver(name: str, **kwargs):
+  if name == 'rm':
+    return RegretMatching(**kwargs)
+  elif name == 'rm+':
+    return RegretMatching(beta=-np.inf, gamma=1, **kwargs)
+  elif name == 'dcfr':
+    return RegretMatching(alpha=1.5, beta=0, gamma=2, **kwargs)
+  elif name == 'rd':
+    return ReplicatorDynamics(**kwargs)
+  elif name == 'fp':
+    return FictitiousPlay(**kwargs)
+  else:
+    raise NotImplementedError(name)
+
+
+""" Implementation """
+def _discount(t, p):
+  if p == np.inf:
+    return 1
+  elif p == -np.inf:
+    return 0
+  return t**p / (t**p + 1)
+
+
+def _pad(x, n):
+  assert x.size <= n, (x.size, n)
+  return np.pad(x, (0, n - x.size))
+
+
+def _regret_to_strategy(regret):
+  r_plus = np.maximum(regret, 0)
+  total = np.sum(r_plus)
+  if total > 0:
+    return r_plus / total
+  return np.ones_like(regret) / regret.size
@@ -1,5 +1,7 @@
+import collections
 import os
 from typing import Dict, List, Tuple
+import cloudpickle
 import numpy as np
 
 from tools import pickle
@@ -10,34 +12,71 @@ from tools.utils import config_attr
 
 
 class PayoffTableCheckpoint(PickleCheckpointBase):
+  """ Saves payoff tables as snapshots followed by logs of changes
+
+  Changes recorded since the last save are appended to the log file 
+  {name}.log.pkl, so saving after a few updates does not rewrite the 
+  whole table. The log is compacted into a new snapshot once it holds 
+  more than compact_interval records. Records are tagged with the 
+  generation of their snapshot, and those left by an interrupted 
+  compaction are skipped by restore.
+  """
   def __init__(
     self, 
     step_size, 
     dir, 
     name='payoff', 
+    compact_interval=100, 
   ):
     self.step_size = step_size
     self.dir = dir
     self.name = name
     self.path = os.path.join(dir, f'{name}.pkl')
+    self.compact_interval = compact_interval
+    # records of changes not saved yet, and the number of records in 
+    # the log file, which is None until a snapshot is saved or restored
+    self.unsaved_records = []
+    self.n_saved_records = None
+    self.is_replaying = False
+    # versions of the tables, which change when strategies are added, 
+    # and of the payoffs of each strategy (aid, sid), which change 
+    # when they are updated
+    self.layout_version = 0
+    self.strategy_versions = collections.defaultdict(int)
 
     self._payoffs = None
     self._counts = None
+    self._generation = 0
 
   """ Checkpoints """
   def retrieve(self):
     data = {v[1:]: getattr(self, v) for v in vars(self) if v.startswith('_')}
+    data.update(self._retrieve_tables())
     return data
 
   def load(self, data):
     config_attr(self, data, filter_dict=False, private_attr=True)
+    self._load_tables()
+    self._reset_log()
+    self.layout_version += 1
 
   def save(self, to_print=True):
-    data = {v[1:]: getattr(self, v) for v in vars(self) if v.startswith('_')}
-    pickle.save(
-      data, filedir=self.dir, filename=self.name, 
-      name='payoffs', to_print=to_print
-    )
+    n_records = (self.n_saved_records or 0) + len(self.unsaved_records)
+    if self.n_saved_records is None or n_records > self.compact_interval:
+      self._generation += 1
+      pickle.save(
+        self.retrieve(), filedir=self.dir, filename=self.name, 
+        name='payoffs', to_print=to_print, atomic=True
+      )
+      if os.path.exists(self._log_path()):
+        os.remove(self._log_path())
+      n_records = 0
+    elif self.unsaved_records:
+      with open(self._log_path(), 'ab') as f:
+        for name, args in self.unsaved_records:
+          cloudpickle.dump((self._generation, name, args), f)
+    self.unsaved_records = []
+    self.n_saved_records = n_records
 
   def restore(self, to_print=True):
     data = pickle.restore(
@@ -45,30 +84,92 @@ class PayoffTableCheckpoint(PickleCheckpointBase):
       name='payoffs', to_print=to_print
     )
     self.load(data)
+    if not data:
+      return
+    n_records = 0
+    self.is_replaying = True
+    try:
+      for generation, name, args in self._read_log():
+        if generation == self._generation:
+          getattr(self, name)(*args)
+          n_records += 1
+    finally:
+      self.is_replaying = False
+    self.n_saved_records = n_records
+    if to_print and n_records:
+      do_logging(f'Replaying {n_records} payoff records from "{self._log_path()}"')
+
+  """ Implementations """
+  def _record(self, name, *args):
+    """ Records a call of method name to be saved in the log """
+    if not self.is_replaying:
+      self.unsaved_records.append((name, args))
+
+  def _update_versions(self, aid, sids):
+    for sid in np.unique(sids):
+      self.strategy_versions[(aid, int(sid))] += 1
+
+  def _reset_log(self):
+    # the next save writes a snapshot
+    self.unsaved_records = []
+    self.n_saved_records = None
+
+  def _log_path(self):
+    return os.path.join(self.dir, f'{self.name}.log.pkl')
+
+  def _read_log(self):
+    records = []
+    if not os.path.exists(self._log_path()):
+      return records
+    with open(self._log_path(), 'rb') as f:
+      while True:
+        try:
+          records.append(cloudpickle.load(f))
+        except EOFError:
+          break
+        except Exception as e:
+          do_logging(f'Ignoring a truncated payoff record: {e}', level='warning')
+          break
+    return records
+
+  def _retrieve_tables(self):
+    """ Returns tables without unused capacity """
+    raise NotImplementedError
+
+  def _load_tables(self):
+    raise NotImplementedError
 
 
 class PayoffTable(PayoffTableCheckpoint):
+  """ Payoff tables of all agents
+
+  Tables grow their capacity geometrically, so adding a strategy pads 
+  them in amortized constant time. Only the first _sizes[i] strategies 
+  of agent i are in use.
+  """
   def __init__(
     self, 
     n_agents, 
     step_size, 
     dir, 
     name='payoff', 
+    compact_interval=100, 
   ):
-    super().__init__(step_size, dir, name)
+    super().__init__(step_size, dir, name, compact_interval)
     self.n_agents = n_agents
 
     self._payoffs = [np.zeros([0] * n_agents, dtype=np.float32) * np.nan for _ in range(n_agents)]
     self._counts = [np.zeros([0] * n_agents, dtype=np.int64) for _ in range(n_agents)]
+    self._sizes = [0] * n_agents
   
   def size(self, aid: int):
-    return self._payoffs[aid].shape[0]
+    return self._sizes[aid]
 
   """ Payoff Retrieval """
   def get_payoffs(self, fill_nan=None):
     payoffs = []
     for p in self._payoffs:
-      p = p.copy()
+      p = self._trim(p).copy()
       if fill_nan is not None:
         assert isinstance(fill_nan, (int, float)), fill_nan
         p[np.isnan(p)] = fill_nan
@@ -77,7 +178,7 @@ class PayoffTable(PayoffTableCheckpoint):
 
   def get_payoffs_for_agent(self, aid: int, *, sid: int=None):
     """ Get the payoff table for agent aid """
-    payoff = self._payoffs[aid]
+    payoff = self._trim(self._payoffs[aid])
     if sid is not None:
       payoff = payoff[(slice(None), ) * aid + (sid,)]
       assert len(payoff.shape) == self.n_agents - 1, (payoff.shape, self.n_agents)
@@ -86,12 +187,12 @@ class PayoffTable(PayoffTableCheckpoint):
     return payoff
 
   def get_counts(self):
-    return self._counts
+    return [self._trim(c) for c in self._counts]
 
   def get_counts_for_agent(self, aid: int, *, sid: int):
-    count = self._counts[aid]
+    count = self._trim(self._counts[aid])
     if sid is not None:
-      count = count[(slice(None), ) * aid + (sid)]
+      count = count[(slice(None), ) * aid + (sid,)]
       assert len(count.shape) == self.n_agents - 1, (count.shape, self.n_agents)
     else:
       assert len(count.shape) == self.n_agents, (count.shape, self.n_agents)
@@ -108,23 +209,22 @@ class PayoffTable(PayoffTableCheckpoint):
         np.zeros([0] * self.n_agents, dtype=np.int64) 
         for _ in range(self.n_agents)
       ]
+      self._sizes = [0] * self.n_agents
     else:
       self._payoffs = [np.zeros_like(p) * np.nan for p in self._payoffs]
       self._counts = [np.zeros_like(c) for c in self._counts]
     if name is not None:
       self.name = name
+    self._reset_log()
+    self.layout_version += 1
 
   def expand(self, aid):
-    pad_width = [(0, 0) for _ in range(self.n_agents)]
-    pad_width[aid] = (0, 1)
-    for i in range(self.n_agents):
-      self._expand(i, pad_width)
+    self._add_strategy(aid)
 
   def expand_all(self, aids: List[int]):
     assert len(aids) == self.n_agents, aids
-    pad_width = [(0, 1) for _ in range(self.n_agents)]
-    for aid in enumerate(aids):
-      self._expand(aid, pad_width)
+    for aid in range(self.n_agents):
+      self._add_strategy(aid)
 
   def update(self, sids: Tuple[int], scores: List[List[float]]):
     """
@@ -132,21 +232,57 @@ class PayoffTable(PayoffTableCheckpoint):
     from the view of the i-th agent
     """
     assert len(sids) == self.n_agents, f'Some models are not specified: {sids}'
-    for payoff, count, s in zip(self._payoffs, self._counts, scores):
-      s_sum = sum(s)
-      s_total = len(s)
-      if s == []:
-        continue
-      elif count[sids] == 0:
-        payoff[sids] = s_sum / s_total
-      elif self.step_size == 0 or self.step_size is None:
-        payoff[sids] = (count[sids] * payoff[sids] + s_sum) / (count[sids] + s_total)
-      else:
-        payoff[sids] += self.step_size * (s_sum / s_total - payoff[sids])
-      assert not np.isnan(payoff[sids]), (count[sids], payoff[sids])
-      count[sids] += s_total
+    self._update_batch([sids], [scores])
+
+  def update_batch(self, sids_batch: List[Tuple[int]], scores_batch: List[List[List[float]]]):
+    """ Updates payoffs of a batch of strategy profiles at once, 
+    which is equivalent to calling update for each of them in order """
+    assert len(sids_batch) == len(scores_batch), (len(sids_batch), len(scores_batch))
+    for sids in sids_batch:
+      assert len(sids) == self.n_agents, f'Some models are not specified: {sids}'
+    self._update_batch(sids_batch, scores_batch)
 
   """ implementations """
+  def _update_batch(self, sids_batch, scores_batch):
+    sids_batch = np.asarray(sids_batch, dtype=np.int64).reshape(-1, self.n_agents)
+    for aid, (payoff, count) in enumerate(zip(self._payoffs, self._counts)):
+      totals = np.array([len(s[aid]) for s in scores_batch], dtype=np.int64)
+      sums = np.array([sum(s[aid]) for s in scores_batch], dtype=np.float64)
+      mask = totals > 0
+      _update_cells(payoff, count, sids_batch[mask].T, 
+        sums[mask], totals[mask], self.step_size)
+      # payoffs of agent aid are retrieved along axis aid
+      self._update_versions(aid, sids_batch[mask, aid])
+
+  def _trim(self, x):
+    return x[tuple(slice(n) for n in self._sizes)]
+
+  def _add_strategy(self, aid):
+    self._reserve(aid, self._sizes[aid] + 1)
+    self._sizes[aid] += 1
+    self.layout_version += 1
+
+  def _reserve(self, aid, size):
+    capacity = self._payoffs[0].shape[aid]
+    if size <= capacity:
+      return
+    pad_width = [(0, 0) for _ in range(self.n_agents)]
+    pad_width[aid] = (0, max(size, 2 * capacity) - capacity)
+    for i in range(self.n_agents):
+      self._expand(i, pad_width)
+
+  def _retrieve_tables(self):
+    return dict(
+      payoffs=[self._trim(p) for p in self._payoffs], 
+      counts=[self._trim(c) for c in self._counts], 
+      sizes=list(self._sizes), 
+    )
+
+  def _load_tables(self):
+    self._payoffs = list(self._payoffs)
+    self._counts = list(self._counts)
+    self._sizes = list(self._payoffs[0].shape)
+
   def _expand(self, aid, pad_width):
     self._payoffs[aid] = np.pad(self._payoffs[aid], pad_width, constant_values=np.nan)
     self._counts[aid] = np.pad(self._counts[aid], pad_width)
@@ -159,12 +295,14 @@ class PayoffTableWithModel(PayoffTable):
     step_size, 
     dir, 
     name='payoff', 
+    compact_interval=100, 
   ):
     # mappings between ModelPath and strategy index
     self._model2sid: List[Dict[ModelPath, int]] = [{} for _ in range(n_agents)]
     self._sid2model: List[List[ModelPath]] = [[] for _ in range(n_agents)]
 
-    super().__init__(n_agents, step_size, dir, name=name)
+    super().__init__(n_agents, step_size, dir, name=name, 
+                     compact_interval=compact_interval)
 
   def __contains__(self, aid_model: Tuple[int, ModelPath]):
     aid, model = aid_model
@@ -180,6 +318,11 @@ class PayoffTableWithModel(PayoffTable):
   def get_model2sid(self):
     return self._model2sid
 
+  def get_payoff_version(self, aid: int, model: ModelPath):
+    """ Returns the version of the payoffs of model of agent aid """
+    sid = self._model2sid[aid][model]
+    return self.layout_version, self.strategy_versions[(aid, sid)]
+
   """ Payoff Retrieval """
   def get_payoffs_for_agent(self, aid: int, *, sid: int=None, model: ModelPath=None):
     if sid is None and model is not None:
@@ -206,34 +349,45 @@ class PayoffTableWithModel(PayoffTable):
     self._expand_mappings(aid, model)
     super().expand(aid)
     self._check_consistency(aid, model)
+    self._record('expand', model, aid)
 
   def expand_all(self, models: List[ModelPath]):
     assert len(models) == self.n_agents, models
-    pad_width = [(0, 1) for _ in range(self.n_agents)]
     for aid, model in enumerate(models):
       assert aid == get_aid(model.model_name), f'Inconsistent aids: {aid} vs {get_aid(model.model_name)}'
       self._expand_mappings(aid, model)
-      self._expand(aid, pad_width)
+    super().expand_all(list(range(self.n_agents)))
 
     for aid, model in enumerate(models):
       self._check_consistency(aid, model)
+    self._record('expand_all', models)
 
   def update(self, models: List[ModelPath], scores: List[List[float]]):
     assert len(models) == len(scores) == self.n_agents, (models, scores, self.n_agents)
-    sids = tuple([
-      m2sid[model] for m2sid, model in zip(self._model2sid, models) if model in m2sid
-    ])
-    super().update(sids, scores)
+    super().update(self._get_sids(models), scores)
+    self._record('update', models, scores)
     # print('Payoffs', *self._payoffs, 'Counts', *self._counts, sep='\n')
 
+  def update_batch(self, models_batch: List[List[ModelPath]], scores_batch: List[List[List[float]]]):
+    for models, scores in zip(models_batch, scores_batch):
+      assert len(models) == len(scores) == self.n_agents, (models, scores, self.n_agents)
+    sids_batch = [self._get_sids(models) for models in models_batch]
+    super().update_batch(sids_batch, scores_batch)
+    self._record('update_batch', models_batch, scores_batch)
+
   """ Implementations """
+  def _get_sids(self, models: List[ModelPath]):
+    return tuple([
+      m2sid[model] for m2sid, model in zip(self._model2sid, models) if model in m2sid
+    ])
+
   def _expand_mappings(self, aid, model: ModelPath):
     if isinstance(model.model_name, str):
       assert aid == get_aid(model.model_name), (aid, model)
     else:
       assert isinstance(model.model_name, int), model.model_name
     assert model not in self._model2sid[aid], f'Model({model}) is already in {list(self._model2sid[aid])}'
-    sid = self._payoffs[aid].shape[aid]
+    sid = self._sizes[aid]
     self._model2sid[aid][model] = sid
     self._sid2model[aid].append(model)
     assert len(self._sid2model[aid]) == sid+1, (sid, self._sid2model)
@@ -243,21 +397,27 @@ class PayoffTableWithModel(PayoffTable):
       assert aid == get_aid(model.model_name), (aid, model)
     else:
       assert isinstance(model.model_name, int), model.model_name
+    assert self._sizes[aid] == self._model2sid[aid][model] + 1, \
+      (self._sizes[aid], self._model2sid[aid][model] + 1)
     for i in range(self.n_agents):
-      assert self._payoffs[i].shape[aid] == self._model2sid[aid][model] + 1, \
-        (self._payoffs[i].shape[aid], self._model2sid[aid][model] + 1)
-      assert self._counts[i].shape[aid] == self._model2sid[aid][model] + 1, \
-        (self._counts[i].shape[aid], self._model2sid[aid][model] + 1)
+      assert self._payoffs[i].shape[aid] >= self._sizes[aid], \
+        (self._payoffs[i].shape[aid], self._sizes[aid])
+      assert self._counts[i].shape[aid] >= self._sizes[aid], \
+        (self._counts[i].shape[aid], self._sizes[aid])
 
 
 class SelfPlayPayoffTable(PayoffTableCheckpoint):
-  def __init__(self, step_size, dir, name='payoff'):
-    super().__init__(step_size, dir, name)
+  """ The antisymmetric payoff table of self-play, whose capacity grows 
+  geometrically as PayoffTable's. Only the first _size strategies are 
+  in use """
+  def __init__(self, step_size, dir, name='payoff', compact_interval=100):
+    super().__init__(step_size, dir, name, compact_interval)
     self._payoffs = np.zeros([0] * 2, dtype=np.float32)
     self._counts = np.zeros([0] * 2, dtype=np.int64)
+    self._size = 0
   
   def size(self):
-    return self._payoffs.shape[0]
+    return self._size
   
   """ Payoff Retrieval """
   def get_subset_payoffs(self, fill_nan=None, *, sid: int=None, other_sids):
@@ -266,7 +426,7 @@ class SelfPlayPayoffTable(PayoffTableCheckpoint):
     return payoffs
 
   def get_payoffs(self, fill_nan=None, *, sid: int=None):
-    payoffs = self._payoffs.copy()
+    payoffs = self._trim(self._payoffs).copy()
     if fill_nan is not None:
       assert isinstance(fill_nan, (int, float)), fill_nan
       payoffs[np.isnan(payoffs)] = fill_nan
@@ -280,7 +440,7 @@ class SelfPlayPayoffTable(PayoffTableCheckpoint):
     return counts
 
   def get_counts(self, *, sid: int=None):
-    counts = self._counts.copy()
+    counts = self._trim(self._counts).copy()
     if sid is not None:
       counts = counts[sid]
     return counts
@@ -290,58 +450,77 @@ class SelfPlayPayoffTable(PayoffTableCheckpoint):
     if from_scratch:
       self._payoffs = np.zeros([0] * 2, dtype=np.float32) * np.nan
       self._counts = np.zeros([0] * 2, dtype=np.int64) 
+      self._size = 0
     else:
       self._payoffs = np.zeros_like(self._payoffs) * np.nan
       self._counts = np.zeros_like(self._counts)
     if name is not None:
       self.name = name
+    self._reset_log()
+    self.layout_version += 1
 
   def expand(self):
-    pad_width = (0, 1)
-    self._expand(pad_width)
+    capacity = self._payoffs.shape[0]
+    if self._size == capacity:
+      self._expand((0, max(1, 2 * capacity) - capacity))
+    self._size += 1
+    self.layout_version += 1
 
   def update(self, sids: Tuple[int], scores: List[float]):
     assert len(sids) == 2, f'Strategies for both sides of agents were expected, but got {sids}'
-    s_sum = sum(scores)
-    s_total = len(scores)
-    if sids[0] == sids[1]:
-      self._payoffs[sids] = 0
-    else:
-      rsids = (sids[1], sids[0])
-      if scores == []:
-        return
-      elif self._counts[sids] == 0:
-        payoff = s_sum / s_total
-        self._payoffs[sids] = payoff
-        self._payoffs[rsids] = -payoff
-      elif self.step_size == 0 or self.step_size is None:
-        payoff = (self._counts[sids] * self._payoffs[sids] + s_sum) / (self._counts[sids] + s_total)
-        self._payoffs[sids] = payoff
-        self._payoffs[rsids] = -payoff
-      else:
-        payoff = s_sum / s_total
-        new_payoff = self.step_size * (payoff - self._payoffs[sids])
-        self._payoffs[sids] += new_payoff
-        new_payoff = self.step_size * (-payoff - self._payoffs[rsids])
-        self._payoffs[rsids] += new_payoff
-      # assert self._payoffs[sids] + self._payoffs[rsids] == 1, (sids, self._payoffs[sids], rsids, self._payoffs[rsids])
-      assert not np.isnan(self._payoffs[sids]), (self._counts[sids], self._payoffs[sids])
-      self._counts[rsids] += s_total
-    self._counts[sids] += s_total
+    self._update_batch([sids], [scores])
+
+  def update_batch(self, sids_batch: List[Tuple[int]], scores_batch: List[List[float]]):
+    """ Updates payoffs of a batch of strategy pairs at once, which is 
+    equivalent to calling update for each of them in order """
+    assert len(sids_batch) == len(scores_batch), (len(sids_batch), len(scores_batch))
+    for sids in sids_batch:
+      assert len(sids) == 2, f'Strategies for both sides of agents were expected, but got {sids}'
+    self._update_batch(sids_batch, scores_batch)
 
   """ implementations """
+  def _update_batch(self, sids_batch, scores_batch):
+    sids_batch = np.asarray(sids_batch, dtype=np.int64).reshape(-1, 2)
+    totals = np.array([len(s) for s in scores_batch], dtype=np.int64)
+    sums = np.array([sum(s) for s in scores_batch], dtype=np.float64)
+    is_diag = sids_batch[:, 0] == sids_batch[:, 1]
+    diag_sids = sids_batch[is_diag, 0]
+    self._payoffs[diag_sids, diag_sids] = 0
+    np.add.at(self._counts, (diag_sids, diag_sids), totals[is_diag])
+
+    mask = ~is_diag & (totals > 0)
+    # each pair updates itself and its reverse with the opposite scores
+    cells = np.stack([sids_batch[mask], sids_batch[mask][:, ::-1]], 1).reshape(-1, 2)
+    sums = np.stack([sums[mask], -sums[mask]], 1).reshape(-1)
+    totals = np.repeat(totals[mask], 2)
+    _update_cells(self._payoffs, self._counts, cells.T, sums, totals, self.step_size)
+    self._update_versions(0, sids_batch)
+
+  def _trim(self, x):
+    return x[:self._size, :self._size]
+
+  def _retrieve_tables(self):
+    return dict(
+      payoffs=self._trim(self._payoffs), 
+      counts=self._trim(self._counts), 
+      size=self._size, 
+    )
+
+  def _load_tables(self):
+    self._size = self._payoffs.shape[0]
+
   def _expand(self, pad_width):
     self._payoffs = np.pad(self._payoffs, pad_width, constant_values=np.nan)
     self._counts = np.pad(self._counts, pad_width)
 
 
 class SelfPlayPayoffTableWithModel(SelfPlayPayoffTable):
-  def __init__(self, step_size, dir, name='payoff'):
+  def __init__(self, step_size, dir, name='payoff', compact_interval=100):
     # mappings between ModelPath and strategy index
     self._model2sid: Dict[ModelPath, int] = {}
     self._sid2model: List[ModelPath] = []
 
-    super().__init__(step_size, dir, name)
+    super().__init__(step_size, dir, name, compact_interval)
 
   def __contains__(self, model: ModelPath):
     return model in self._sid2model
@@ -367,6 +546,11 @@ class SelfPlayPayoffTableWithModel(SelfPlayPayoffTable):
     payoffs = payoffs[other_sids]
     return payoffs
 
+  def get_payoff_version(self, model: ModelPath):
+    """ Returns the version of the payoffs of model """
+    sid = self._model2sid[model]
+    return self.layout_version, self.strategy_versions[(0, sid)]
+
   def get_payoffs(self, fill_nan=None, *, sid: int=None, model: ModelPath=None):
     if sid is None and model is not None:
       sid = self._model2sid[model]
@@ -400,24 +584,71 @@ class SelfPlayPayoffTableWithModel(SelfPlayPayoffTable):
     self._expand_mappings(model)
     super().expand()
     self._check_consistency(model)
+    self._record('expand', model)
 
   def update(self, models: List[ModelPath], scores: List[float]):
     assert len(models) == 2, models
     sids = tuple([self._model2sid[model] for model in models if model])
     super().update(sids, scores)
+    self._record('update', models, scores)
+
+  def update_batch(self, models_batch: List[List[ModelPath]], scores_batch: List[List[float]]):
+    for models in models_batch:
+      assert len(models) == 2, models
+    sids_batch = [tuple([self._model2sid[model] for model in models if model]) 
+      for models in models_batch]
+    super().update_batch(sids_batch, scores_batch)
+    self._record('update_batch', models_batch, scores_batch)
     # print('Payoffs', *self._payoffs, 'Counts', *self._counts, sep='\n')
 
   """ Implementations """
   def _expand_mappings(self, model: ModelPath):
     assert isinstance(model, ModelPath), model
     assert model not in self._model2sid, f'Model({model}) is already in {list(self._model2sid)}'
-    sid = self._payoffs.shape[0]
+    sid = self._size
     self._model2sid[model] = sid
     self._sid2model.append(model)
     assert len(self._sid2model) == sid+1, (sid, self._sid2model)
 
   def _check_consistency(self, model: ModelPath):
-    assert self._payoffs.shape[0] == self._model2sid[model] + 1, \
-      (self._payoffs.shape[0], self._model2sid[model] + 1)
-    assert self._counts.shape[0] == self._model2sid[model] + 1, \
-      (self._counts.shape[0], self._model2sid[model] + 1)
+    assert self._size == self._model2sid[model] + 1, \
+      (self._size, self._model2sid[model] + 1)
+    assert self._payoffs.shape[0] >= self._size, (self._payoffs.shape[0], self._size)
+    assert self._counts.shape[0] >= self._size, (self._counts.shape[0], self._size)
+
+
+def _update_cells(payoff, count, cells, sums, totals, step_size):
+  """ Updates payoff and count at cells with scores summing to sums in 
+  order, where cells is a sequence of index arrays, one per dimension """
+  if len(sums) == 0:
+    return
+  idxes = np.ravel_multi_index(tuple(cells), payoff.shape)
+  if step_size == 0 or step_size is None:
+    # averages over the entire history do not depend on the order
+    idxes, inverse = np.unique(idxes, return_inverse=True)
+    _update_unique_cells(payoff, count, idxes, 
+      np.bincount(inverse, sums), np.bincount(inverse, totals), step_size)
+    return
+  # cells updated repeatedly are updated in rounds by their occurrences
+  order = np.argsort(idxes, kind='stable')
+  sorted_idxes = idxes[order]
+  starts = np.flatnonzero(np.r_[True, sorted_idxes[1:] != sorted_idxes[:-1]])
+  occurrences = np.empty_like(order)
+  occurrences[order] = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+  for i in range(occurrences.max() + 1):
+    mask = occurrences == i
+    _update_unique_cells(
+      payoff, count, idxes[mask], sums[mask], totals[mask], step_size)
+
+
+def _update_unique_cells(payoff, count, idxes, sums, totals, step_size):
+  c = count.flat[idxes]
+  p = payoff.flat[idxes].astype(np.float64)
+  if step_size == 0 or step_size is None:
+    new_p = (c * p + sums) / (c + totals)
+  else:
+    new_p = p + step_size * (sums / totals - p)
+  new_p = np.where(c == 0, sums / totals, new_p)
+  assert not np.any(np.isnan(new_p)), (c, p)
+  payoff.flat[idxes] = new_p
+  count.flat[idxes] = c + totals.astype(count.dtype)
@@ -1,5 +1,6 @@
 import numpy as np
 
+from game.meta_solver import compute_strategy_utilities
 from game.utils import compute_utility
 
 
@@ -27,6 +28,12 @@ class RegretMatching:
     u_sigma = self.meta_strategies[aid] @ u_sigma
     self.regrets[aid][sid] = self.regrets[aid][sid] + u_pi - u_sigma
 
+  def update_all_regrets(self, payoffs):
+    """ Update regrets of all strategies of all agents at once """
+    utilities = compute_strategy_utilities(payoffs, self.meta_strategies)
+    for aid, u_sigma in enumerate(utilities):
+      self.regrets[aid] += u_sigma - self.meta_strategies[aid] @ u_sigma
+
   def update_meta_strategy(self, aid):
     r_plus = np.maximum(0, self.regrets[aid])
     r_plus_total = sum(r_plus)
@@ -41,9 +48,7 @@ class RegretMatching:
     for payoff in payoffs:
       assert payoff.shape == tuple([n_strategies for _ in range(n_agents)]), (payoff.shape, n_agents)
     for t in range(n_iterations):
-      for aid in range(n_agents):
-        for sid in range(n_strategies):
-          self.update_regrets(payoffs[aid], aid, sid)
+      self.update_all_regrets(payoffs)
       for aid in range(n_agents):
         self.update_meta_strategy(aid)
 
@@ -0,0 +1,193 @@
+from typing import List, Tuple
+
+
+CHANCE = -1
+TERMINAL = -4
+
+
+class GameState:
+  """ The subset of pyspiel.State used to enumerate game trees
+
+  Subclasses describe small extensive-form games in pure Python, so
+  that they can be solved by game.cfr without OpenSpiel. Players are
+  numbered from 0. Chance and terminal states return CHANCE and
+  TERMINAL as their current players, as in OpenSpiel.
+  """
+  def current_player(self) -> int:
+    raise NotImplementedError
+
+  def is_terminal(self) -> bool:
+    return self.current_player() == TERMINAL
+
+  def is_chance_node(self) -> bool:
+    return self.current_player() == CHANCE
+
+  def is_simultaneous_node(self) -> bool:
+    return False
+
+  def chance_outcomes(self) -> List[Tuple[int, float]]:
+    raise NotImplementedError
+
+  def legal_actions(self, player: int=None) -> List[int]:
+    raise NotImplementedError
+
+  def information_state_string(self, player: int=None) -> str:
+    raise NotImplementedError
+
+  def child(self, action: int) -> 'GameState':
+    raise NotImplementedError
+
+  def returns(self) -> List[float]:
+    raise NotImplementedError
+
+
+class KuhnPokerState(GameState):
+  """ Kuhn poker with cards 0 < 1 < 2 and actions pass (0) and bet (1) """
+  TERMINALS = ('pp', 'bp', 'bb', 'pbp', 'pbb')
+
+  def __init__(self, cards=(), history=''):
+    self.cards = cards
+    self.history = history
+
+  def current_player(self):
+    if len(self.cards) < 2:
+      return CHANCE
+    if self.history in self.TERMINALS:
+      return TERMINAL
+    return len(self.history) % 2
+
+  def chance_outcomes(self):
+    cards = [c for c in range(3) if c not in self.cards]
+    return [(c, 1 / len(cards)) for c in cards]
+
+  def legal_actions(self, player=None):
+    return [0, 1]
+
+  def information_state_string(self, player=None):
+    if player is None:
+      player = self.current_player()
+    return f'{self.cards[player]}{self.history}'
+
+  def child(self, action):
+    if self.is_chance_node():
+      return KuhnPokerState(self.cards + (action,), self.history)
+    return KuhnPokerState(self.cards, self.history + 'pb'[action])
+
+  def returns(self):
+    if self.history == 'bp':
+      return [1., -1.]
+    if self.history == 'pbp':
+      return [-1., 1.]
+    stake = 1. if self.history == 'pp' else 2.
+    winner = 0 if self.cards[0] > self.cards[1] else 1
+    return [stake, -stake] if winner == 0 else [-stake, stake]
+
+
+class LeducPokerState(GameState):
+  """ Leduc poker with two suits of three ranks and actions fold (0),
+  call (1) and raise (2)
+
+  Each player antes 1 and is dealt a private card. Two betting rounds
+  with raises of 2 and 4 are separated by dealing a public card, and
+  at most two raises are allowed per round. Player 0 acts first in
+  both rounds. Pairing the public card wins at showdown, otherwise
+  the higher rank wins. Card c has rank c // 2.
+  """
+  N_CARDS = 6
+  RAISE_AMOUNTS = (2, 4)
+  MAX_RAISES = 2
+
+  def __init__(self, private=(), public=None, rounds=('',), pot=(1, 1), folded=None):
+    self.private = private
+    self.public = public
+    self.rounds = rounds
+    self.pot = pot
+    self.folded = folded
+
+  def current_player(self):
+    if len(self.private) < 2:
+      return CHANCE
+    if self.folded is not None:
+      return TERMINAL
+    if _is_round_over(self.rounds[-1]):
+      return TERMINAL if len(self.rounds) == 2 else CHANCE
+    return len(self.rounds[-1]) % 2
+
+  def chance_outcomes(self):
+    dealt = self.private + (() if self.public is None else (self.public,))
+    cards = [c for c in range(self.N_CARDS) if c not in dealt]
+    return [(c, 1 / len(cards)) for c in cards]
+
+  def legal_actions(self, player=None):
+    history = self.rounds[-1]
+    actions = [0, 1] if history.endswith('r') else [1]
+    if history.count('r') < self.MAX_RAISES:
+      actions.append(2)
+    return actions
+
+  def information_state_string(self, player=None):
+    if player is None:
+      player = self.current_player()
+    return f'{player}:{self.private[player]}:{self.public}:{"/".join(self.rounds)}'
+
+  def child(self, action):
+    if self.is_chance_node():
+      if len(self.private) < 2:
+        return LeducPokerState(self.private + (action,))
+      return LeducPokerState(
+        self.private, action, self.rounds + ('',), self.pot)
+    player = self.current_player()
+    pot = list(self.pot)
+    folded = None
+    if action == 0:
+      folded = player
+    elif action == 1:
+      pot[player] = max(pot)
+    else:
+      pot[player] = max(pot) + self.RAISE_AMOUNTS[len(self.rounds) - 1]
+    rounds = self.rounds[:-1] + (self.rounds[-1] + 'fcr'[action],)
+    return LeducPokerState(
+      self.private, self.public, rounds, tuple(pot), folded)
+
+  def returns(self):
+    if self.folded is not None:
+      loser = self.folded
+    else:
+      ranks = [c // 2 for c in self.private]
+      public_rank = self.public // 2
+      strengths = [(r == public_rank, r) for r in ranks]
+      if strengths[0] == strengths[1]:
+        return [0., 0.]
+      loser = 0 if strengths[0] < strengths[1] else 1
+    returns = [float(self.pot[loser])] * 2
+    returns[loser] = -returns[loser]
+    return returns
+
+
+class TabularGame:
+  """ A game of GameStates with the interface of pyspiel.Game used by
+  game.cfr """
+  def __init__(self, state_cls, n_players=2):
+    self.state_cls = state_cls
+    self.n_players = n_players
+
+  def new_initial_state(self):
+    return self.state_cls()
+
+  def num_players(self):
+    return self.n_players
+
+
+def load_game(name: str):
+  """ Loads a pure Python game, or an OpenSpiel game otherwise """
+  if name == 'kuhn_poker':
+    return TabularGame(KuhnPokerState)
+  elif name == 'leduc_poker':
+    return TabularGame(LeducPokerState)
+  import pyspiel
+  return pyspiel.load_game(name)
+
+
+""" Implementation """
+def _is_round_over(history):
+  return len(history) >= 2 and history[-1] == 'c'
@@ -1,6 +1,7 @@
 import collections
 import logging
 import time
+import weakref
 import numpy as np
 
 from core.elements.buffer import Buffer
@@ -8,8 +9,9 @@ from core.elements.model import Model
 from tools.log import do_logging
 from core.typing import AttrDict, dict2AttrDict
 from tools.display import print_dict_info
-from tools.tree_ops import tree_map
-from tools.utils import batch_dicts, batch_states, stack_data_with_state
+from tools.tree_ops import tree_flatten, tree_map, tree_unflatten
+from tools.utils import batch_dicts, batch_states
+from replay.ds.shared_memory import SharedArrays, SharedMemorySlot, create_slot_flags
 from replay import replay_registry
 
 logger = logging.getLogger(__name__)
@@ -52,42 +54,114 @@ class LocalBuffer(Buffer):
     return self._size >= self.n_steps
 
   def reset(self):
+    """ Drops references to the arrays of the previous rollout, so data 
+    retrieved before stays intact. New arrays are allocated on the 
+    next add """
     self._size = 0
-    self._buffer = collections.defaultdict(list)
-
-  def add(self, **data):
-    # self._replace_obs_with_next_obs(data)
-    for k, v in data.items():
-      self._buffer[k].append(v)
-    self._size += 1
+    # number of steps added for each env
+    self._env_steps = np.zeros(self.n_envs, dtype=np.int64)
+    # key -> [structure, leaf arrays, number of steps, capacity]
+    self._buffer = {}
+
+  def add(self, idxes=None, **data):
+    """ Adds a step of all envs, or of envs idxes when envs are stepped 
+    asynchronously, in which case each env is written at its own next 
+    step. The buffer is as large as the env with the fewest steps """
+    if idxes is None:
+      for k, v in data.items():
+        self._write(k, v, self._size)
+      self._env_steps += 1
+    else:
+      idxes = np.asarray(idxes)
+      steps = self._env_steps[idxes]
+      for k, v in data.items():
+        self._write(k, v, steps, idxes)
+      self._env_steps[idxes] += 1
+    self._size = int(self._env_steps.min())
 
   def retrieve_all_data(self, latest_piece=None):
     # assert self._size == self.n_steps, (self._size, self.n_steps)
     if latest_piece is not None:
       for k, v in latest_piece.items():
         if k in self._buffer:
-          self._buffer[k].append(v)
-    data = stack_data_with_state(self._buffer, self.sample_keys)
+          self._write(k, v, self._size)
+    data = self._stack_data(self.sample_keys)
     self.reset()
 
     return self.runner_id, data, self.n_envs * self.n_steps
 
-  def _replace_obs_with_next_obs(self, data):
-    if f'next_{self.obs_keys[0]}' not in data:
-      return
-    if self.config.timeout_done:
-      # for environments that treat timeout as done, 
-      # we do not separately record obs and next obs
-      # instead, we record n+1 obs 
-      if self._size == 0:
-        for k in self.obs_keys:
-          assert data[k].shape == data[f'next_{k}'].shape, (data[k].shape, data[f'next_{k}'].shape)
-          # add the first obs when buffer is empty
-          self._buffer[k].append(data[k])
-          data[k] = data.pop(f'next_{k}')
+  """ Implementation """
+  def _write(self, key, value, step, idxes=None):
+    """ Writes value at step of all envs, or at steps of envs idxes """
+    leaves, structure = tree_flatten(value)
+    if key not in self._buffer:
+      n_envs = None if idxes is None else self.n_envs
+      arrays = [_allocate_steps(v, self.n_steps + 1, n_envs) for v in leaves]
+      self._buffer[key] = [structure, arrays, 0, self.n_steps + 1]
+    _, arrays, n, capacity = self._buffer[key]
+    assert len(arrays) == len(leaves), (key, len(arrays), len(leaves))
+    last_step = int(np.max(step))
+    if last_step >= capacity:
+      # more steps than expected, e.g., when collecting running stats
+      arrays[:] = [_grow_steps(x) for x in arrays]
+      self._buffer[key][3] = 2 * capacity
+    for x, v in zip(arrays, leaves):
+      if x is not None:
+        if idxes is None:
+          x[:, step] = v
+        else:
+          x[idxes, step] = v
+    self._buffer[key][2] = max(n, last_step + 1)
+
+  def _stack_data(self, keys):
+    """ Returns data in the same layout as stack_data_with_state, 
+    with views of the preallocated arrays """
+    def get(k):
+      structure, arrays, n, _ = self._buffer[k]
+      return _remove_none(tree_unflatten(
+        structure, [None if x is None else x[:, :n] for x in arrays]))
+
+    data = AttrDict(action=AttrDict())
+    for k in keys:
+      if k not in self._buffer:
+        continue
+      if k == 'action':
+        data[k].update(get(k))
+      elif k == 'action_mask':
+        data['action'].update({f'{k}_mask': v for k, v in get(k).items()})
+      elif k == 'prev_info':
+        for kk in self._buffer:
+          if k in kk:
+            data[kk] = get(kk)
       else:
-        for k in self.obs_keys:
-          data[k] = data.pop(f'next_{k}')
+        data[k] = get(k)
+
+    return data
+
+
+def _allocate_steps(x, n_steps, n_envs=None):
+  """ Allocates an array of shape [n_envs, n_steps, ...] for leaves 
+  of shape [n_envs, ...], or of shape [n, ...] for n of n_envs envs. 
+  None and strings are ignored as in batch_dicts """
+  if x is None or isinstance(x, str):
+    return None
+  x = np.asarray(x)
+  if x.dtype.kind == 'U':
+    return None
+  n_envs = x.shape[0] if n_envs is None else n_envs
+  return np.empty((n_envs, n_steps, *x.shape[1:]), dtype=x.dtype)
+
+
+def _grow_steps(x):
+  if x is None:
+    return x
+  return np.concatenate([x, np.empty_like(x)], 1)
+
+
+def _remove_none(x):
+  if isinstance(x, dict):
+    return type(x)({k: _remove_none(v) for k, v in x.items() if v is not None})
+  return x
 
 
 @replay_registry.register('ac')
@@ -116,6 +190,17 @@ class ACBuffer(Buffer):
       self.aid, 
     )
 
+    # transport of runner data, object or shm
+    self._transport = self.config.get('transport', 'object')
+    self._n_shm_slots = self.config.get('n_shm_slots', 2)
+    self._shm_slots = None
+    self._shm_flags = None
+    self._shm_structure = None
+    self._shm_rows = None
+    self._shm_finalizer = None
+    # incremented on reset to drop slots written before
+    self._shm_epoch = 0
+
     self.reset()
 
     self._sleep_time = 0.025
@@ -138,6 +223,15 @@ class ACBuffer(Buffer):
     self._queue = collections.deque(maxlen=self.config.get('queue_len', 1))
     self._memory = []
     self._current_size = 0
+    if self._shm_flags is not None:
+      # releases rows whose slots have been received, while those still 
+      # in flight are released when their stale slots arrive
+      flags, epoch = self._shm_flags.arrays
+      for slot, filled in enumerate(self._shm_filled):
+        flags[slot, list(filled)] = 0
+      self._shm_epoch += 1
+      epoch[0] = self._shm_epoch
+    self._shm_filled = [set() for _ in range(self._n_shm_slots)]
 
   """ Filling Methods """  
   def add_last_value(self, value):
@@ -151,8 +245,59 @@ class ACBuffer(Buffer):
     assert len(self._buffer) == 0, self._buffer
     self._buffer['obs'] = data['obs']
 
+  def get_shared_memory_slots(self, rid: int, structure, specs):
+    """ Returns the handles of the shared memory slots and the rows 
+    runner rid writes into. The slots are allocated on the first call, 
+    where each leaf of a runner's data, described by specs, takes 
+    n_runners times its rows along the first axis """
+    assert self._transport == 'shm', self._transport
+    assert 0 <= rid < self.n_runners, (rid, self.n_runners)
+    n = specs[0][0][0]
+    for shape, _ in specs:
+      assert shape[0] == n, f'Inconsistent numbers of rows: {specs}'
+    if self._shm_slots is None:
+      self._shm_structure = structure
+      self._shm_rows = n
+      full_specs = [((self.n_runners * shape[0], *shape[1:]), dtype) 
+        for shape, dtype in specs]
+      self._shm_slots = [SharedArrays(full_specs) for _ in range(self._n_shm_slots)]
+      self._shm_flags = create_slot_flags(self._n_shm_slots, self.n_runners)
+      self._shm_flags.arrays[1][0] = self._shm_epoch
+      # unlinks the segments if the buffer is collected without closing
+      self._shm_finalizer = weakref.finalize(
+        self, _close_shared_arrays, self._shm_slots + [self._shm_flags])
+    else:
+      assert structure == self._shm_structure, (structure, self._shm_structure)
+      assert n == self._shm_rows, (n, self._shm_rows)
+      full_specs = self._shm_slots[0].specs
+      assert len(full_specs) == len(specs), (len(full_specs), len(specs))
+      for (fs, fd), (s, d) in zip(full_specs, specs):
+        assert fs == (self.n_runners * s[0], *s[1:]) and fd == np.dtype(d), \
+          (fs, fd, s, d)
+    return dict(
+      handles=[s.handle for s in self._shm_slots], 
+      flags=self._shm_flags.handle, 
+      rid=rid, 
+      rows=(rid * n, (rid + 1) * n), 
+    )
+
+  def close_shared_memory(self):
+    """ Closes and unlinks the shared memory slots. Runners should 
+    have released them before """
+    if self._shm_slots is not None:
+      self._shm_finalizer()
+      self._shm_finalizer = None
+      self._shm_slots = None
+      self._shm_flags = None
+
+  def close(self):
+    self.close_shared_memory()
+
   def merge_data(self, rid: int, data: dict, n: int):
     """ Merging Data from Other Buffers """
+    if isinstance(data, SharedMemorySlot):
+      self._merge_shared_data(rid, data)
+      return
     for k, v in data.items():
       self._buffers[rid][k].append(v)
     self._current_size += n
@@ -191,6 +336,25 @@ class ACBuffer(Buffer):
       self._buffers = collections.defaultdict(lambda: collections.defaultdict(list))
       self._current_size = 0
 
+  def _merge_shared_data(self, rid: int, data: SharedMemorySlot):
+    """ Data of all runners are already in place, so the batch is copied 
+    out of the slot at once when every runner has written its rows. The 
+    rows are then released for runners to write the next rollouts """
+    slot = data.slot
+    if data.epoch != self._shm_epoch:
+      # written before the last reset
+      self._shm_flags.arrays[0][slot, rid] = 0
+      return
+    filled = self._shm_filled[slot]
+    assert rid not in filled, f'Runner {rid} overwrote slot {slot} before it was consumed'
+    filled.add(rid)
+    if len(filled) == self.n_runners:
+      data = tree_unflatten(self._shm_structure, self._shm_slots[slot].arrays)
+      data = tree_map(lambda x: x[-self.batch_size:].copy(), data)
+      self._queue.append(dict2AttrDict(data, shallow=True))
+      filled.clear()
+      self._shm_flags.arrays[0][slot] = 0
+
   def get_data(self, last_piece=None):
     _, data, _ = self._buffer.retrieve_all_data(last_piece)
     return data
@@ -236,6 +400,11 @@ class ACBuffer(Buffer):
     self._queue.clear()
 
 
+def _close_shared_arrays(shared_arrays):
+  for s in shared_arrays:
+    s.close()
+
+
 def create_buffer(config, model, env_stats, **kwargs):
   config = dict2AttrDict(config)
   env_stats = dict2AttrDict(env_stats)
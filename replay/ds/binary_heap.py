@@ -0,0 +1,95 @@
+import numpy as np
+
+
+class IndexedBinaryHeap:
+  """ An array-based max-heap over priorities of memory indices
+
+  Heap positions serve as approximate ranks: position 0 holds the
+  highest priority and a position p roughly corresponds to rank p+1.
+  Since a sorted array is a valid heap, the approximation is tightened
+  by periodically re-sorting the array with rebalance.
+  """
+  def __init__(self, capacity):
+    self._capacity = int(capacity)
+    self._priorities = np.zeros(self._capacity)
+    self._mem_idxes = np.zeros(self._capacity, dtype=np.int64)
+    # heap position of each memory index, -1 if absent
+    self._positions = np.full(self._capacity, -1, dtype=np.int64)
+    self._size = 0
+
+  def __len__(self):
+    return self._size
+
+  @property
+  def max_priority(self):
+    return self._priorities[0] if self._size > 0 else None
+
+  def get_mem_idxes(self, positions):
+    return self._mem_idxes[positions]
+
+  def get_priorities(self, mem_idxes):
+    return self._priorities[self._positions[mem_idxes]]
+
+  def batch_update(self, mem_idxes, priorities):
+    """ Inserts new memory indices and updates existing ones """
+    # python scalars are much faster than numpy scalars for element-wise access
+    for i, p in zip(np.asarray(mem_idxes).tolist(), np.asarray(priorities).tolist()):
+      self.update(i, p)
+
+  def update(self, mem_idx, priority):
+    pos = int(self._positions[mem_idx])
+    if pos < 0:
+      pos = self._size
+      self._size += 1
+      self._mem_idxes[pos] = mem_idx
+      self._positions[mem_idx] = pos
+      self._priorities[pos] = priority
+      self._sift_up(pos)
+    else:
+      old = self._priorities[pos]
+      self._priorities[pos] = priority
+      if priority > old:
+        self._sift_up(pos)
+      elif priority < old:
+        self._sift_down(pos)
+
+  def rebalance(self):
+    """ Sorts the heap in descending order of priorities """
+    n = self._size
+    order = np.argsort(-self._priorities[:n], kind='stable')
+    self._priorities[:n] = self._priorities[order]
+    self._mem_idxes[:n] = self._mem_idxes[order]
+    self._positions[self._mem_idxes[:n]] = np.arange(n)
+
+  """ Implementation """
+  def _swap(self, i, j):
+    pri, idx = self._priorities, self._mem_idxes
+    pri[i], pri[j] = pri[j], pri[i]
+    idx[i], idx[j] = idx[j], idx[i]
+    self._positions[idx[i]] = i
+    self._positions[idx[j]] = j
+
+  def _sift_up(self, pos):
+    pri = self._priorities
+    while pos > 0:
+      parent = (pos - 1) // 2
+      if pri[parent] >= pri[pos]:
+        break
+      self._swap(pos, parent)
+      pos = parent
+
+  def _sift_down(self, pos):
+    pri = self._priorities
+    n = self._size
+    while True:
+      left = 2 * pos + 1
+      if left >= n:
+        break
+      child = left
+      right = left + 1
+      if right < n and pri[right] > pri[left]:
+        child = right
+      if pri[pos] >= pri[child]:
+        break
+      self._swap(pos, child)
+      pos = child
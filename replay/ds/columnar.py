@@ -0,0 +1,117 @@
+import numpy as np
+
+from core.typing import AttrDict
+from tools.tree_ops import tree_flatten, tree_unflatten, tree_map
+
+
+class ColumnarStorage:
+  """ A FIFO ring buffer that stores each key in a contiguous array
+
+  Arrays are preallocated the first time data arrives. Indices passed
+  to the public interface are logical, i.e., 0 refers to the oldest
+  transition, mirroring the indexing of collections.deque.
+  """
+  def __init__(self, capacity):
+    self._capacity = int(capacity)
+    self._memory = {}     # key -> list of leaf arrays of shape [capacity, ...]
+    self._structs = {}    # key -> tree structure of the leaves
+    self._idx = 0         # the next physical index to write
+    self._size = 0
+
+  @property
+  def maxlen(self):
+    return self._capacity
+
+  def __len__(self):
+    return self._size
+
+  def __getitem__(self, idx):
+    """ Returns the transition at logical index idx as a dict """
+    if idx < 0:
+      idx += self._size
+    if not 0 <= idx < self._size:
+      raise IndexError(f'index {idx} out of range for storage of size {self._size}')
+    i = self._physical_idxes(idx)
+    return {k: tree_unflatten(self._structs[k], [v[i].copy() for v in leaves])
+      for k, leaves in self._memory.items()}
+
+  def __iter__(self):
+    for i in range(self._size):
+      yield self[i]
+
+  def is_initialized(self):
+    return self._memory != {}
+
+  def clear(self):
+    self._idx = 0
+    self._size = 0
+
+  def append(self, traj):
+    self.extend([traj])
+
+  def extend(self, trajs):
+    """ Writes a list of transitions at the cycling index """
+    if len(trajs) == 0:
+      return
+    if not self.is_initialized():
+      self._init(trajs[0])
+    leaves = {}
+    for k in self._memory:
+      vals = [tree_flatten(traj[k])[0] for traj in trajs]
+      leaves[k] = [np.stack(x) for x in zip(*vals)]
+    self._write(leaves, len(trajs))
+
+  def extend_batch(self, data):
+    """ Writes a dict of batched transitions at the cycling index """
+    n = len(tree_flatten(data['reward'])[0][0])
+    if n == 0:
+      return
+    if not self.is_initialized():
+      self._init(tree_map(lambda x: x[0], data))
+    leaves = {k: tree_flatten(data[k])[0] for k in self._memory}
+    self._write(leaves, n)
+
+  def get(self, idxes, keys=None):
+    """ Gathers transitions at logical indices through fancy indexing """
+    idxes = self._physical_idxes(np.asarray(idxes))
+    if keys is None:
+      keys = self._memory.keys()
+    samples = AttrDict()
+    for k in keys:
+      if k not in self._memory:
+        continue
+      samples[k] = tree_unflatten(
+        self._structs[k], [v[idxes] for v in self._memory[k]])
+    return samples
+
+  """ Implementation """
+  def _write(self, leaves, n):
+    # only the last capacity transitions survive a write larger than the storage
+    if n > self._capacity:
+      leaves = {k: [x[-self._capacity:] for x in v] for k, v in leaves.items()}
+      self._idx = (self._idx + n - self._capacity) % self._capacity
+      n = self._capacity
+    idxes = np.arange(self._idx, self._idx + n) % self._capacity
+    for k, v in self._memory.items():
+      for dest, src in zip(v, leaves[k]):
+        dest[idxes] = src
+    self._idx = (self._idx + n) % self._capacity
+    self._size = min(self._size + n, self._capacity)
+
+  def _init(self, traj):
+    for k, v in traj.items():
+      leaves, struct = tree_flatten(v)
+      if any([x is None or isinstance(x, str) for x in leaves]):
+        # strings and None are ignored, consistent with batch_dicts
+        continue
+      leaves = [np.asarray(x) for x in leaves]
+      self._structs[k] = struct
+      self._memory[k] = [
+        self._allocate(k, i, x.shape, x.dtype) for i, x in enumerate(leaves)]
+
+  def _allocate(self, key, i, shape, dtype):
+    return np.zeros((self._capacity, *shape), dtype=dtype)
+
+  def _physical_idxes(self, idxes):
+    start = self._idx if self._size == self._capacity else 0
+    return (start + idxes) % self._capacity
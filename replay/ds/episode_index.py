@@ -0,0 +1,103 @@
+import collections
+import numpy as np
+
+
+class EpisodeIndex:
+  """ A FIFO index of episode keys and lengths
+
+  Arrays of keys, lengths and cumulative numbers of sequence start
+  positions are rebuilt lazily after the index changes, so that
+  sampling (episode, offset) pairs is a few vectorized operations.
+  """
+  def __init__(self):
+    self._keys = collections.deque()
+    self._lengths = collections.deque()
+
+    self._key_array = None
+    self._length_array = None
+    self._cumsums = {}    # sample_size -> cumulative numbers of start positions
+    self._long_eids = {}  # sample_size -> ids of episodes of at least sample_size steps
+
+  def __len__(self):
+    return len(self._keys)
+
+  def __contains__(self, key):
+    return key in self._keys
+
+  def __iter__(self):
+    return iter(self._keys)
+
+  def append(self, key, length):
+    self._keys.append(key)
+    self._lengths.append(length)
+    self._invalidate()
+
+  def popleft(self):
+    self._lengths.popleft()
+    self._invalidate()
+    return self._keys.popleft()
+
+  def remove(self, keys):
+    """ Removes keys in a set of keys """
+    items = [(k, l) for k, l in zip(self._keys, self._lengths) if k not in keys]
+    self._keys = collections.deque(k for k, _ in items)
+    self._lengths = collections.deque(l for _, l in items)
+    self._invalidate()
+
+  def n_steps(self):
+    return sum(self._lengths)
+
+  def sample(self, batch_size, sample_size, n=None, length_weighted=False):
+    """ Samples (episode key, offset) pairs from the most recent n episodes
+
+    Episodes are sampled uniformly by default. If length_weighted,
+    every valid sequence start is equally likely, which gives uniform
+    sampling over time steps. Episodes shorter than sample_size are 
+    never sampled.
+    """
+    self._build()
+    n_eps = len(self)
+    start = 0 if n is None else max(n_eps - n, 0)
+    if length_weighted:
+      cumsum = self._get_cumsum(sample_size)
+      low = cumsum[start-1] if start > 0 else 0
+      assert cumsum[-1] > low, \
+        f'No episode has at least {sample_size} steps to sample from'
+      positions = np.random.randint(low, cumsum[-1], size=batch_size)
+      eids = np.searchsorted(cumsum, positions, side='right')
+      offsets = positions - np.where(eids > 0, cumsum[eids-1], 0)
+    else:
+      eids = self._get_long_eids(sample_size)
+      eids = eids[eids >= start]
+      assert len(eids) > 0, \
+        f'No episode has at least {sample_size} steps to sample from'
+      eids = eids[np.random.randint(len(eids), size=batch_size)]
+      n_starts = self._length_array[eids] - sample_size + 1
+      offsets = (np.random.uniform(size=batch_size) * n_starts).astype(np.int64)
+
+    return self._key_array[eids], offsets
+
+  """ Implementation """
+  def _invalidate(self):
+    self._key_array = None
+    self._length_array = None
+    self._cumsums = {}
+    self._long_eids = {}
+
+  def _build(self):
+    if self._key_array is None:
+      self._key_array = np.empty(len(self._keys), dtype=object)
+      self._key_array[:] = list(self._keys)
+      self._length_array = np.array(self._lengths, dtype=np.int64)
+
+  def _get_long_eids(self, sample_size):
+    if sample_size not in self._long_eids:
+      self._long_eids[sample_size] = np.nonzero(
+        self._length_array >= sample_size)[0]
+    return self._long_eids[sample_size]
+
+  def _get_cumsum(self, sample_size):
+    if sample_size not in self._cumsums:
+      n_starts = np.maximum(self._length_array - sample_size + 1, 0)
+      self._cumsums[sample_size] = np.cumsum(n_starts)
+    return self._cumsums[sample_size]
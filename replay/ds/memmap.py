@@ -0,0 +1,69 @@
+import os
+import numpy as np
+
+from tools.pickle import save, restore
+from replay.ds.columnar import ColumnarStorage
+
+
+class MemmapStorage(ColumnarStorage):
+  """ A ColumnarStorage whose arrays are np.memmap files in filedir
+
+  Each leaf is kept in a separate file, so only the pages touched by
+  writes and samples are resident. The layout and write position are
+  recorded in a small metadata file by save; storages created on a
+  directory with metadata reopen the existing files without copying.
+  """
+  def __init__(self, capacity, filedir):
+    super().__init__(capacity)
+    self._filedir = filedir
+    os.makedirs(self._filedir, exist_ok=True)
+    self._meta = {}   # key -> list of (shape, dtype) of the leaves
+    self._reopen()
+
+  def flush(self):
+    for leaves in self._memory.values():
+      for v in leaves:
+        v.flush()
+
+  def save(self):
+    if not self.is_initialized():
+      return
+    self.flush()
+    meta = dict(
+      capacity=self._capacity,
+      idx=self._idx,
+      size=self._size,
+      structs=self._structs,
+      meta=self._meta,
+    )
+    save(meta, filedir=self._filedir, filename='meta',
+      name='memmap meta', to_print=False, atomic=True)
+
+  """ Implementation """
+  def _allocate(self, key, i, shape, dtype):
+    if i == 0:
+      self._meta[key] = []
+    self._meta[key].append((shape, dtype))
+    return self._open_leaf(key, i, shape, dtype, mode='w+')
+
+  def _reopen(self):
+    meta = restore(filedir=self._filedir, filename='meta',
+      default=None, name='memmap meta', to_print=False)
+    if meta is None:
+      return
+    assert meta['capacity'] == self._capacity, (
+      f'Inconsistent capacity: {meta["capacity"]} in {self._filedir} vs. {self._capacity}')
+    self._idx = meta['idx']
+    self._size = meta['size']
+    self._structs = meta['structs']
+    self._meta = meta['meta']
+    self._memory = {
+      k: [self._open_leaf(k, i, shape, dtype, mode='r+')
+        for i, (shape, dtype) in enumerate(m)]
+      for k, m in self._meta.items()
+    }
+
+  def _open_leaf(self, key, i, shape, dtype, mode):
+    filename = os.path.join(self._filedir, f'{key}-{i}.dat')
+    return np.memmap(
+      filename, dtype=dtype, mode=mode, shape=(self._capacity, *shape))
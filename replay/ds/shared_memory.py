@@ -0,0 +1,70 @@
+import collections
+import time
+import numpy as np
+
+from tools.shared_memory import SharedArrays, get_specs
+
+
+SharedMemorySlot = collections.namedtuple('SharedMemorySlot', 'slot epoch')
+
+
+class SharedMemoryWriter:
+  """ Writes rollouts of a runner into its rows of the learner's slots
+
+  Slots are used in a round-robin fashion. A runner marks its rows of a
+  slot as written, and the learner releases them once it has copied the
+  slot out. Before writing, a runner waits for its rows to be released,
+  so it is at most n_slots - 1 rollouts ahead of the learner and never
+  overwrites rows the learner has not consumed. Slots are tagged with 
+  the learner's epoch, so that the learner drops those written before 
+  it is reset.
+  """
+  def __init__(self, sleep_time=.001):
+    self._slots = None
+    self._flags = None
+    self._epoch = None
+    self._rid = None
+    self._rows = None
+    self._next_slot = 0
+    self._sleep_time = sleep_time
+
+  def is_connected(self):
+    return self._slots is not None
+
+  def connect(self, info):
+    self._slots = [SharedArrays.attach(h) for h in info['handles']]
+    self._flags = SharedArrays.attach(info['flags'])
+    self._epoch = self._flags.arrays[1]
+    self._rid = info['rid']
+    self._rows = slice(*info['rows'])
+
+  def write(self, leaves):
+    slot = self._next_slot
+    flags = self._flags.arrays[0]
+    while flags[slot, self._rid]:
+      time.sleep(self._sleep_time)
+    arrays = self._slots[slot].arrays
+    assert len(arrays) == len(leaves), (len(arrays), len(leaves))
+    for x, v in zip(arrays, leaves):
+      x[self._rows] = v
+    epoch = int(self._epoch[0])
+    flags[slot, self._rid] = 1
+    self._next_slot = (slot + 1) % len(self._slots)
+    return SharedMemorySlot(slot, epoch)
+
+  def close(self):
+    if self._slots is not None:
+      for s in self._slots:
+        s.close()
+      self._flags.close()
+      self._slots = None
+      self._flags = None
+      self._epoch = None
+
+
+def create_slot_flags(n_slots, n_runners):
+  """ Flags of the rows of each runner in each slot, which are set by 
+  the runner after writing and cleared by the learner after reading, 
+  followed by the epoch of the learner """
+  return SharedArrays([((n_slots, n_runners), np.int8), ((1,), np.int64)])
+
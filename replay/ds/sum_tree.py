@@ -80,3 +80,118 @@ class SumTree:
       diffs = diffs[idxes >= 0]
       idxes = idxes[idxes >= 0]
       self._container[idxes] += diffs
+
+
+class VectorizedSumTree:
+  """ A sum tree padded to a power of two with an accompanying min tree
+
+  Nodes are stored in a 1-indexed heap: the root is at 1 and the 
+  children of node i are at 2i and 2i+1. Padding leaves have zero 
+  priority in the sum tree and infinite priority in the min tree, 
+  so they are never sampled and never affect the minimum.
+  """
+  def __init__(self, capacity):
+    self._capacity = int(capacity)
+    self._depth = max(int(np.ceil(np.log2(self._capacity))), 0)
+    self._n_leaves = 2**self._depth
+
+    self._sum_tree = np.zeros(2 * self._n_leaves)
+    self._min_tree = np.full(2 * self._n_leaves, np.inf)
+
+  @property
+  def total_priorities(self):
+    return self._sum_tree[1]
+
+  @property
+  def min_priority(self):
+    return self._min_tree[1]
+
+  def find(self, value):
+    priorities, idxes = self.batch_find(np.array([value]))
+    return priorities[0], idxes[0]
+
+  def batch_find(self, values):
+    """ Vectorized top-down search, one level at a time """
+    values = np.array(values, dtype=np.float64)
+    idxes = np.ones(values.shape, dtype=np.int64)
+    for _ in range(self._depth):
+      left = 2 * idxes
+      left_values = self._sum_tree[left]
+      # never step into an empty subtree due to floating point errors
+      go_right = (values > left_values) & (self._sum_tree[left + 1] > 0)
+      values = np.where(go_right, values - left_values, values)
+      idxes = left + go_right
+
+    return self._sum_tree[idxes], idxes - self._n_leaves
+
+  def stratified_find(self, batch_size, beta=None):
+    """ Draws one value from each of batch_size equal-width segments 
+    of the total priority
+
+    Returns the indices, priorities, and importance sampling ratios 
+    normalized by the maximum ratio, computed from the min tree. The 
+    ratios are None if beta is None.
+    """
+    total = self.total_priorities
+    segment = total / batch_size
+    values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * segment
+    priorities, idxes = self.batch_find(values)
+    if beta is None:
+      is_ratio = None
+    else:
+      # (N * p)**(-beta) / max((N * p)**(-beta)) = (min(p) / p)**beta
+      is_ratio = (self.min_priority / priorities)**beta
+
+    return idxes, priorities, is_ratio
+
+  def update(self, mem_idx, value):
+    self.batch_update(np.array([mem_idx]), np.array([value]))
+
+  def batch_update(self, mem_idxes, values):
+    """ Vectorized update
+
+    Parents are recomputed from their children instead of accumulating 
+    differences, so duplicate indices need no special treatment; 
+    for duplicate leaves, the last value takes effect. Values must be 
+    positive, which is checked by callers to keep this path O(log n).
+    """
+    idxes = np.asarray(mem_idxes) + self._n_leaves
+    self._sum_tree[idxes] = values
+    self._min_tree[idxes] = values
+    for _ in range(self._depth):
+      idxes = idxes // 2
+      left = 2 * idxes
+      self._sum_tree[idxes] = self._sum_tree[left] + self._sum_tree[left + 1]
+      self._min_tree[idxes] = np.minimum(
+        self._min_tree[left], self._min_tree[left + 1])
+
+
+if __name__ == '__main__':
+  import time
+
+  capacity = int(1e6)
+  n_iters = 100
+  for batch_size in [256, 1024]:
+    trees = [SumTree(capacity), VectorizedSumTree(capacity)]
+    init_priorities = np.random.uniform(.1, 1, size=capacity)
+    for tree in trees:
+      tree.batch_update(np.arange(capacity), init_priorities)
+    idxes = [np.random.choice(capacity, size=batch_size, replace=False) 
+      for _ in range(n_iters)]
+    priorities = [np.random.uniform(.1, 1, size=batch_size) for _ in range(n_iters)]
+    for tree in trees:
+      start = time.time()
+      for i, p in zip(idxes, priorities):
+        tree.batch_update(i, p)
+      update_time = (time.time() - start) / n_iters
+
+      start = time.time()
+      for _ in range(n_iters):
+        total = tree.total_priorities
+        intervals = np.linspace(0, total, batch_size+1)
+        values = np.random.uniform(intervals[:-1], intervals[1:])
+        tree.batch_find(values)
+      find_time = (time.time() - start) / n_iters
+      print(f'{type(tree).__name__}(capacity={capacity}, batch_size={batch_size}): '
+        f'batch_update {update_time*1000:.3g}ms, batch_find {find_time*1000:.3g}ms')
+    np.testing.assert_allclose(trees[0].total_priorities, trees[1].total_priorities)
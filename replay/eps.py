@@ -3,26 +3,108 @@ import collections
 from datetime import datetime
 import logging
 from pathlib import Path
-import random
+import queue
+import threading
 import uuid
+import weakref
 from typing import List
 import numpy as np
 
-from core.elements.buffer import Buffer
+from core.elements.buffer import Buffer, synchronized
 from core.elements.model import Model
 from tools.log import do_logging
 from core.typing import AttrDict
 from replay.local import EpisodicBuffer
+from replay.ds.episode_index import EpisodeIndex
 from replay.utils import load_data, save_data
-from tools.utils import batch_dicts, yield_from_tree
+from tools.tree_ops import tree_flatten, tree_unflatten
+from tools.utils import yield_from_tree
 from tools.display import print_dict_info
 from replay import replay_registry
 
 logger = logging.getLogger(__name__)
 
 
+class EpisodeWriter:
+  """ Writes episodes and removes files on a background thread
+
+  Requests are served in submission order. Pending requests are 
+  drained and handled together, and a removal cancels a write of 
+  the same file that has not started yet. Episodes are written to 
+  temporary files that are renamed when complete. Pending requests are 
+  handled when the writer is closed, collected, or the interpreter 
+  exits, and no request is accepted after closing.
+  """
+  def __init__(self, compress=True, max_batch=64):
+    self._queue = queue.Queue()
+    # the thread and the finalizer do not refer to the writer, so that 
+    # the writer is collected along with its owner
+    thread = threading.Thread(
+      target=_run_writer, args=(self._queue, compress, max_batch), daemon=True)
+    thread.start()
+    self._finalizer = weakref.finalize(self, _stop_writer, self._queue, thread)
+
+  @property
+  def closed(self):
+    return not self._finalizer.alive
+
+  def write(self, filename, episode):
+    self._put(filename, episode)
+
+  def remove(self, filename):
+    self._put(filename, None)
+
+  def flush(self):
+    """ Blocks until all submitted requests are handled """
+    self._queue.join()
+
+  def close(self):
+    """ Handles pending requests and stops the thread """
+    self._finalizer()
+
+  def _put(self, filename, episode):
+    if self.closed:
+      raise RuntimeError(f'EpisodeWriter is closed: {filename}')
+    self._queue.put((filename, episode))
+
+
+def _stop_writer(requests: queue.Queue, thread: threading.Thread):
+  requests.put((None, None))
+  thread.join()
+
+
+def _run_writer(requests: queue.Queue, compress, max_batch):
+  while True:
+    batch = [requests.get()]
+    while len(batch) < max_batch:
+      try:
+        batch.append(requests.get_nowait())
+      except queue.Empty:
+        break
+    removed = {f for f, eps in batch if eps is None}
+    stop = False
+    for filename, eps in batch:
+      try:
+        if filename is None:
+          stop = True
+        elif eps is None:
+          filename.unlink(missing_ok=True)
+        elif filename not in removed:
+          tmp_filename = filename.with_name(f'{filename.name}.tmp')
+          save_data(tmp_filename, eps, compress=compress)
+          os.replace(tmp_filename, filename)
+      except Exception as e:
+        do_logging(f'Failed to handle {filename}: {e}', 
+          logger=logger, level='warning')
+      requests.task_done()
+    if stop:
+      break
+
+
 @replay_registry.register('eps')
 class EpisodicReplay(Buffer):
+  is_synchronized = True
+
   def __init__(
     self, 
     config: AttrDict, 
@@ -41,14 +123,20 @@ class EpisodicReplay(Buffer):
     self._save = self.config.save
     if self._save:
       self._dir.mkdir(parents=True, exist_ok=True)
+      self._writer = EpisodeWriter(self.config.get('compress', True))
 
-    self._filenames = collections.deque()
+    self._index = EpisodeIndex()
     self._memory = {}
+    # episodes loaded lazily from files, in LRU order
+    self._cache = collections.OrderedDict()
+    self._cache_size = self.config.get('cache_size', 1000)
 
     self.max_episodes = self.config.get('max_episodes', 1000)
     self.min_episodes = self.config.get('min_episodes', 10)
     self.batch_size = self.config.batch_size
     self.n_recency = self.config.get('n_recency', self.min_episodes)
+    # sample uniformly over time steps instead of episodes
+    self.length_weighted = self.config.get('length_weighted', False)
 
     self._tmp_bufs: List[EpisodicBuffer] = [
       EpisodicBuffer(config, env_stats, model, aid, 0) 
@@ -59,11 +147,12 @@ class EpisodicReplay(Buffer):
     return len(self) >= self.min_episodes
 
   def __len__(self):
-    return len(self._filenames)
+    return len(self._index)
 
   def add(self, idxes=None, **data):
     if self.n_envs > 1:
-      for i, d in enumerate(yield_from_tree(data)):
+      idxes = range(self.n_envs) if idxes is None else idxes
+      for i, d in zip(idxes, yield_from_tree(data)):
         eps = self._tmp_bufs[i].add(**d)
         if eps is not None:
           self.merge(eps)
@@ -109,11 +198,14 @@ class EpisodicReplay(Buffer):
       raise ValueError(f'{i} of type {type(i)} is not supported')
     self.merge(episodes)
     
+  @synchronized
   def merge(self, episodes):
     if episodes is None:
       return
     if isinstance(episodes, dict):
       episodes = [episodes]
+    if self._save and self._writer.closed:
+      raise RuntimeError('Episodes are merged after the buffer is closed')
     timestamp = datetime.now().strftime('%Y%m%dT%H%M%S')
     for eps in episodes:
       epslen = len(next(iter(eps.values())))
@@ -124,8 +216,8 @@ class EpisodicReplay(Buffer):
       filename = self._dir / f'{timestamp}-{identifier}-{epslen}.npz'
       self._memory[filename] = eps
       if self._save:
-        save_data(filename, eps)
-      self._filenames.append(filename)
+        self._writer.write(filename, eps)
+      self._index.append(filename, epslen)
     if self._save:
       self._remove_file()
     else:
@@ -134,34 +226,44 @@ class EpisodicReplay(Buffer):
   def count_episodes(self):
     """ count the total number of episodes and transitions in the directory """
     if self._save:
-      filenames = self._dir.glob('*.npz')
       # subtract 1 as we don't take into account the terminal state
-      lengths = [int(n.stem.rsplit('-', 1)[-1]) - 1 for n in filenames]
+      lengths = [l - 1 for _, l in self._list_episode_files()]
       episodes, steps = len(lengths), sum(lengths)
       return episodes, steps
     else:
       return 0, 0
   
   def count_steps(self):
-    filenames = self._dir.glob('*.npz')
     # subtract 1 as we don't take into account the terminal state
-    lengths = [int(n.stem.rsplit('-', 1)[-1]) - 1 for n in filenames]
+    lengths = [l - 1 for _, l in self._list_episode_files()]
     episodes, steps = len(lengths), sum(lengths)
     return episodes, steps
 
+  def flush(self):
+    """ Waits until all episodes are written to disk """
+    if self._save:
+      self._writer.flush()
+
+  def close(self):
+    """ Writes pending episodes and stops the writer """
+    if self._save:
+      self._writer.close()
+
+  @synchronized
   def load_data(self):
-    if self._memory == {}:
-      # load data from files
-      for filename in self._dir.glob('*.npz'):
-        if filename not in self._memory:
-          data = load_data(filename)
-          if data is not None:
-            self._filenames.append(filename)
-            self._memory[filename] = data
-      do_logging(f'{len(self)} episodes are loaded', logger=logger)
+    """ Indexes episode files by the lengths in their names; 
+    episodes are loaded on first access """
+    if len(self) == 0:
+      # filenames start with timestamps, so sorting preserves FIFO order
+      for filename, epslen in sorted(self._list_episode_files()):
+        if self.sample_size and epslen < self.sample_size:
+          continue
+        self._index.append(filename, epslen)
+      do_logging(f'{len(self)} episodes are indexed', logger=logger)
     else:
       do_logging(f'There are already {len(self)} episodes in the memory. No further loading is performed', logger=logger)
 
+  @synchronized
   def sample(
     self, 
     batch_size=None, 
@@ -171,14 +273,13 @@ class EpisodicReplay(Buffer):
   ):
     if self.ready_to_sample():
       batch_size = batch_size or self.batch_size
-      samples = [self._sample(sample_keys, sample_size, squeeze)
-        for _ in range(batch_size)]
-      data = batch_dicts(samples)
+      data = self._sample(batch_size, sample_keys, sample_size, squeeze)
     else:
       data = None
 
     return data
   
+  @synchronized
   def sample_from_recency(
     self, 
     batch_size=None, 
@@ -191,51 +292,100 @@ class EpisodicReplay(Buffer):
     """
     batch_size = batch_size or self.batch_size
     n = n or self.n_recency
-    samples = batch_dicts(
-      [self._sample(sample_keys, sample_size, squeeze, n) 
-      for _ in range(batch_size)]
-    )
+    samples = self._sample(batch_size, sample_keys, sample_size, squeeze, n)
 
     return samples
 
-  def _sample(self, sample_keys=None, sample_size=None, squeeze=False, n=None):
-    """ Samples a sequence """
-    assert set(self._filenames) == set(self._memory), (set(self._memory) - set(self._filenames))
+  def _sample(
+    self, 
+    batch_size, 
+    sample_keys=None, 
+    sample_size=None, 
+    squeeze=False, 
+    n=None
+  ):
+    """ Samples a batch of sequences """
     sample_keys = sample_keys or self.sample_keys
     sample_size = sample_size or self.sample_size
-    n = n or len(self._filenames)
-    if n is None:
-      filename = random.choice(self._filenames)
-    else:
-      filename = random.choice(list(self._filenames)[-n:])
-    episode = self._memory[filename]
-    epslen = len(next(iter(episode.values())))
-    available = epslen - self.sample_size
-    assert available >= 0, f'Skipped short episode of length {epslen}.' \
-      f'{[(k, np.array(v).shape) for e in self._memory.values() for k, v in e.items()]}'
-
-    i = random.randint(0, available)
+    while True:
+      filenames, offsets = self._index.sample(
+        batch_size, sample_size, n=n, length_weighted=self.length_weighted)
+      episodes = [self._get_episode(f) for f in filenames]
+      failed = {f for f, eps in zip(filenames, episodes) if eps is None}
+      if not failed:
+        break
+      # drops unloadable episodes and samples again
+      self._index.remove(failed)
+      if not self.ready_to_sample():
+        return None
+
     if sample_size == 1 and squeeze:
-      sample = episode.subdict(*sample_keys).slice(i)
+      take = lambda x, i: x[i]
     else:
-      sample = episode.subdict(*sample_keys).slice(
-        np.arange(i, i+sample_size))
+      take = lambda x, i: x[i:i+sample_size]
+    samples = AttrDict()
+    for k in sample_keys:
+      if k not in episodes[0]:
+        continue
+      leaves, structs = zip(*[tree_flatten(eps[k]) for eps in episodes])
+      samples[k] = tree_unflatten(structs[0], [
+        np.stack([take(l[i], o) for l, o in zip(leaves, offsets)])
+        for i in range(len(leaves[0]))
+      ])
+
+    return samples
 
-    return sample
+  def _list_episode_files(self):
+    """ Returns (filename, length) of episode files in the directory, 
+    skipping files not named by merge """
+    files = []
+    for filename in self._dir.glob('*.npz'):
+      epslen = _parse_episode_length(filename)
+      if epslen is None:
+        do_logging(f'Skipping file not named as an episode: {filename}', 
+          logger=logger, level='warning')
+      else:
+        files.append((filename, epslen))
+    return files
+
+  def _get_episode(self, filename):
+    if filename in self._memory:
+      return self._memory[filename]
+    if filename in self._cache:
+      self._cache.move_to_end(filename)
+      return self._cache[filename]
+    episode = load_data(filename)
+    if episode is None:
+      do_logging(f'Dropping unloadable episode {filename}', 
+        logger=logger, level='warning')
+      return None
+    self._cache[filename] = episode
+    if len(self._cache) > self._cache_size:
+      self._cache.popitem(last=False)
+    return episode
 
   def _pop_episode(self):
-    if len(self._memory) > self.max_episodes:
-      filename = self._filenames.popleft()
-      assert(filename in self._memory)
-      del self._memory[filename]
+    while len(self) > self.max_episodes:
+      filename = self._index.popleft()
+      self._memory.pop(filename, None)
+      self._cache.pop(filename, None)
 
   def _remove_file(self):
-    if len(self._memory) > self.max_episodes:
-      filename = self._filenames.popleft()
-      assert(filename in self._memory)
-      del self._memory[filename]
-      filename.unlink()
+    while len(self) > self.max_episodes:
+      filename = self._index.popleft()
+      self._memory.pop(filename, None)
+      self._cache.pop(filename, None)
+      self._writer.remove(filename)
       
   def clear_temp_bufs(self):
     for b in self._tmp_bufs:
       b.reset()
+
+
+def _parse_episode_length(filename: Path):
+  """ Returns the length in the name of an episode file, i.e., 
+  {timestamp}-{identifier}-{length}.npz, or None if it does not match """
+  parts = filename.stem.split('-')
+  if len(parts) != 3 or not parts[2].isdigit():
+    return None
+  return int(parts[2])
@@ -5,6 +5,7 @@ import math
 import numpy as np
 
 from jx.elements.buffer import Buffer
+from tools.tree_ops import tree_flatten, tree_map, tree_unflatten
 from tools.utils import batch_dicts, stack_data_with_state
 from replay.utils import *
 
@@ -111,6 +112,147 @@ class NStepBuffer(LocalBuffer):
     return result
 
 
+class BatchedNStepBuffer(LocalBuffer):
+  """ N-step accumulator over a batch of environments stepping in lockstep
+
+  Pending transitions are kept in arrays of shape [n_envs, max_steps, ...]
+  written at a shared cycling slot. Each add updates the rewards, 
+  discounts, steps and next_* entries of all pending transitions with 
+  array operations, and returns the completed transitions as a single 
+  dict of arrays, or None if no transition completes. The pending 
+  transitions of an environment complete when it terminates or resets. 
+  Values may be nested, e.g., memory states, while None values are 
+  ignored.
+  """
+  def _add_attributes(self):
+    self.max_steps = self.config.get('max_steps', 1)
+    self.gamma = self.config.gamma
+    self._buffer = {}
+    self._slot = 0
+    self._count = None    # number of pending transitions per env
+
+  def __len__(self):
+    return 0 if self._count is None else int(np.sum(self._count))
+
+  def is_full(self):
+    return self._count is not None and np.all(self._count == self.max_steps)
+
+  def reset(self):
+    if self._count is not None:
+      self._count[:] = 0
+
+  def retrieve_all_data(self):
+    if self._count is None:
+      return None
+    data = self._pop(np.ones_like(self._count, dtype=bool))
+    self.reset()
+    return data
+
+  def add(self, **data):
+    """ Add a batch of transitions, one per environment """
+    if self.max_steps == 1:
+      return data
+    data = {k: v for k, v in data.items() if v is not None}
+    if self._buffer == {}:
+      self._init_buffer(data)
+    t = self._slot
+    n = self.max_steps
+    results = []
+
+    # the oldest pending transitions complete once their slot is reused
+    full = np.nonzero(self._count == n)[0]
+    if full.size > 0:
+      results.append({k: tree_map(lambda x: x[full, t], v) 
+        for k, v in self._buffer.items()})
+      self._count[full] -= 1
+
+    # update pending transitions in the other slots with the new data
+    lags = np.arange(1, n)
+    slots = (t - lags) % n
+    mask = lags[None] <= self._count[:, None]    # [n_envs, n-1]
+    def expand(m, x):
+      return m.reshape(*m.shape, *[1]*(x.ndim - m.ndim))
+    reward = self._buffer['reward'][:, slots]
+    new_reward = np.expand_dims(data['reward'], 1)
+    discounts = self.gamma**lags.reshape(1, -1, *[1]*(reward.ndim-2))
+    self._buffer['reward'][:, slots] = reward \
+      + np.where(expand(mask, reward), discounts * new_reward, 0)
+    self._buffer['steps'][:, slots] += expand(mask, self._buffer['steps'][:, slots])
+    def update(x, v):
+      x[:, slots] = np.where(
+        expand(mask, x[:, slots]), np.expand_dims(v, 1), x[:, slots])
+    for k, v in data.items():
+      if k == 'discount' or k.startswith('next_'):
+        _tree_zip_map(update, self._buffer[k], v)
+
+    # write the new transitions
+    def write(x, v):
+      x[:, t] = v
+    for k, v in data.items():
+      _tree_zip_map(write, self._buffer[k], v)
+    self._buffer['steps'][:, t] = 1
+    self._count += 1
+    self._slot = (t + 1) % n
+
+    done = np.all(self._env_wise(data['discount']) == 0, axis=1)
+    if 'reset' in data:
+      done = np.logical_or(done, np.all(self._env_wise(data['reset']), axis=1))
+    if np.any(done):
+      results.append(self._pop(done))
+      self._count[done] = 0
+
+    results = [r for r in results if r is not None]
+    if not results:
+      return None
+    elif len(results) == 1:
+      return results[0]
+    return {k: _tree_zip_map(lambda *xs: np.concatenate(xs), 
+      *[r[k] for r in results]) for k in results[0]}
+
+  """ Implementation """
+  def _init_buffer(self, data):
+    def allocate(v):
+      v = np.asarray(v)
+      return np.zeros((v.shape[0], self.max_steps, *v.shape[1:]), v.dtype)
+    for k, v in data.items():
+      self._buffer[k] = tree_map(allocate, v)
+    reward = self._buffer['reward']
+    self._buffer['steps'] = np.zeros(reward.shape, np.float32)
+    if reward.dtype != np.float32 and reward.dtype != np.float64:
+      self._buffer['reward'] = reward.astype(np.float32)
+    self._count = np.zeros(reward.shape[0], np.int64)
+
+  def _env_wise(self, x):
+    x = np.asarray(x)
+    return x.reshape(x.shape[0], -1)
+
+  def _pop(self, mask):
+    """ Returns all pending transitions of the masked envs in the order 
+    they were added """
+    env_ids = np.nonzero(mask)[0]
+    counts = self._count[env_ids]
+    total = np.sum(counts)
+    if total == 0:
+      return None
+    env_ids = np.repeat(env_ids, counts)
+    # ages run from count down to 1 for the pending transitions of each env
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    ages = np.repeat(counts, counts) - (np.arange(total) - starts)
+    slots = (self._slot - ages) % self.max_steps
+    return {k: tree_map(lambda x: x[env_ids, slots], v) 
+      for k, v in self._buffer.items()}
+
+
+def _tree_zip_map(func, tree, *others):
+  """ Maps func over the corresponding leaves of trees of the same 
+  structure, skipping None leaves """
+  leaves, structure = tree_flatten(tree)
+  other_leaves = [tree_flatten(x)[0] for x in others]
+  return tree_unflatten(structure, [
+    None if xs[0] is None else func(*xs) 
+    for xs in zip(leaves, *other_leaves)])
+
+
 class VecEnvNStepBuffer(NStepBuffer):
   """ Local memory only stores one episode of transitions from n environments """
   def reset(self):
@@ -0,0 +1,55 @@
+import os
+import numpy as np
+
+from core.typing import AttrDict
+from core.elements.model import Model
+from tools.log import do_logging
+from replay.uniform import UniformReplay
+from replay.ds.memmap import MemmapStorage
+from replay import replay_registry
+
+
+@replay_registry.register('memmap')
+class MemmapReplay(UniformReplay):
+  """ Uniform replay whose transitions live in np.memmap files
+
+  Files are placed at filedir/filename, where filedir defaults to the
+  model directory. An existing replay in that directory is reopened on
+  construction, so restarts do not reload the data into memory.
+  """
+  def __init__(
+    self,
+    config: AttrDict,
+    env_stats: AttrDict,
+    model: Model,
+    aid: int=0,
+  ):
+    super().__init__(config, env_stats, model, aid)
+    if len(self) > 0:
+      do_logging(f'Number of transitions reopened: {len(self)}')
+
+  def _create_memory(self):
+    assert self._filedir is not None, 'MemmapReplay requires a directory'
+    return MemmapStorage(
+      self.max_size, os.path.join(self._filedir, self._filename))
+
+  """ Retrieval """
+  def retrieve_all_data(self):
+    self.clear_local_buffer()
+    data = self._memory.get(np.arange(len(self)))
+    self._memory.clear()
+    return data
+
+  """ Save & Restore """
+  def save(self, filedir=None, filename=None):
+    assert filedir is None and filename is None, \
+      'MemmapReplay is saved in place'
+    self._memory.save()
+    do_logging(f'Number of transitions saved: {len(self)}')
+
+  def restore(self, filedir=None, filename=None):
+    if filedir is not None or filename is not None:
+      self._filedir = filedir or self._filedir
+      self._filename = filename or self._filename
+    self._memory = self._create_memory()
+    do_logging(f'Number of transitions restored: {len(self)}')
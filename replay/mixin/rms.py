@@ -18,3 +18,6 @@ class TemporaryRMS:
     self.rms.update(
       np.stack([traj[self.key] for traj in trajs]), 
     )
+
+  def update_obs_rms_from_batch(self, data):
+    self.rms.update(data[self.key])
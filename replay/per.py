@@ -2,7 +2,7 @@ import os
 from typing import List
 import numpy as np
 
-from core.elements.buffer import Buffer
+from core.elements.buffer import Buffer, synchronized
 from core.elements.model import Model
 from core.typing import AttrDict
 from tools.log import do_logging
@@ -10,14 +10,17 @@ from tools.pickle import save, restore
 from tools.schedule import PiecewiseSchedule
 from tools.utils import batch_dicts, yield_from_tree
 from replay.local import NStepBuffer
-from replay.ds.sum_tree import SumTree
+from replay.ds.sum_tree import VectorizedSumTree
+from replay.ds.binary_heap import IndexedBinaryHeap
 from replay import replay_registry
 from replay.mixin.rms import TemporaryRMS
 
 
 @replay_registry.register('per')
 class ProportionalPER(Buffer):
-  """ Base class for PER, left in case one day I implement rank-based PER """
+  """ Proportional PER, also the base class of RankBasedPER """
+  is_synchronized = True
+
   def __init__(
     self, 
     config: AttrDict, 
@@ -56,7 +59,7 @@ class ProportionalPER(Buffer):
     ]
 
     self._top_priority = 1.
-    self._data_structure = SumTree(self.max_size)
+    self._data_structure = VectorizedSumTree(self.max_size)
     self._use_is_ratio = self.config.use_is_ratio
     self._alpha = self.config.get('alpha', 0)
     self._beta = self.config.get('beta', .4)
@@ -74,7 +77,7 @@ class ProportionalPER(Buffer):
       return self._idx
 
   def ready_to_sample(self):
-    return len(self._memory) >= self.min_size
+    return len(self) >= self.min_size
 
   def get_obs_rms(self):
     if self.config.model_norm_obs:
@@ -96,11 +99,11 @@ class ProportionalPER(Buffer):
             self.config, self.env_stats, self.model, self.aid, 0))
         traj = self._tmp_bufs[i].add(**d)
         if traj is not None:
-          trajs.append(traj)
+          trajs.extend(traj)
     else:
       traj = self._tmp_bufs[0].add(**data)
       if traj is not None:
-        trajs.append(traj)
+        trajs.extend(traj)
     self.merge(trajs)
 
   def add_and_pop(self, **data):
@@ -113,32 +116,32 @@ class ProportionalPER(Buffer):
             self.config, self.env_stats, self.model, self.aid, 0))
         traj = self._tmp_bufs[i].add(**d)
         if traj is not None:
-          trajs.append(traj)
+          trajs.extend(traj)
     else:
       traj = self._tmp_bufs[0].add(**data)
       if traj is not None:
-        trajs.append(traj)
+        trajs.extend(traj)
     popped_data.extend(self.merge_and_pop(trajs))
 
     return popped_data
 
+  @synchronized
   def merge(self, trajs):
     if isinstance(trajs, dict):
       trajs = [trajs]
     n = len(trajs)
     idxes = self._get_next_idxes(self._idx, n)
-    for i, traj in zip(idxes, trajs):
-      self._memory[i] = traj
+    self._write_memory(trajs)
     assert len(self) <= self.max_size, len(self)
     self._update_obs_rms(trajs)
 
-    priority = self._top_priority * np.ones(n)
-    self.update_data_structure(idxes, priority)
+    self.update_data_structure(idxes, np.full(n, self._top_priority))
     self._idx += n
     if self._idx >= self.max_size:
       self._idx %= self.max_size
       self._is_full = True
 
+  @synchronized
   def merge_and_pop(self, trajs):
     if isinstance(trajs, dict):
       trajs = [trajs]
@@ -161,6 +164,7 @@ class ProportionalPER(Buffer):
     return popped_data
 
   """ Sampling """
+  @synchronized
   def sample_from_recency(self, batch_size, sample_keys=None, n=None, add_seq_dim=False):
     batch_size = batch_size or self.batch_size
     n = max(batch_size, n or self.n_recency)
@@ -174,6 +178,7 @@ class ProportionalPER(Buffer):
 
     return samples
 
+  @synchronized
   def sample(self, batch_size=None):
     if self.ready_to_sample():
       samples = self._sample(batch_size=batch_size)
@@ -203,9 +208,9 @@ class ProportionalPER(Buffer):
     idxes = np.arange(start, end)
     return self._get_samples(idxes, self._memory)
 
+  @synchronized
   def update_priorities(self, priorities, idxes):
-    assert not np.any(np.isnan(priorities)), priorities
-    np.testing.assert_array_less(0, priorities)
+    assert np.all(priorities > 0), priorities   # also rules out nan
     self._top_priority = max(self._top_priority, np.max(priorities))
     self.update_data_structure(idxes, priorities)
 
@@ -235,16 +240,19 @@ class ProportionalPER(Buffer):
     priorities = priorities ** self._alpha
     self._data_structure.batch_update(idxes, priorities)
 
-  def _compute_IS_ratios(self, probabilities):
-    """
-    w = (N * p)**(-beta)
-    max(w) = max(N * p)**(-beta) = (N * min(p))**(-beta)
-    norm_w = w / max(w) = (N*p)**(-beta) / (N * min(p))**(-beta)
-         = (min(p) / p)**beta
-    """
-    IS_ratios = (np.min(probabilities) / probabilities)**self._beta
-
-    return IS_ratios
+  def _write_memory(self, trajs):
+    """ Writes trajs to memory from self._idx on in at most two slice 
+    assignments, keeping the last max_size ones if there are more """
+    n = len(trajs)
+    trajs = list(trajs[-self.max_size:])
+    start = (self._idx + n - len(trajs)) % self.max_size
+    end = start + len(trajs)
+    if end <= self.max_size:
+      self._memory[start:end] = trajs
+    else:
+      split = self.max_size - start
+      self._memory[start:] = trajs[:split]
+      self._memory[:end - self.max_size] = trajs[split:]
 
   def _get_prev_idxes(self, idx, n):
     return np.arange(idx-n, idx) % self.max_size
@@ -254,23 +262,13 @@ class ProportionalPER(Buffer):
 
   def _sample(self, batch_size=None):
     batch_size = batch_size or self.batch_size
-    total_priorities = self._data_structure.total_priorities
-
-    intervals = np.linspace(0, total_priorities, batch_size+1)
-    values = np.random.uniform(intervals[:-1], intervals[1:])
-    priorities, idxes = self._data_structure.batch_find(values)
-    priorities = np.where(idxes >= len(self), self._top_priority, priorities)   # a lazy fix for the out-of-range find in sum tree
-    idxes = np.where(idxes >= len(self), self._idx-1, idxes)   # a lazy fix for the out-of-range find in sum tree
-    # assert np.max(idxes) < len(self), f'idxes: {idxes}\nvalues: {values}\npriorities: {priorities}\ntotal: {total_priorities}, len: {len(self)}'
-    # assert np.min(priorities) > 0, f'idxes: {idxes}\nvalues: {values}\npriorities: {priorities}\ntotal: {total_priorities}, len: {len(self)}'
+    idxes, priorities, is_ratio = self._data_structure.stratified_find(
+      batch_size, self._beta if self._use_is_ratio else None)
 
-    # compute importance sampling ratios
     samples = self._get_samples(idxes, self._memory)
     samples.idxes = idxes
     samples.priority = priorities
     if self._use_is_ratio:
-      probabilities = priorities / total_priorities
-      is_ratio = self._compute_IS_ratios(probabilities)
       samples.is_ratio = is_ratio.astype(np.float32)
 
     return samples
@@ -305,11 +303,114 @@ class ProportionalPER(Buffer):
   def restore(self, filedir=None, filename=None):
     filedir = filedir or self._filedir
     filename = filename or self._filename
-    self._memory, self._is_full, self._idx, self._top_priority = \
+    self._memory, self._data_structure, self._is_full, self._idx, self._top_priority = \
       restore(
         filedir=filedir, 
         filename=filename, 
-        default=([None for _ in range(self.max_size)], SumTree(self.max_size), False, 0, 1.), 
+        default=([None for _ in range(self.max_size)], VectorizedSumTree(self.max_size), False, 0, 1.), 
         name='data'
       )
     do_logging(f'Number of transitions restored: {len(self)}')
+
+
+@replay_registry.register('rank_per')
+class RankBasedPER(ProportionalPER):
+  """ Rank-based PER, where P(i) is proportional to (1 / rank(i))**alpha
+
+  Ranks are approximated by positions in an indexed binary heap, which 
+  is re-sorted every rebalance_freq updates. The power-law segment 
+  boundaries are precomputed for n_partitions memory sizes and each 
+  batch size, so each sampling step costs O(batch_size).
+  """
+  def __init__(
+    self, 
+    config: AttrDict, 
+    env_stats: AttrDict, 
+    model: Model, 
+    aid: int=0, 
+  ):
+    super().__init__(config, env_stats, model, aid)
+
+    self._data_structure = IndexedBinaryHeap(self.max_size)
+    self._n_partitions = self.config.get('n_partitions', 100)
+    self._partition_size = max(self.max_size // self._n_partitions, 1)
+    self._rebalance_freq = self.config.get('rebalance_freq', 1000)
+    self._n_updates = 0
+    # (memory size, batch size) -> (segment boundaries, probabilities)
+    self._distributions = {}
+
+  """ Save & Restore """
+  def save(self, filedir=None, filename=None):
+    filedir = filedir or self._filedir
+    filename = filename or self._filename
+    save(
+      (self._memory, self._data_structure, self._is_full, self._idx, 
+       self._top_priority, self._n_updates, self._distributions), 
+      filedir=filedir, 
+      filename=filename, 
+      name='data'
+    )
+    do_logging(f'Number of transitions saved: {len(self)}')
+
+  def restore(self, filedir=None, filename=None):
+    filedir = filedir or self._filedir
+    filename = filename or self._filename
+    self._memory, self._data_structure, self._is_full, self._idx, \
+      self._top_priority, self._n_updates, self._distributions = restore(
+        filedir=filedir, 
+        filename=filename, 
+        default=([None for _ in range(self.max_size)], IndexedBinaryHeap(self.max_size), 
+                 False, 0, 1., 0, {}), 
+        name='data'
+      )
+    do_logging(f'Number of transitions restored: {len(self)}')
+
+  """ Implementation """
+  def update_data_structure(self, idxes, priorities):
+    self._data_structure.batch_update(idxes, priorities)
+    self._n_updates += 1
+    if self._n_updates % self._rebalance_freq == 0:
+      self._data_structure.rebalance()
+
+  def _get_distribution(self, batch_size):
+    """ Returns segment boundaries and probabilities over the top n ranks, 
+    where n is len(self) rounded down to a multiple of the partition size """
+    n = len(self) // self._partition_size * self._partition_size
+    if n < batch_size:
+      return self._compute_distribution(len(self), batch_size)
+    if (n, batch_size) not in self._distributions:
+      self._distributions[(n, batch_size)] = \
+        self._compute_distribution(n, batch_size)
+    return self._distributions[(n, batch_size)]
+
+  def _compute_distribution(self, n, batch_size):
+    probabilities = (1 / np.arange(1, n+1))**self._alpha
+    probabilities /= np.sum(probabilities)
+    cdf = np.cumsum(probabilities)
+    boundaries = np.zeros(batch_size+1, dtype=np.int64)
+    boundaries[1:-1] = np.searchsorted(
+      cdf, np.arange(1, batch_size) / batch_size, side='right')
+    boundaries[-1] = n
+    # every segment contains at least one rank when n >= batch_size
+    for i in range(1, batch_size):
+      boundaries[i] = min(max(boundaries[i], boundaries[i-1]+1), n)
+
+    return boundaries, probabilities
+
+  def _sample(self, batch_size=None):
+    batch_size = batch_size or self.batch_size
+    boundaries, probabilities = self._get_distribution(batch_size)
+    ranks = np.random.randint(
+      boundaries[:-1], np.maximum(boundaries[1:], boundaries[:-1]+1))
+    ranks = np.minimum(ranks, len(probabilities)-1)
+    idxes = self._data_structure.get_mem_idxes(ranks)
+
+    samples = self._get_samples(idxes, self._memory)
+    samples.idxes = idxes
+    samples.priority = self._data_structure.get_priorities(idxes)
+    if self._use_is_ratio:
+      # the maximum ratio corresponds to the lowest rank
+      is_ratio = (probabilities[-1] / probabilities[ranks])**self._beta
+      samples.is_ratio = is_ratio.astype(np.float32)
+
+    return samples
@@ -8,6 +8,9 @@ from replay.uniform import UniformReplay
 logger = logging.getLogger(__name__)
 
 class SequentialBase:
+  # merge is not synchronized
+  is_synchronized = False
+
   """ Construction """
   def _add_attributes(self, state_keys=None):
     self._state_keys = state_keys or getattr(self, '_state_keys', [])
@@ -4,39 +4,12 @@ import numpy as np
 from core.elements.buffer import Buffer
 from core.elements.model import Model
 from core.typing import AttrDict, dict2AttrDict
+from tools.advantage import compute_gae
 from tools.tree_ops import tree_map
 from tools.utils import batch_dicts
 from replay import replay_registry
 
 
-def compute_gae(
-  reward, 
-  discount, 
-  value, 
-  gamma, 
-  gae_discount, 
-  next_value=None, 
-  reset=None, 
-):
-  if next_value is None:
-    value, next_value = value[:-1], value[1:]
-  elif next_value.ndim < value.ndim:
-    next_value = np.expand_dims(next_value, 1)
-    next_value = np.concatenate([value[1:], next_value], 0)
-  assert reward.shape == discount.shape == value.shape == next_value.shape, (reward.shape, discount.shape, value.shape, next_value.shape)
-  
-  delta = (reward + discount * gamma * next_value - value).astype(np.float32)
-  discount = (discount if reset is None else (1 - reset)) * gae_discount
-  
-  next_adv = 0
-  advs = np.zeros_like(reward, dtype=np.float32)
-  for i in reversed(range(advs.shape[0])):
-    advs[i] = next_adv = (delta[i] + discount[i] * next_adv)
-  traj_ret = advs + value
-
-  return advs, traj_ret
-
-
 @replay_registry.register('tblocal')
 class TurnBasedLocalBuffer(Buffer):
   def __init__(
@@ -127,6 +100,7 @@ class TurnBasedLocalBuffer(Buffer):
         gamma=self.config.gamma,
         gae_discount=self.config.gamma * self.config.lam,
         next_value=np.array([0], np.float32), 
+        axis=0, 
       )
     elif self.data_type == 'step':
       new_eps = {}
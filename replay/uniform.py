@@ -4,19 +4,23 @@ from typing import Dict
 import numpy as np
 
 from core.typing import AttrDict
-from core.elements.buffer import Buffer
+from core.elements.buffer import Buffer, synchronized
 from core.elements.model import Model
 from tools.pickle import save, restore
 from tools.log import do_logging
 from tools.timer import Timer, timeit
+from tools.tree_ops import tree_map
 from tools.utils import batch_dicts, yield_from_tree, yield_from_tree_with_indices
-from replay.local import NStepBuffer
+from replay.local import BatchedNStepBuffer
+from replay.ds.columnar import ColumnarStorage
 from replay import replay_registry
 from replay.mixin.rms import TemporaryRMS
 
 
 @replay_registry.register('uniform')
 class UniformReplay(Buffer):
+  is_synchronized = True
+
   def __init__(
     self, 
     config: AttrDict, 
@@ -43,12 +47,13 @@ class UniformReplay(Buffer):
     self._filedir = filedir
     self._filename = self.config.filename if self.config.filename else 'uniform'
 
-    self._memory = collections.deque(maxlen=self.max_size)
+    self._storage = self.config.get('storage', 'deque')
+    self._memory = self._create_memory()
 
     if self.config.model_norm_obs:
       self.obs_rms = TemporaryRMS(self.config.get('obs_name', 'obs'), [0])
-    self._tmp_bufs: Dict[int, NStepBuffer] = collections.defaultdict(
-      lambda: NStepBuffer(config, env_stats, model, aid, 0))
+    self._tmp_bufs: Dict[int, BatchedNStepBuffer] = collections.defaultdict(
+      lambda: BatchedNStepBuffer(config, env_stats, model, aid, 0))
 
   def __len__(self):
     return len(self._memory)
@@ -62,30 +67,32 @@ class UniformReplay(Buffer):
 
   def reset(self):
     pass
+
+  def _create_memory(self):
+    if self._storage == 'deque':
+      return collections.deque(maxlen=self.max_size)
+    elif self._storage == 'columnar':
+      return ColumnarStorage(self.max_size)
+    else:
+      raise ValueError(f'Unknown storage: {self._storage}')
   
   def collect_and_pop(self, idxes=None, **data):
     data = self._prepare_data(**data)
     return self.add_and_pop(idxes=idxes, **data)
 
   def add(self, rid=None, **data):
-    trajs = []
-    for i, d in enumerate(yield_from_tree(data)):
-      traj = self._tmp_bufs[(rid, i)].add(**d)
-      if traj is not None:
-        trajs.extend(traj)
-    self.merge(trajs)
+    """ Add a batch of transitions, one per environment """
+    data = self._tmp_bufs[rid].add(**data)
+    if data is not None:
+      self.merge_batch(data)
 
   def add_and_pop(self, rid=None, **data):
-    trajs = []
-    popped_data = []
-    for i, d in enumerate(yield_from_tree(data)):
-      traj = self._tmp_bufs[(rid, i)].add(**d)
-      if traj is not None:
-        trajs.extend(traj)
-    popped_data.extend(self.merge_and_pop(trajs))
-
-    return popped_data
+    data = self._tmp_bufs[rid].add(**data)
+    if data is None:
+      return []
+    return self.merge_and_pop(list(yield_from_tree(data)))
 
+  @synchronized
   def merge(self, trajs):
     if isinstance(trajs, dict):
       trajs = [trajs]
@@ -93,14 +100,30 @@ class UniformReplay(Buffer):
     assert len(self) <= self.max_size, len(self)
     self._update_obs_rms(trajs)
 
+  @synchronized
+  def merge_batch(self, data):
+    """ Merge a dict of batched transitions """
+    if isinstance(self._memory, ColumnarStorage):
+      self._memory.extend_batch(data)
+      if self.config.model_norm_obs:
+        self.obs_rms.update_obs_rms_from_batch(data)
+    else:
+      self.merge(list(yield_from_tree(data)))
+
+  @synchronized
   def merge_and_pop(self, trajs):
     if isinstance(trajs, dict):
       trajs = [trajs]
     popped_data = []
-    for traj in trajs:
-      if len(self._memory) == self._memory.maxlen:
-        popped_data.append(self._memory.popleft())
-      self._memory.append(traj)
+    if isinstance(self._memory, ColumnarStorage):
+      n_popped = max(0, len(self._memory) + len(trajs) - self._memory.maxlen)
+      popped_data = [self._memory[i] for i in range(min(n_popped, len(self._memory)))]
+      self._memory.extend(trajs)
+    else:
+      for traj in trajs:
+        if len(self._memory) == self._memory.maxlen:
+          popped_data.append(self._memory.popleft())
+        self._memory.append(traj)
     self._update_obs_rms(trajs)
     return popped_data
 
@@ -110,6 +133,7 @@ class UniformReplay(Buffer):
       self.add(rid, **d)
 
   """ Sampling """
+  @synchronized
   @timeit
   def sample_from_recency(self, batch_size, sample_keys=None, n=None):
     batch_size = batch_size or self.batch_size
@@ -124,6 +148,7 @@ class UniformReplay(Buffer):
 
     return samples
     
+  @synchronized
   def sample(self, batch_size=None, add_seq_axis=True):
     if self.ready_to_sample():
       samples = self._sample(batch_size, add_seq_axis=add_seq_axis)
@@ -159,17 +184,17 @@ class UniformReplay(Buffer):
   def retrieve_all_data(self):
     self.clear_local_buffer()
     data = self._memory
-    self._memory = collections.deque(maxlen=self.max_size)
+    self._memory = self._create_memory()
     return data
 
   def clear_local_buffer(self, drop_data=False):
-    for b in self._tmp_bufs:
+    for b in self._tmp_bufs.values():
       if drop_data:
         b.reset()
       else:
-        traj = b.retrieve_all_data()
-        if traj:
-          self.merge(traj)
+        data = b.retrieve_all_data()
+        if data is not None:
+          self.merge_batch(data)
 
   def _sample(self, batch_size=None, add_seq_axis=True):
     batch_size = batch_size or self.batch_size
@@ -185,6 +210,11 @@ class UniformReplay(Buffer):
   def _get_samples(self, idxes, memory, sample_keys=None, add_seq_axis=True):
     if sample_keys is None:
       sample_keys = self.sample_keys
+    if isinstance(memory, ColumnarStorage):
+      samples = memory.get(idxes, keys=sample_keys)
+      if add_seq_axis:
+        samples = tree_map(lambda x: np.expand_dims(x, 1), samples)
+      return samples
     raw_samples = [memory[i] for i in idxes]
     fn = lambda x: np.expand_dims(np.stack(x), 1) if add_seq_axis else np.stack
     samples = batch_dicts(raw_samples, func=fn, keys=sample_keys)
@@ -205,5 +235,9 @@ class UniformReplay(Buffer):
     filedir = filedir or self._filedir
     filename = filename or self._filename
     self._memory = restore(filedir=filedir, filename=filename, 
-      default=collections.deque(maxlen=self.max_size), name='data')
+      default=self._create_memory(), name='data')
+    if not isinstance(self._memory, ColumnarStorage) and self._storage == 'columnar':
+      memory = self._create_memory()
+      memory.extend(list(self._memory))
+      self._memory = memory
     do_logging(f'Number of transitions restored: {len(self)}')
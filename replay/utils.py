@@ -170,8 +170,11 @@ def load_data(filename):
   return data
 
 
-def save_data(filename, data):
+def save_data(filename, data, compress=True):
   if isinstance(filename, str):
     filename = Path(filename)
   with filename.open('wb') as f:
-    np.savez_compressed(f, **data)
+    if compress:
+      np.savez_compressed(f, **data)
+    else:
+      np.savez(f, **data)
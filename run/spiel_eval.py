@@ -33,6 +33,7 @@ from core.utils import *
 from core.typing import ModelPath, get_basic_model_name, dict2AttrDict
 from tools.pickle import set_weights_for_agent
 from envs.func import create_env
+from game.cfr import build_game_tree, select_cfr
 from run.args import parse_eval_args
 from run.ops import search_for_all_configs, search_for_config
 
@@ -177,6 +178,20 @@ def build_policies(configs, env):
   return aggr_policy
 
 
+# (game, solver, n_iterations) -> exploitability
+_CFR_BASELINES = {}
+
+def compute_cfr_baseline(game, n_iterations, solver='cfr+'):
+  """ Returns the exploitability of tabular CFR after n_iterations, 
+  which is computed once per process """
+  key = (str(game), solver, n_iterations)
+  if key not in _CFR_BASELINES:
+    cfr = select_cfr(solver, build_game_tree(game))
+    cfr.iterate(n_iterations)
+    _CFR_BASELINES[key] = cfr.exploitability()
+  return _CFR_BASELINES[key]
+
+
 def main(
   configs, 
   step, 
@@ -184,6 +199,7 @@ def main(
   avg=True, 
   latest=True, 
   write_to_disk=True, 
+  cfr_iterations=0, 
 ):
   configs = [dict2AttrDict(c) for c in configs]
   configs = configure_gpu(configs)
@@ -207,6 +223,8 @@ def main(
   set_seed(config.seed)
 
   nash_conv = {'step': step}
+  if cfr_iterations:
+    nash_conv['cfr_expl'] = compute_cfr_baseline(env.game, cfr_iterations)
 
   if avg:
     aggr_policy = build_policies(configs, env)
@@ -0,0 +1,103 @@
+import numpy as np
+import torch
+
+from tools.advantage import reverse_scan, compute_gae
+from th.tools import th_loss
+
+
+def loop_gae(reward, discount, value, next_value, reset, gamma, lam):
+  # the reference implementation for batch-major data
+  delta = reward + discount * gamma * next_value - value
+  discount = (1 - reset) * gamma * lam
+  next_adv = 0
+  advs = np.zeros_like(reward)
+  for i in reversed(range(advs.shape[1])):
+    advs[:, i] = next_adv = (delta[:, i] + discount[:, i] * next_adv)
+  return advs, advs + value
+
+
+def create_data(shape=(4, 7, 3)):
+  reward = np.random.normal(size=shape).astype(np.float32)
+  discount = (np.random.uniform(size=shape) > .2).astype(np.float32)
+  reset = (np.random.uniform(size=shape) > .8).astype(np.float32)
+  value = np.random.normal(size=(shape[0], shape[1]+1, *shape[2:])).astype(np.float32)
+  return reward, discount, reset, value
+
+
+class TestClass:
+  def test_reverse_scan(self):
+    x = np.random.normal(size=(3, 5, 2))
+    discount = np.random.uniform(size=(3, 5, 2))
+    for axis in range(x.ndim):
+      y = reverse_scan(x, discount, axis=axis)
+      xt, dt = np.moveaxis(x, axis, 0), np.moveaxis(discount, axis, 0)
+      expected = np.zeros_like(xt)
+      nxt = 0
+      for i in reversed(range(xt.shape[0])):
+        expected[i] = nxt = xt[i] + dt[i] * nxt
+      np.testing.assert_allclose(y, np.moveaxis(expected, 0, axis))
+      y = reverse_scan(torch.from_numpy(x), torch.from_numpy(discount), axis=axis)
+      np.testing.assert_allclose(y.numpy(), np.moveaxis(expected, 0, axis))
+
+  def test_gae(self):
+    reward, discount, reset, value = create_data()
+    expected = loop_gae(
+      reward, discount, value[:, :-1], value[:, 1:], reset, .99, .95)
+
+    advs, ret = compute_gae(
+      reward, discount, value, .99, .99 * .95, reset=reset)
+    np.testing.assert_allclose(advs, expected[0], rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(ret, expected[1], rtol=1e-5, atol=1e-5)
+
+    # the last value without the time dimension
+    advs, ret = compute_gae(
+      reward, discount, value[:, :-1], .99, .99 * .95, 
+      next_value=value[:, -1], reset=reset)
+    np.testing.assert_allclose(advs, expected[0], rtol=1e-5, atol=1e-5)
+
+    # time-major data
+    advs, ret = compute_gae(
+      reward.swapaxes(0, 1), discount.swapaxes(0, 1), value.swapaxes(0, 1), 
+      .99, .99 * .95, reset=reset.swapaxes(0, 1), axis=0)
+    np.testing.assert_allclose(advs.swapaxes(0, 1), expected[0], rtol=1e-5, atol=1e-5)
+
+    vs, advs = th_loss.gae(
+      reward=torch.from_numpy(reward), 
+      value=torch.from_numpy(value[:, :-1]), 
+      next_value=torch.from_numpy(value[:, 1:]), 
+      discount=torch.from_numpy(discount), 
+      reset=torch.from_numpy(reset), 
+      gamma=.99, lam=.95, axis=1)
+    np.testing.assert_allclose(advs.numpy(), expected[0], rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(vs.numpy(), expected[1], rtol=1e-5, atol=1e-5)
+
+  def test_vtrace_gradient(self):
+    reward, discount, reset, value = create_data()
+    value = torch.tensor(value, requires_grad=True)
+    ratio = torch.tensor(np.random.uniform(.5, 1.5, size=reward.shape), 
+      dtype=torch.float32, requires_grad=True)
+    vs, advs = th_loss.v_trace_from_ratio(
+      reward=torch.from_numpy(reward), 
+      value=value[:, :-1], 
+      next_value=value[:, 1:], 
+      ratio=ratio, 
+      discount=torch.from_numpy(discount), 
+      reset=torch.from_numpy(reset), 
+      gamma=.99, lam=.95, adv_type='gae', axis=1)
+    assert advs.shape == reward.shape, advs.shape
+    advs.sum().backward()
+    assert ratio.grad is not None and torch.any(ratio.grad != 0)
+
+    # with all ratios at one, v-trace with gae advantages reduces to gae
+    expected = loop_gae(
+      reward, discount, value[:, :-1].detach().numpy(), 
+      value[:, 1:].detach().numpy(), reset, .99, .95)
+    vs, advs = th_loss.v_trace_from_ratio(
+      reward=torch.from_numpy(reward), 
+      value=value[:, :-1].detach(), 
+      next_value=value[:, 1:].detach(), 
+      ratio=torch.ones(reward.shape), 
+      discount=torch.from_numpy(discount), 
+      reset=torch.from_numpy(reset), 
+      gamma=.99, lam=.95, adv_type='gae', axis=1)
+    np.testing.assert_allclose(advs.numpy(), expected[0], rtol=1e-5, atol=1e-5)
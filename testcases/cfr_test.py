@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from game.cfr import build_game_tree, compute_exploitability, \
+  compute_values, select_cfr
+from game.tabular_games import load_game
+
+
+class TestClass:
+  def test_game_tree(self):
+    tree = build_game_tree(load_game('kuhn_poker'))
+    assert tree.n_nodes == 58, tree.n_nodes
+    assert tree.n_infosets == 12, tree.n_infosets
+    assert tree.is_depth_aligned
+    np.testing.assert_allclose(compute_values(tree, tree.uniform_strategy()), 
+      [.125, -.125])
+    np.testing.assert_allclose(
+      compute_exploitability(tree, tree.uniform_strategy()), 11 / 24)
+
+    tree = build_game_tree(load_game('leduc_poker'))
+    assert tree.n_nodes == 9457, tree.n_nodes
+    assert tree.n_infosets == 936, tree.n_infosets
+    # children of each node are contiguous and ordered as their parents
+    assert np.all(np.diff(tree.parent) >= 0)
+    np.testing.assert_allclose(
+      compute_exploitability(tree, tree.uniform_strategy()), 2.373611, atol=1e-6)
+
+  @pytest.mark.parametrize('name', ['cfr', 'cfr+', 'dcfr'])
+  def test_kuhn_poker(self, name):
+    tree = build_game_tree(load_game('kuhn_poker'))
+    cfr = select_cfr(name, tree)
+    cfr.iterate(1000)
+    assert cfr.exploitability() < 1e-2, cfr.exploitability()
+    value = compute_values(tree, cfr.average_strategy())
+    np.testing.assert_allclose(value, [-1/18, 1/18], atol=1e-3)
+    policy = cfr.average_policy()
+    assert len(policy) == tree.n_infosets, len(policy)
+    for probs in policy.values():
+      np.testing.assert_allclose(sum(probs.values()), 1)
+
+  def test_mccfr(self):
+    tree = build_game_tree(load_game('kuhn_poker'))
+    cfr = select_cfr('mccfr', tree, seed=0)
+    cfr.iterate(2000)
+    assert cfr.exploitability() < .05, cfr.exploitability()
+
+  def test_leduc_poker(self):
+    tree = build_game_tree(load_game('leduc_poker'))
+    cfr = select_cfr('cfr+', tree)
+    cfr.iterate(100)
+    assert cfr.exploitability() < .05, cfr.exploitability()
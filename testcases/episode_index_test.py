@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from replay.ds.episode_index import EpisodeIndex
+
+
+class TestClass:
+  def test_episode_index(self):
+    index = EpisodeIndex()
+    lengths = np.random.randint(5, 50, size=20)
+    for i, l in enumerate(lengths):
+      index.append(f'eps{i}', l)
+    sample_size = 5
+    for length_weighted in [False, True]:
+      for n in [None, 3]:
+        keys, offsets = index.sample(
+          1000, sample_size, n=n, length_weighted=length_weighted)
+        eids = np.array([int(k[3:]) for k in keys])
+        if n is not None:
+          assert np.all(eids >= len(lengths) - n), eids
+        np.testing.assert_array_less(-1, offsets)
+        np.testing.assert_array_less(offsets, lengths[eids] - sample_size + 1)
+
+    # length-weighted sampling is uniform over sequence starts
+    index = EpisodeIndex()
+    index.append('short', 2)
+    index.append('long', 101)
+    keys, _ = index.sample(10000, 1, length_weighted=True)
+    assert np.mean(keys == 'short') < .05, np.mean(keys == 'short')
+
+    assert index.popleft() == 'short'
+    keys, offsets = index.sample(10, 1)
+    assert np.all(keys == 'long'), keys
+
+  def test_short_episodes(self):
+    index = EpisodeIndex()
+    for i, l in enumerate([3, 10, 8, 4]):
+      index.append(f'eps{i}', l)
+    for length_weighted in [False, True]:
+      keys, offsets = index.sample(1000, 5, length_weighted=length_weighted)
+      # episodes shorter than sample_size are never sampled
+      assert set(keys) == {'eps1', 'eps2'}, set(keys)
+      lengths = np.where(keys == 'eps1', 10, 8)
+      np.testing.assert_array_less(-1, offsets)
+      np.testing.assert_array_less(offsets, lengths - 5 + 1)
+      with pytest.raises(AssertionError):
+        index.sample(10, 5, n=1, length_weighted=length_weighted)
+      with pytest.raises(AssertionError):
+        index.sample(10, 11, length_weighted=length_weighted)
@@ -0,0 +1,99 @@
+import gc
+import weakref
+import numpy as np
+import pytest
+
+from core.typing import dict2AttrDict
+from replay.eps import EpisodicReplay
+
+
+env_stats = dict2AttrDict(dict(
+  obs_keys=[['obs']], 
+  use_action_mask=False, 
+  use_sample_mask=False, 
+))
+
+
+def create_buffer(directory):
+  config = dict2AttrDict(dict(
+    n_runners=1, 
+    n_envs=1, 
+    batch_size=16, 
+    n_steps=1, 
+    sample_size=4, 
+    sample_keys=['obs', 'reward'], 
+    directory=directory, 
+    max_episodes=20, 
+    min_episodes=2, 
+    save=True, 
+    cache_size=5, 
+  ))
+  return EpisodicReplay(config, env_stats, None)
+
+
+class TestClass:
+  def test_async_save_and_lazy_load(self, tmp_path):
+    buffer = create_buffer(str(tmp_path))
+    for _ in range(30):
+      n = np.random.randint(4, 30)
+      buffer.merge(dict2AttrDict(dict(
+        obs=np.random.normal(size=(n, 3)).astype(np.float32), 
+        reward=np.arange(n, dtype=np.float32), 
+      )))
+    buffer.flush()
+    assert len(buffer) == 20, len(buffer)
+    assert len(list(tmp_path.glob('*.npz'))) == 20
+
+    buffer = create_buffer(str(tmp_path))
+    buffer.load_data()
+    assert len(buffer) == 20, len(buffer)
+    assert len(buffer._cache) == 0
+    samples = buffer.sample()
+    assert samples.obs.shape == (16, 4, 3), samples.obs.shape
+    np.testing.assert_equal(np.diff(samples.reward, axis=1), 1)
+    assert 0 < len(buffer._cache) <= 5, len(buffer._cache)
+
+  def test_close_and_unloadable_episodes(self, tmp_path):
+    buffer = create_buffer(str(tmp_path))
+    for _ in range(5):
+      buffer.merge(dict2AttrDict(dict(
+        obs=np.random.normal(size=(10, 3)).astype(np.float32), 
+        reward=np.arange(10, dtype=np.float32), 
+      )))
+    # pending episodes are written completely on close
+    buffer.close()
+    assert len(list(tmp_path.glob('*.npz'))) == 5
+    assert len(list(tmp_path.glob('*.tmp'))) == 0
+    with pytest.raises(RuntimeError):
+      buffer.merge(dict2AttrDict(dict(
+        obs=np.zeros((10, 3), np.float32), reward=np.zeros(10, np.float32))))
+    # files not named as episodes are skipped
+    np.savez(tmp_path / 'foreign.npz', x=np.zeros(3))
+    np.savez(tmp_path / 'a-b-c.npz', x=np.zeros(3))
+
+    filenames = sorted(tmp_path.glob('*.npz'))
+    filenames[0].write_bytes(filenames[0].read_bytes()[:10])
+    buffer = create_buffer(str(tmp_path))
+    buffer.load_data()
+    assert len(buffer) == 5, len(buffer)
+    assert buffer.count_episodes() == (5, 45)
+    for _ in range(10):
+      samples = buffer.sample()
+      assert samples.obs.shape == (16, 4, 3), samples.obs.shape
+    assert len(buffer) == 4, len(buffer)
+    assert filenames[0] not in buffer._index
+    buffer.close()
+
+  def test_writer_is_collected_with_buffer(self, tmp_path):
+    buffer = create_buffer(str(tmp_path))
+    for _ in range(5):
+      buffer.merge(dict2AttrDict(dict(
+        obs=np.random.normal(size=(10, 3)).astype(np.float32), 
+        reward=np.arange(10, dtype=np.float32), 
+      )))
+    ref = weakref.ref(buffer)
+    del buffer
+    gc.collect()
+    assert ref() is None
+    # pending episodes are written when the writer is collected
+    assert len(list(tmp_path.glob('*.npz'))) == 5
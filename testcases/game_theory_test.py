@@ -1,6 +1,9 @@
+import time
 import numpy as np
 
 from game.alpharank import AlphaRank
+from game.meta_solver import compute_nash_conv, compute_strategy_utilities, \
+  select_meta_solver
 from game.rm import RegretMatching
 from game.utils import compute_utility
 
@@ -111,3 +114,118 @@ class TestClass:
     rank, mass = alpha_rank.compute_rank(payoffs, True, True)
     p2 = flow[rank]
     # np.testing.assert_equal(p2, np.sort(flow)[::-1])
+
+  def test_alpha_rank_solvers(self):
+    ns = (3, 4, 5)
+    payoffs = [np.random.normal(size=ns) for _ in ns]
+    alpha_rank = AlphaRank(10, 5, 1e-2)
+    transition = alpha_rank.compute_transition_matrix(payoffs)
+    np.testing.assert_allclose(transition.sum(-1), 1)
+    assert np.sum(transition > 0) <= np.prod(ns) * (1 + sum(n - 1 for n in ns))
+    pi = alpha_rank.compute_stationary_distribution(payoffs)
+    np.testing.assert_allclose(pi @ transition, pi, atol=1e-10)
+    for solver in ['eigs', 'power']:
+      sparse_pi = AlphaRank(10, 5, 1e-2, solver=solver)\
+        .compute_stationary_distribution(payoffs)
+      np.testing.assert_allclose(sparse_pi, pi, atol=1e-8)
+
+    alphas = [.1, 1, 10]
+    pis = alpha_rank.sweep(payoffs, alphas)
+    assert pis.shape == (len(alphas), np.prod(ns)), pis.shape
+    for alpha, sweep_pi in zip(alphas, pis):
+      pi = AlphaRank(alpha, 5, 1e-2).compute_stationary_distribution(payoffs)
+      np.testing.assert_allclose(sweep_pi, pi, atol=1e-8)
+
+  def test_strategy_utilities(self):
+    ns = (3, 4, 5)
+    payoffs = [np.random.normal(size=ns) for _ in ns]
+    strategies = [np.random.dirichlet(np.ones(n)) for n in ns]
+    utilities = compute_strategy_utilities(payoffs, strategies)
+    for aid, u in enumerate(utilities):
+      for sid in range(ns[aid]):
+        s = strategies.copy()
+        s[aid] = np.eye(ns[aid])[sid]
+        np.testing.assert_allclose(u[sid], compute_utility(payoffs[aid], s))
+
+  def test_regret_matching_against_loops(self):
+    n_agents, n_strategies, n_iterations = 3, 8, 20
+    payoffs = [np.random.normal(size=(n_strategies,)*n_agents) 
+      for _ in range(n_agents)]
+
+    legacy = _run_legacy_regret_matching(payoffs, n_iterations)
+    rm = RegretMatching(n_agents, n_strategies)
+    ans = rm.compute(payoffs, n_agents, n_strategies, n_iterations)
+    for x, y in zip(ans, legacy.average_meta_strategies):
+      np.testing.assert_allclose(x, y, rtol=1e-4, atol=1e-5)
+
+  def test_meta_solvers(self):
+    n = 10
+    payoff = np.random.normal(size=(n, n))
+    payoffs = [payoff, -payoff]
+    for name in ['rm', 'rm+', 'dcfr', 'rd', 'fp']:
+      solver = select_meta_solver(name, n_iterations=2000)
+      strategies = solver.compute(payoffs)
+      for s in strategies:
+        np.testing.assert_allclose(np.sum(s), 1)
+        assert np.all(s >= 0), s
+      nash_conv = compute_nash_conv(payoffs, strategies)
+      assert nash_conv < .1, (name, nash_conv)
+
+  def test_meta_solver_warm_start(self):
+    n = 10
+    payoff = np.random.normal(size=(n+1, n+1))
+    payoffs = [payoff, -payoff]
+    solver = select_meta_solver('rm+', n_iterations=1000, warm_start=True)
+    strategies = solver.compute([p[:n, :n] for p in payoffs])
+    assert all(s.shape == (n,) for s in strategies)
+    # the averages carry over the iterations on the smaller game
+    solver.n_iterations = 3000
+    strategies = solver.compute(payoffs)
+    assert all(s.shape == (n+1,) for s in strategies)
+    assert compute_nash_conv(payoffs, strategies) < .1
+
+    # warm-started calls continue from where the last one stopped
+    small = [p[:n, :n] for p in payoffs]
+    for name in ['rm+', 'rd', 'fp']:
+      solver = select_meta_solver(name, n_iterations=100, warm_start=True)
+      solver.compute(small)
+      warm = solver.compute(small)
+      cold = select_meta_solver(name, n_iterations=200).compute(small)
+      for x, y in zip(warm, cold):
+        np.testing.assert_allclose(x, y, err_msg=name)
+      solver.compute(payoffs)
+      assert solver._state['t'] == 300, name
+    # new strategies are only played in iterations after they are added
+    for s in solver.strategies:
+      assert s[n] <= 100 / 301, s
+
+    init = [np.eye(n+1)[0], np.eye(n+1)[0]]
+    fp = select_meta_solver('fp', n_iterations=0)
+    for x, y in zip(fp.compute(payoffs, init), init):
+      np.testing.assert_allclose(x, y)
+
+
+def _run_legacy_regret_matching(payoffs, n_iterations):
+  n_agents, n_strategies = len(payoffs), payoffs[0].shape[0]
+  legacy = RegretMatching(n_agents, n_strategies)
+  for _ in range(n_iterations):
+    for aid in range(n_agents):
+      for sid in range(n_strategies):
+        legacy.update_regrets(payoffs[aid], aid, sid)
+    for aid in range(n_agents):
+      legacy.update_meta_strategy(aid)
+  return legacy
+
+
+if __name__ == '__main__':
+  # benchmarks the vectorized regret matching against the loops
+  n_agents, n_strategies, n_iterations = 3, 8, 20
+  payoffs = [np.random.normal(size=(n_strategies,)*n_agents) 
+    for _ in range(n_agents)]
+  start = time.time()
+  _run_legacy_regret_matching(payoffs, n_iterations)
+  print(f'legacy: {time.time() - start:.4f}s')
+  start = time.time()
+  RegretMatching(n_agents, n_strategies).compute(
+    payoffs, n_agents, n_strategies, n_iterations)
+  print(f'vectorized: {time.time() - start:.4f}s')
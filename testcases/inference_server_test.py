@@ -0,0 +1,188 @@
+import asyncio
+import collections
+import numpy as np
+import pytest
+
+from core.names import MODEL
+from core.typing import ModelPath, ModelWeights, dict2AttrDict
+from distributed.common.remote.inference_server import InferenceServer
+from distributed.common.weights import WeightTransfer
+from envs.typing import EnvOutput
+from tools.utils import set_path
+from tools.yaml_op import load_config
+
+
+class ObjectRef:
+  """ An awaitable stand-in of ray.ObjectRef """
+  def __init__(self, oid, value):
+    self.oid = oid
+    self.value = value
+    self.n_resolved = 0
+
+  def hex(self):
+    return self.oid
+
+  def __await__(self):
+    self.n_resolved += 1
+    yield from asyncio.sleep(0).__await__()
+    return self.value
+
+
+class Model:
+  def get_initial_state(self, n):
+    return np.zeros((n, 1), np.float32)
+
+
+class Agent:
+  """ Outputs obs + w, where w is the model weights, and counts steps
+  in its memory states """
+  def __init__(self):
+    self.model = Model()
+    self.weights = None
+    self.batch_sizes = []
+    self.state = None
+
+  def set_strategy(self, model_weights):
+    self.weights = model_weights.weights[MODEL]
+
+  def set_states(self, state):
+    self.state = state
+
+  def get_states(self):
+    return self.state
+
+  def __call__(self, env_output, evaluation=False):
+    n = len(env_output.reset)
+    self.batch_sizes.append(n)
+    if self.state is None:
+      self.state = self.model.get_initial_state(n)
+    self.state = self.state + 1
+    return env_output.obs + self.weights, self.state[:, 0]
+
+
+def create_server(n_runners, max_latency=.01):
+  server = InferenceServer.__new__(InferenceServer)
+  server.n_runners = n_runners
+  server.max_latency = max_latency
+  server.weight_transfer = WeightTransfer.FULL
+  server.n_agents = 1
+  server.agents = [Agent()]
+  server._weights = [{}]
+  server._runner_oids = [{}]
+  server._current = [None]
+  server._requests = collections.defaultdict(list)
+  server._states = {}
+  return server
+
+
+def load_server_config(root_dir):
+  config = load_config('th/algo/ppo/configs/template')
+  config.dllib = 'th'
+  config.env = dict2AttrDict(dict(
+    env_name='random-rand',
+    n_units=2,
+    uid2aid=[0, 1],
+    max_episode_steps=20,
+    n_runners=2,
+    n_envs=2,
+    use_action_mask=False,
+    use_idx=False,
+    timeout_done=True,
+  ))
+  config.parameter_server = dict2AttrDict(dict(weight_transfer=WeightTransfer.FP16))
+  return set_path(config, ModelPath(str(root_dir), 'test'))
+
+
+def create_env_output(rid, n=2):
+  return EnvOutput(
+    obs=np.full((n, 3), rid, np.float32),
+    reward=np.zeros(n, np.float32),
+    discount=np.ones(n, np.float32),
+    reset=np.zeros(n, np.float32),
+  )
+
+
+def put(oid, model, w):
+  return ObjectRef(oid, ModelWeights(model, {MODEL: ObjectRef(f'{oid}-model', w)}))
+
+
+class TestClass:
+  def test_init(self, tmp_path):
+    config = load_server_config(tmp_path)
+    server = InferenceServer(config, n_runners=2)
+    assert server.n_runners == 2
+    assert server.weight_transfer == WeightTransfer.FP16
+    # the env config of the caller is not modified
+    assert config.env.n_runners == 2
+    assert server.env_stats.n_runners == 1
+    assert server.n_agents == 2
+    assert len(server.agents) == 2
+    # a single config is copied for each agent
+    assert server.agents[0].config is not server.agents[1].config
+    for states in (server._weights, server._runner_oids, server._current):
+      assert len(states) == 2
+
+    configs = [dict2AttrDict(config, to_copy=True) for _ in range(2)]
+    for aid, c in enumerate(configs):
+      c.name = f'ppo{aid}'
+    server = InferenceServer(configs, n_runners=2)
+    assert [agent.name for agent in server.agents] == ['ppo0', 'ppo1']
+    with pytest.raises(AssertionError):
+      InferenceServer(configs * 2, n_runners=2)
+
+  def test_gathering_and_scattering(self):
+    n_runners = 3
+    server = create_server(n_runners)
+    model = ModelPath('logs', 'test/a0/i1-v1')
+    mid = put('v1', model, 10)
+
+    async def run():
+      for rid in range(n_runners):
+        assert await server.set_model_weights(0, rid, [mid]) == model
+      # snapshots are resolved once
+      assert mid.n_resolved == 1, mid.n_resolved
+      outs = await asyncio.gather(*[
+        server.infer(0, rid, 'v1', create_env_output(rid))
+        for rid in range(n_runners)])
+      # requests of all runners are answered by a single batched pass
+      assert server.agents[0].batch_sizes == [2 * n_runners]
+      for rid, (action, state) in enumerate(outs):
+        np.testing.assert_equal(action, rid + 10)
+        np.testing.assert_equal(state, 1)
+
+      # incomplete batches are flushed after max_latency
+      action, state = await server.infer(0, 0, 'v1', create_env_output(0))
+      assert server.agents[0].batch_sizes[-1] == 2
+      np.testing.assert_equal(action, 10)
+      # memory states are kept for each runner
+      np.testing.assert_equal(state, 2)
+      server.reset_states(0)
+      _, state = await server.infer(0, 0, 'v1', create_env_output(0))
+      np.testing.assert_equal(state, 1)
+    asyncio.run(run())
+
+  def test_versions_and_release(self):
+    server = create_server(2, max_latency=.001)
+    model = ModelPath('logs', 'test/a0/i1-v1')
+    other = ModelPath('logs', 'test/a0/i2-v1')
+
+    async def run():
+      await server.set_model_weights(0, 0, [put('v1', model, 10)])
+      await server.set_model_weights(0, 1, [put('v2', model, 20)])
+      # runners playing different versions of a model do not interfere
+      (a0, _), (a1, _) = await asyncio.gather(
+        server.infer(0, 0, 'v1', create_env_output(0)),
+        server.infer(0, 1, 'v2', create_env_output(1)))
+      np.testing.assert_equal(a0, 10)
+      np.testing.assert_equal(a1, 21)
+      assert set(server._weights[0]) == {'v1', 'v2'}
+
+      # weights and states no runner uses are released
+      await server.set_model_weights(0, 0, [put('v2', model, 20)])
+      assert set(server._weights[0]) == {'v2'}
+      assert (0, 0, model) in server._states
+      await server.set_model_weights(0, 0, [put('o1', other, 30)])
+      assert set(server._weights[0]) == {'v2', 'o1'}
+      assert (0, 0, model) not in server._states
+      assert (0, 1, model) in server._states
+    asyncio.run(run())
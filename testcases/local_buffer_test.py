@@ -0,0 +1,126 @@
+import collections
+import numpy as np
+
+from core.typing import dict2AttrDict
+from tools.tree_ops import tree_flatten
+from tools.utils import stack_data_with_state
+from replay.ac import LocalBuffer
+
+
+LSTMState = collections.namedtuple('LSTMState', 'hidden cell')
+
+env_stats = dict2AttrDict(dict(
+  obs_keys=[['obs']], 
+  use_action_mask=False, 
+  use_sample_mask=False, 
+))
+
+
+def create_buffer(n_steps):
+  config = dict2AttrDict(dict(
+    n_envs=3, 
+    n_steps=n_steps, 
+    sample_keys=[
+      'obs', 'action', 'action_mask', 'reward', 'value', 'state_reset', 'state'], 
+  ))
+  buffer = LocalBuffer(config, env_stats, None, 0, 0)
+  # state keys are dropped without a model
+  buffer.sample_keys = config.sample_keys
+  return buffer
+
+
+def create_step():
+  return dict(
+    obs=np.random.normal(size=(3, 2, 4)).astype(np.float32), 
+    action=dict(
+      move=np.random.randint(4, size=(3, 2)), 
+      info=None, 
+    ), 
+    action_mask=dict(move=np.random.randint(2, size=(3, 2, 4)).astype(bool)), 
+    reward=np.random.normal(size=(3, 2)), 
+    value=np.random.normal(size=(3, 2)), 
+    state_reset=np.random.randint(2, size=(3, 2)), 
+    state=LSTMState(np.random.normal(size=(3, 2, 5)), np.random.normal(size=(3, 2, 5))), 
+  )
+
+
+def stack_steps(steps, latest_piece, keys):
+  data = collections.defaultdict(list)
+  for step in steps:
+    for k, v in step.items():
+      data[k].append(v)
+  for k, v in latest_piece.items():
+    data[k].append(v)
+  return stack_data_with_state(data, keys)
+
+
+def assert_equal(x, y):
+  x_leaves, x_struct = tree_flatten(x)
+  y_leaves, y_struct = tree_flatten(y)
+  assert x_struct == y_struct, (x_struct, y_struct)
+  for a, b in zip(x_leaves, y_leaves):
+    assert a.dtype == b.dtype, (a.dtype, b.dtype)
+    np.testing.assert_equal(a, b)
+
+
+class TestClass:
+  def test_preallocated_rollout(self):
+    buffer = create_buffer(5)
+    # 12 steps exceed the preallocated steps
+    for n_steps in [5, 12, 5]:
+      steps = [create_step() for _ in range(n_steps)]
+      for step in steps:
+        buffer.add(**step)
+      latest_piece = dict(
+        value=np.random.normal(size=(3, 2)), 
+        state_reset=np.random.randint(2, size=(3, 2)), 
+      )
+      _, data, _ = buffer.retrieve_all_data(latest_piece)
+      expected = stack_steps(steps, latest_piece, buffer.sample_keys)
+      assert_equal(data, expected)
+      assert data.value.shape == (3, n_steps+1, 2), data.value.shape
+      assert buffer.is_empty()
+
+  def test_async_rollout(self):
+    buffer = create_buffer(4)
+    steps = [create_step() for _ in range(4)]
+    # envs are added in different orders and subsets
+    order = [[0, 1, 2], [2], [1, 2], [0], [2, 0], [1], [1, 0]]
+    env_steps = np.zeros(3, dtype=np.int64)
+    for idxes in order:
+      idxes = np.array(idxes)
+      data = {k: _take(v, idxes) for k, v in steps[0].items()}
+      for j, i in enumerate(idxes):
+        _put(data, j, steps[env_steps[i]], i)
+      assert not buffer.is_full()
+      buffer.add(idxes=idxes, **data)
+      env_steps[idxes] += 1
+      assert len(buffer) == env_steps.min()
+    assert buffer.is_full()
+    latest_piece = dict(
+      value=np.random.normal(size=(3, 2)), 
+      state_reset=np.random.randint(2, size=(3, 2)), 
+    )
+    _, data, _ = buffer.retrieve_all_data(latest_piece)
+    expected = stack_steps(steps, latest_piece, buffer.sample_keys)
+    assert_equal(data, expected)
+
+
+def _take(x, idxes):
+  if isinstance(x, dict):
+    return {k: _take(v, idxes) for k, v in x.items()}
+  if isinstance(x, tuple):
+    return type(x)(*[_take(v, idxes) for v in x])
+  return None if x is None else x[idxes].copy()
+
+
+def _put(x, j, y, i):
+  """ Writes row i of y into row j of x """
+  if isinstance(x, dict):
+    for k in x:
+      _put(x[k], j, y[k], i)
+  elif isinstance(x, tuple):
+    for a, b in zip(x, y):
+      _put(a, j, b, i)
+  elif x is not None:
+    x[j] = y[i]
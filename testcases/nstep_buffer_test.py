@@ -0,0 +1,99 @@
+import collections
+import numpy as np
+
+from core.typing import AttrDict, dict2AttrDict
+from replay.local import BatchedNStepBuffer
+
+
+LSTMState = collections.namedtuple('LSTMState', 'h c')
+
+env_stats = dict2AttrDict(dict(
+  obs_keys=[['obs']], 
+  use_action_mask=False, 
+  use_sample_mask=False, 
+))
+
+
+def reference_nstep(trajs, max_steps, gamma):
+  """ Per-env n-step returns computed with plain loops """
+  results = []
+  pending = []
+  for d in trajs:
+    for i, p in enumerate(reversed(pending)):
+      p['reward'] += gamma**(i+1) * d['reward']
+      p['discount'] = d['discount']
+      p['next_obs'] = d['next_obs']
+      p['steps'] += 1
+    pending.append(dict(d, steps=np.float32(1)))
+    if len(pending) == max_steps or d['discount'] == 0 or d['reset']:
+      if d['discount'] == 0 or d['reset']:
+        results.extend(pending)
+        pending = []
+      else:
+        results.append(pending.pop(0))
+  return results
+
+
+class TestClass:
+  def test_batched_nstep_buffer(self):
+    n_envs, n_steps, max_steps, gamma = 5, 40, 3, .9
+    config = dict2AttrDict(dict(
+      max_steps=max_steps, gamma=gamma, n_steps=1, sample_keys=['obs']))
+    buffer = BatchedNStepBuffer(config, env_stats, None, 0, 0)
+    trajs = [[] for _ in range(n_envs)]
+    outputs = []
+    for t in range(n_steps):
+      data = dict(
+        obs=np.random.normal(size=(n_envs, 2)), 
+        next_obs=np.random.normal(size=(n_envs, 2)), 
+        reward=np.random.normal(size=n_envs), 
+        discount=(np.random.uniform(size=n_envs) > .1).astype(np.float32), 
+        reset=np.random.uniform(size=n_envs) < .05, 
+      )
+      for i in range(n_envs):
+        trajs[i].append({k: v[i].copy() for k, v in data.items()})
+      out = buffer.add(**data)
+      if out is not None:
+        outputs.append(out)
+    out = buffer.retrieve_all_data()
+    if out is not None:
+      outputs.append(out)
+    outputs = {k: np.concatenate([o[k] for o in outputs]) for k in outputs[0]}
+    
+    for i in range(n_envs):
+      expected = reference_nstep(trajs[i], max_steps, gamma)
+      # pending transitions left at the end are retrieved as well
+      n_expected = len(trajs[i])
+      mask = np.any(np.isin(outputs['obs'], np.stack([d['obs'] for d in trajs[i]])), axis=1)
+      assert np.sum(mask) == n_expected, (np.sum(mask), n_expected)
+      for k in ['reward', 'discount', 'next_obs', 'steps']:
+        np.testing.assert_allclose(
+          outputs[k][mask][:len(expected)], np.stack([d[k] for d in expected]), 
+          err_msg=k)
+
+  def test_nested_and_none_values(self):
+    n_envs, max_steps = 3, 3
+    config = dict2AttrDict(dict(
+      max_steps=max_steps, gamma=.9, n_steps=1, sample_keys=['obs']))
+    buffer = BatchedNStepBuffer(config, env_stats, None, 0, 0)
+    outputs = []
+    for t in range(10):
+      obs = np.random.normal(size=(n_envs, 2))
+      out = buffer.add(
+        obs=obs, 
+        next_obs=obs + 1, 
+        state=LSTMState(obs * 2, AttrDict(c=obs * 3)), 
+        reward=np.ones(n_envs), 
+        discount=np.ones(n_envs, np.float32), 
+        reset=np.zeros(n_envs, bool), 
+        mask=None, 
+      )
+      if out is not None:
+        outputs.append(out)
+    outputs.append(buffer.retrieve_all_data())
+    assert all('mask' not in o for o in outputs)
+    for o in outputs:
+      assert isinstance(o['state'], LSTMState), type(o['state'])
+      np.testing.assert_allclose(o['state'].h, o['obs'] * 2)
+      np.testing.assert_allclose(o['state'].c.c, o['obs'] * 3)
+    assert sum(len(o['obs']) for o in outputs) == 10 * n_envs
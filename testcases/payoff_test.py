@@ -0,0 +1,168 @@
+import numpy as np
+import pytest
+
+from core.typing import ModelPath
+from distributed.common.remote.payoff import PayoffManager
+from game.payoff import PayoffTableWithModel, SelfPlayPayoffTableWithModel
+
+
+def _model(aid, iid):
+  return ModelPath('logs', f'test/a{aid}/i{iid}-v0')
+
+
+def _reference_update(payoff, count, sids, s, step_size):
+  """ The scalar update of payoff tables before they were vectorized """
+  if count[sids] == 0:
+    payoff[sids] = np.mean(s)
+  elif not step_size:
+    payoff[sids] = (count[sids] * payoff[sids] + sum(s)) / (count[sids] + len(s))
+  else:
+    payoff[sids] += step_size * (np.mean(s) - payoff[sids])
+  count[sids] += len(s)
+
+
+def _random_updates(rng, n_agents, sizes, n):
+  updates = []
+  for _ in range(n):
+    sids = tuple(rng.integers(sizes[i]) for i in range(n_agents))
+    scores = [list(rng.normal(size=rng.integers(3))) for _ in range(n_agents)]
+    updates.append((sids, scores))
+  return updates
+
+
+class TestClass:
+  @pytest.mark.parametrize('step_size', [0, .1])
+  def test_update(self, step_size):
+    rng = np.random.default_rng(0)
+    n_agents, sizes = 2, (5, 3)
+    table = PayoffTableWithModel(n_agents, step_size, 'logs')
+    for i in range(max(sizes)):
+      for aid in range(n_agents):
+        if i < sizes[aid]:
+          table.expand(_model(aid, i))
+    assert [table.size(aid) for aid in range(n_agents)] == list(sizes)
+    assert table.get_payoffs()[0].shape == sizes
+
+    payoffs = [np.full(sizes, np.nan) for _ in range(n_agents)]
+    counts = [np.zeros(sizes, np.int64) for _ in range(n_agents)]
+    updates = _random_updates(rng, n_agents, sizes, 100)
+    for sids, scores in updates[:50]:
+      models = [_model(aid, sid) for aid, sid in enumerate(sids)]
+      table.update(models, scores)
+    table.update_batch(
+      [[_model(aid, sid) for aid, sid in enumerate(sids)] for sids, _ in updates[50:]],
+      [scores for _, scores in updates[50:]])
+    for sids, scores in updates:
+      for aid in range(n_agents):
+        if scores[aid]:
+          _reference_update(payoffs[aid], counts[aid], sids, scores[aid], step_size)
+    for aid in range(n_agents):
+      np.testing.assert_allclose(table.get_payoffs()[aid], payoffs[aid], rtol=1e-5)
+      np.testing.assert_array_equal(table.get_counts()[aid], counts[aid])
+
+  def test_update_batch_with_unknown_models(self):
+    table = PayoffTableWithModel(2, .1, 'logs')
+    table.expand_all([_model(aid, 0) for aid in range(2)])
+    # profiles shortened by unknown models are rejected, not reshaped
+    with pytest.raises(AssertionError):
+      table.update_batch(
+        [[_model(0, 0), _model(1, 1)], [_model(0, 1), _model(1, 0)]], 
+        [[[1.], [-1.]], [[1.], [-1.]]])
+    np.testing.assert_array_equal(table.get_counts()[0], 0)
+
+    table = SelfPlayPayoffTableWithModel(.1, 'logs')
+    table.expand(_model(0, 0))
+    with pytest.raises(AssertionError):
+      table.update_batch([[_model(0, 0), None]], [[1.]])
+
+  @pytest.mark.parametrize('step_size', [0, .1])
+  def test_self_play_update(self, step_size):
+    rng = np.random.default_rng(0)
+    n = 4
+    table = SelfPlayPayoffTableWithModel(step_size, 'logs')
+    for i in range(n):
+      table.expand(_model(0, i))
+    payoff = np.full((n, n), np.nan)
+    count = np.zeros((n, n), np.int64)
+    updates = [(tuple(rng.integers(n, size=2)), list(rng.normal(size=rng.integers(3))))
+      for _ in range(100)]
+    table.update_batch(
+      [[_model(0, i) for i in sids] for sids, _ in updates],
+      [scores for _, scores in updates])
+    for sids, scores in updates:
+      if sids[0] == sids[1]:
+        payoff[sids] = 0
+        count[sids] += len(scores)
+      elif scores:
+        rsids = sids[::-1]
+        is_new = count[sids] == 0
+        _reference_update(payoff, count, sids, scores, step_size)
+        if step_size and not is_new:
+          payoff[rsids] += step_size * (-np.mean(scores) - payoff[rsids])
+        else:
+          payoff[rsids] = -payoff[sids]
+        count[rsids] += len(scores)
+    np.testing.assert_allclose(table.get_payoffs(), payoff, rtol=1e-5, atol=1e-6)
+    np.testing.assert_array_equal(table.get_counts(), count)
+
+  def test_save_restore(self, tmp_path):
+    rng = np.random.default_rng(0)
+    n_agents = 2
+    table = PayoffTableWithModel(n_agents, .1, str(tmp_path), compact_interval=5)
+    table.expand_all([_model(aid, 0) for aid in range(n_agents)])
+    table.save(to_print=False)
+    for i in range(1, 4):
+      for aid in range(n_agents):
+        table.expand(_model(aid, i))
+      for sids, scores in _random_updates(rng, n_agents, (i+1, i+1), 3):
+        table.update([_model(aid, sid) for aid, sid in enumerate(sids)], scores)
+      table.save(to_print=False)
+      # changes are logged until there are more than compact_interval of them
+      assert (tmp_path / 'payoff.log.pkl').exists() == (i != 2), i
+
+      restored = PayoffTableWithModel(n_agents, .1, str(tmp_path), compact_interval=5)
+      restored.restore(to_print=False)
+      assert restored.get_all_models() == table.get_all_models()
+      for p1, p2 in zip(restored.get_payoffs(), table.get_payoffs()):
+        np.testing.assert_array_equal(p1, p2)
+      for c1, c2 in zip(restored.get_counts(), table.get_counts()):
+        np.testing.assert_array_equal(c1, c2)
+      assert restored.size(0) == i + 1
+
+  @pytest.mark.parametrize('self_play', [False, True])
+  def test_opponent_distribution_cache(self, self_play):
+    config = dict(step_size=.1, sampling_strategy=dict(type='pfsp', p=1))
+    n_agents = 2
+    manager = PayoffManager(config, n_agents, 'logs', self_play=self_play)
+    opp = 0 if self_play else 1
+    for i in range(3):
+      manager.add_strategy(_model(0, i))
+      if not self_play:
+        manager.add_strategy(_model(1, i))
+    model = _model(0, 0)
+
+    def compute():
+      results = manager.compute_opponent_distribution(0, model)
+      expected = manager._compute_opponent_distribution(0, model, True)
+      for x, y in zip(results, expected):
+        np.testing.assert_array_equal(x, y)
+      return results
+
+    compute()
+    # results returned are copies of the cached ones
+    compute()[2][:] = 0
+    compute()
+    assert (manager.n_cache_hits, manager.n_cache_misses) == (2, 1)
+    # updates of payoffs of other strategies keep the cache
+    manager.update_payoffs([_model(0, 1), _model(opp, 2)], 
+      [1.] if self_play else [[1.], [0.]])
+    compute()
+    assert (manager.n_cache_hits, manager.n_cache_misses) == (3, 1)
+    manager.update_payoffs([model, _model(opp, 1)], 
+      [1.] if self_play else [[1.], [0.]])
+    compute()
+    assert (manager.n_cache_hits, manager.n_cache_misses) == (3, 2)
+    manager.add_strategy(_model(opp, 3))
+    compute()
+    assert manager.get_cache_stats() == dict(
+      opp_dist_cache_hits=3, opp_dist_cache_misses=3)
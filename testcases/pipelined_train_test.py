@@ -0,0 +1,128 @@
+import threading
+import time
+import numpy as np
+
+from core.typing import AttrDict
+from algo.ma_common.run import Runner
+from algo.ma_common.train import pipelined_train
+from tools.store import StateStore
+
+
+class Model:
+  def __init__(self):
+    self.weights = 0
+
+  def get_weights(self):
+    return self.weights
+
+  def set_weights(self, weights):
+    self.weights = weights
+
+
+class Buffer:
+  def __init__(self):
+    self.data = []
+
+  def collect(self, **data):
+    self.data.append(data)
+
+
+class Agent:
+  """ Acts randomly and records when and with which weights it acts and
+  trains. The weights of the model are its train step """
+  def __init__(self, aid, runner, events):
+    self.aid = aid
+    self.runner = runner
+    self.events = events
+    self.model = Model()
+    self.actor = AttrDict(model=self.model)
+    self.buffer = Buffer()
+    self.env_step = 0
+    self.train_step = 0
+    # the train steps of data prepared for training
+    self.prepared = []
+    # threads storing stats
+    self.store_threads = []
+
+  def __call__(self, env_output):
+    self.events.append(('act', threading.get_ident(), time.time()))
+    time.sleep(.002)
+    action = self.runner.env.random_action()[self.aid]
+    n = len(env_output.reset)
+    return action, {'weights': np.full((n, 1), self.actor.model.weights)}
+
+  def train_record(self):
+    start = time.time()
+    time.sleep(.05)
+    self.train_step += 1
+    self.model.weights = self.train_step
+    self.events.append(('train', start, time.time()))
+
+  def get_train_step(self):
+    return self.train_step
+
+  def add_env_step(self, n):
+    self.env_step += n
+
+  def get_env_step(self):
+    return self.env_step
+
+  def build_memory(self):
+    return None
+
+  def set_memory(self, memory):
+    pass
+
+  def store(self, **kwargs):
+    self.store_threads.append(threading.get_ident())
+
+
+def prepare_buffer(agent, env_output, compute_return_at_once):
+  data = agent.buffer.data
+  agent.buffer.data = []
+  train_steps = np.concatenate([d['train_step'] for d in data])
+  weights = np.concatenate([d['weights'] for d in data])
+  # data are collected by the snapshot of the stored train step
+  np.testing.assert_equal(train_steps, weights)
+  agent.prepared.append(np.unique(train_steps).item())
+
+
+class TestClass:
+  def test_pipelined_train(self):
+    StateStore.state.pop('real', None)
+    runner = Runner(dict(
+      env_name='random-rand',
+      n_units=2,
+      uid2aid=[0, 1],
+      max_episode_steps=20,
+      n_runners=1,
+      n_envs=2,
+      use_action_mask=False,
+      use_idx=False,
+      timeout_done=True,
+      seed=0,
+    ))
+    events = []
+    agents = [Agent(aid, runner, events) for aid in range(2)]
+    models = [agent.actor.model for agent in agents]
+    routine_config = AttrDict(
+      n_steps=5, MAX_STEPS=50, compute_return_at_once=False)
+    pipelined_train(agents, runner, routine_config, prepare_buffer, lambda _: False)
+    StateStore.state.pop('real', None)
+
+    for agent, model in zip(agents, models):
+      # actors get their models back
+      assert agent.actor.model is model
+      assert agent.get_env_step() == 50
+      # the policy lag is one iteration
+      assert agent.prepared == [0, 0, 1, 2, 3], agent.prepared
+      assert agent.get_train_step() == 4
+      # episode stats are stored on the main thread
+      assert agent.store_threads
+      assert set(agent.store_threads) == {threading.get_ident()}
+
+    # rollouts are collected off the main thread while training
+    trains = [(start, end) for name, start, end in events if name == 'train']
+    acts = [(tid, t) for name, tid, t in events if name == 'act']
+    assert any(tid != threading.get_ident() for tid, _ in acts)
+    assert any(start < t < end for start, end in trains for _, t in acts)
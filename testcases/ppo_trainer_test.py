@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+import torch
+
+from core.typing import AttrDict
+from th.algo.ppo.elements.trainer import Trainer
+
+
+class Model(torch.nn.Module):
+  def __init__(self):
+    super().__init__()
+    self.linear = torch.nn.Linear(3, 1)
+    self.theta = list(self.linear.parameters())
+
+
+class Loss:
+  """ Regresses targets of all steps of sequences and records the
+  sequences seen """
+  def __init__(self, model):
+    self.model = model
+    self.seen = []
+
+  def loss(self, data):
+    self.seen.append(data.sid[:, 0].clone())
+    value = self.model.linear(data.obs).squeeze(-1)
+    value_loss = ((value - data.v_target)**2).mean()
+    actor_loss = torch.zeros(())
+    return actor_loss, value_loss, AttrDict(raw_v_target=data.v_target)
+
+
+def create_trainer(n_mbs=1, n_epochs=1, n_grad_accum=1, lr=0.):
+  torch.manual_seed(0)
+  trainer = Trainer.__new__(Trainer)
+  trainer.config = AttrDict(
+    n_runners=2, n_envs=4, n_mbs=n_mbs, n_epochs=n_epochs, 
+    n_grad_accum=n_grad_accum, theta_opt=True, popart=False)
+  trainer.model = Model()
+  trainer.loss = Loss(trainer.model)
+  trainer.tpdv = dict(device='cpu', dtype=torch.float32)
+  trainer.opts = AttrDict(theta=torch.optim.SGD(trainer.model.theta, lr=lr))
+  trainer.clip_norm = 1e6
+  trainer.post_init()
+  return trainer
+
+
+def create_data(b=8, s=5):
+  rng = np.random.default_rng(0)
+  return AttrDict(
+    obs=rng.normal(size=(b, s, 3)).astype(np.float32),
+    v_target=rng.normal(size=(b, s)).astype(np.float32),
+    sid=np.repeat(np.arange(b, dtype=np.float32)[:, None], s, 1),
+  )
+
+
+class TestClass:
+  @pytest.mark.parametrize('n_mbs', [1, 3, 8])
+  def test_mini_batches(self, n_mbs):
+    n_epochs = 2
+    trainer = create_trainer(n_mbs, n_epochs)
+    stats = trainer.train(create_data())
+    # every sequence is used exactly once in each epoch
+    assert len(trainer.loss.seen) == n_mbs * n_epochs
+    for e in range(n_epochs):
+      sids = torch.cat(trainer.loss.seen[e*n_mbs:(e+1)*n_mbs])
+      np.testing.assert_array_equal(np.sort(sids.numpy()), np.arange(8))
+      for mb in trainer.loss.seen[e*n_mbs:(e+1)*n_mbs]:
+        assert len(mb) in (8 // n_mbs, 8 // n_mbs + 1)
+    assert 'group_first_epoch/norm' in stats
+    assert 'group_last_epoch/norm' in stats
+
+  def test_single_mini_batch_stats(self):
+    stats = create_trainer().train(create_data())
+    assert 'group_first_epoch/norm' in stats
+    assert 'group_last_epoch/norm' in stats
+
+  @pytest.mark.parametrize('n_grad_accum', [2, 3])
+  def test_grad_accum(self, n_grad_accum):
+    data = AttrDict({k: torch.from_numpy(v) for k, v in create_data().items()})
+    grads = []
+    for n in [1, n_grad_accum]:
+      trainer = create_trainer(n_grad_accum=n)
+      stats = trainer.theta_train(data)
+      grads.append([p.grad.clone() for p in trainer.model.theta])
+      assert len(trainer.loss.seen) == n
+      np.testing.assert_array_equal(stats.raw_v_target, data.v_target)
+    for g1, g2 in zip(*grads):
+      torch.testing.assert_close(g1, g2)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from core.elements.prefetcher import Prefetcher
+from core.elements.trainloop import TrainingLoop
+from core.typing import AttrDict, dict2AttrDict
+from replay.per import ProportionalPER
+
+
+def create_per():
+  config = dict2AttrDict(dict(
+    n_runners=1, 
+    n_envs=1, 
+    max_size=100, 
+    min_size=10, 
+    batch_size=8, 
+    n_steps=1, 
+    sample_keys=['obs', 'reward'], 
+    use_is_ratio=True, 
+    alpha=.6, 
+  ))
+  env_stats = dict2AttrDict(dict(
+    obs_keys=[['obs']], 
+    use_action_mask=False, 
+    use_sample_mask=False, 
+  ))
+  return ProportionalPER(config, env_stats, None)
+
+
+class DummyTrainer:
+  model = None
+
+
+class TestClass:
+  def test_prefetcher(self):
+    buffer = create_per()
+    prefetcher = Prefetcher(buffer, 2)
+    assert prefetcher.sample() is None
+    for t in range(50):
+      buffer.add(obs=np.full(3, t, np.float32), reward=np.float32(t), discount=1.)
+    for _ in range(5):
+      data = prefetcher.sample()
+      assert data.obs.shape == (8, 1, 3), data.obs.shape
+      prefetcher.update_priorities(np.full(8, 2.), data.idxes)
+    prefetcher.stop()
+    # all submitted updates are applied after stopping
+    assert buffer._top_priority == 2., buffer._top_priority
+
+  def test_trainloop_prefetching(self):
+    buffer = create_per()
+    for t in range(50):
+      buffer.add(obs=np.full(3, t, np.float32), reward=np.float32(t), discount=1.)
+    config = AttrDict(prefetch=AttrDict(n_batches=3))
+    train_loop = TrainingLoop(config, buffer, DummyTrainer())
+    for _ in range(5):
+      data = train_loop.sample_data()
+      assert data.obs.shape == (8, 1, 3), data.obs.shape
+      train_loop.update_priorities(np.full(8, 3.), data.idxes)
+    train_loop.stop_prefetching()
+    assert buffer._top_priority == 3., buffer._top_priority
+
+  def test_prefetching_with_concurrent_writes(self):
+    buffer = create_per()
+    for t in range(20):
+      buffer.add(obs=np.full(3, t, np.float32), reward=np.float32(t), discount=1.)
+    prefetcher = Prefetcher(buffer, 2)
+    # writes on this thread are serialized with sampling on the prefetching thread
+    for t in range(20, 500):
+      buffer.add(obs=np.full(3, t, np.float32), reward=np.float32(t), discount=1.)
+      if t % 50 == 0:
+        data = prefetcher.sample()
+        np.testing.assert_equal(data.obs[:, 0, 0], data.reward[:, 0])
+    prefetcher.stop()
+
+  def test_to_tensor_requires_torch_trainer(self):
+    buffer = create_per()
+    config = AttrDict(prefetch=AttrDict(n_batches=2, to_tensor=True))
+    train_loop = TrainingLoop(config, buffer, DummyTrainer())
+    with pytest.raises(ValueError):
+      train_loop.sample_data()
+
+  def test_prefetching_requires_synchronized_buffer(self):
+    buffer = create_per()
+    buffer.is_synchronized = False
+    config = AttrDict(prefetch=AttrDict(n_batches=2))
+    train_loop = TrainingLoop(config, buffer, DummyTrainer())
+    with pytest.raises(ValueError):
+      train_loop.sample_data()
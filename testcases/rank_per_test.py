@@ -0,0 +1,95 @@
+import numpy as np
+
+from core.typing import dict2AttrDict
+from replay.ds.binary_heap import IndexedBinaryHeap
+from replay.per import ProportionalPER, RankBasedPER
+
+
+def _build_buffer(directory=None, cls=RankBasedPER, max_size=1000):
+  config = dict2AttrDict(dict(
+    n_runners=1, 
+    n_envs=1, 
+    max_size=max_size, 
+    min_size=64, 
+    batch_size=32, 
+    n_steps=1, 
+    sample_keys=['obs', 'reward'], 
+    use_is_ratio=True, 
+    alpha=.7, 
+    n_partitions=10, 
+    directory=directory, 
+  ))
+  env_stats = dict2AttrDict(dict(
+    obs_keys=[['obs']], 
+    use_action_mask=False, 
+    use_sample_mask=False, 
+  ))
+  return cls(config, env_stats, None)
+
+
+class TestClass:
+  def test_indexed_binary_heap(self):
+    cap = 100
+    heap = IndexedBinaryHeap(cap)
+    heap.batch_update(np.arange(cap), np.random.uniform(size=cap))
+    for _ in range(10):
+      idxes = np.random.randint(cap, size=20)
+      heap.batch_update(idxes, np.random.uniform(size=20))
+      p = heap._priorities
+      np.testing.assert_array_less(-1e-12, p[(np.arange(1, cap)-1)//2] - p[1:])
+      np.testing.assert_equal(heap._positions[heap._mem_idxes], np.arange(cap))
+    heap.rebalance()
+    np.testing.assert_equal(np.sort(heap._priorities)[::-1], heap._priorities)
+
+  def test_proportional_per_merge(self):
+    buffer = _build_buffer(cls=ProportionalPER, max_size=10)
+    buffer.merge([dict(obs=t) for t in range(7)])
+    buffer.update_priorities(np.full(2, 2.), np.array([0, 1]))
+    # trajectories wrap around the end of memory
+    buffer.merge([dict(obs=t) for t in range(7, 12)])
+    assert len(buffer) == 10 and buffer._idx == 2, (len(buffer), buffer._idx)
+    assert [d['obs'] for d in buffer._memory] == [10, 11] + list(range(2, 10))
+    # new trajectories get the top priority
+    tree = buffer._data_structure
+    np.testing.assert_allclose(
+      tree._sum_tree[tree._n_leaves:][:10], 
+      np.array([2, 2, 1, 1, 1, 1, 1, 2, 2, 2])**buffer._alpha)
+    # only the last max_size trajectories are kept
+    buffer.merge([dict(obs=t) for t in range(25)])
+    assert buffer._idx == 7, buffer._idx
+    assert [d['obs'] for d in buffer._memory] == list(range(18, 25)) + list(range(15, 18))
+
+  def test_rank_based_per(self):
+    buffer = _build_buffer()
+    for t in range(500):
+      buffer.add(obs=np.full(3, t, np.float32), reward=np.float32(t), discount=1.)
+    boundaries, probabilities = buffer._get_distribution(32)
+    assert len(probabilities) == 500, len(probabilities)
+    assert np.all(np.diff(boundaries) > 0), boundaries
+
+    samples = buffer.sample()
+    assert samples.obs.shape == (32, 1, 3), samples.obs.shape
+    np.testing.assert_array_less(samples.is_ratio, 1+1e-6)
+    buffer.update_priorities(samples.reward[:, 0] + 1, samples.idxes)
+    priorities = buffer._data_structure.get_priorities(samples.idxes)
+    np.testing.assert_allclose(priorities, samples.reward[:, 0] + 1)
+
+  def test_rank_based_per_save_restore(self, tmp_path):
+    buffer = _build_buffer(str(tmp_path))
+    # restoring without saved data keeps an empty heap to sample from
+    buffer.restore()
+    for t in range(100):
+      buffer.add(obs=np.full(3, t, np.float32), reward=np.float32(t), discount=1.)
+    samples = buffer.sample()
+    buffer.update_priorities(samples.reward[:, 0] + 1, samples.idxes)
+    buffer.save()
+
+    restored = _build_buffer(str(tmp_path))
+    restored.restore()
+    assert len(restored) == len(buffer), (len(restored), len(buffer))
+    assert restored._n_updates == buffer._n_updates
+    assert set(restored._distributions) == set(buffer._distributions)
+    np.testing.assert_allclose(
+      restored._data_structure.get_priorities(samples.idxes), samples.reward[:, 0] + 1)
+    samples = restored.sample()
+    assert samples.obs.shape == (32, 1, 3), samples.obs.shape
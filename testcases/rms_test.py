@@ -77,4 +77,80 @@ class TestClass:
       mean, std = moments(x, axis=tuple(range(m.ndim)), mask=m)
       var = np.square(std)
       np.testing.assert_allclose(mean, stats._mean)
-      np.testing.assert_allclose(var, stats._var)
\ No newline at end of file
+      np.testing.assert_allclose(var, stats._var)
+  def test_compute_moments(self):
+    x = np.random.normal(3, 2, size=(6, 5, 4)).astype(np.float32)
+    for axis in [(0,), (0, 1)]:
+      mean, var, count = compute_moments(x, axis)
+      assert mean.dtype == np.float32, mean.dtype
+      np.testing.assert_allclose(mean, x.astype(np.float64).mean(axis), rtol=1e-5, atol=1e-5)
+      np.testing.assert_allclose(var, x.astype(np.float64).var(axis), rtol=1e-5, atol=1e-5)
+      assert count == np.prod(x.shape[:len(axis)]), count
+
+    mask = np.random.randint(2, size=(6, 5))
+    mean, var, count = compute_moments(x, (0, 1), mask)
+    y = x[mask.astype(bool)].astype(np.float64)
+    np.testing.assert_allclose(mean, y.mean(0), rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(var, y.var(0), rtol=1e-5, atol=1e-5)
+    assert count == mask.sum(), (count, mask.sum())
+
+    # masks broadcast over dimensions of size one
+    mask = np.random.randint(2, size=(6, 1))
+    mean, var, count = compute_moments(x, (0, 1), mask)
+    y = x[np.broadcast_to(mask, (6, 5)).astype(bool)].astype(np.float64)
+    np.testing.assert_allclose(mean, y.mean(0), rtol=1e-5, atol=1e-5)
+    assert count == y.shape[0], (count, y.shape)
+
+  def test_combine_rms_list(self):
+    rms_list = [
+      StatsWithVarCount(
+        np.random.normal(size=3), np.random.uniform(size=3), np.random.randint(1, 10))
+      for _ in range(5)
+    ]
+    rms_list.append(StatsWithVarCount(0, 1, 0))
+    expected = rms_list[0]
+    for rms in rms_list[1:]:
+      expected = combine_rms(expected, rms)
+    rms = combine_rms_list(rms_list)
+    np.testing.assert_allclose(rms.mean, expected.mean)
+    np.testing.assert_allclose(rms.var, expected.var)
+    assert rms.count == expected.count, (rms.count, expected.count)
+    assert combine_rms_list([StatsWithVarCount(0, 1, 0)]) is None
+
+  def test_group_obs_rms(self):
+    from core.typing import dict2AttrDict
+    from core.mixin.actor import RMS
+
+    def create_rms(n_obs):
+      config = dict2AttrDict(dict(
+        model_path=('logs', 'rms_test'), 
+        print_for_debug=False, 
+        obs=dict(
+          normalize_obs=True, 
+          obs_names=['obs', 'global_state'], 
+          obs_normalized_axis=(0, 1), 
+          obs_normalized_ndim=2, 
+        ), 
+        reward=dict(gamma=.99), 
+      ))
+      return RMS(config, n_obs=n_obs)
+
+    indices = [[0, 2], [1]]
+    rms = create_rms(len(indices))
+    ref_rms = [create_rms(1) for _ in indices]
+    for _ in range(3):
+      data = dict2AttrDict(dict(
+        obs=np.random.normal(size=(4, 5, 3, 6)).astype(np.float32), 
+        global_state=np.random.normal(size=(4, 5, 3, 2)).astype(np.float32), 
+      ))
+      mask = np.random.randint(2, size=(4, 5))
+      rms.update_obs_rms(data, indices=indices, split_axis=2, mask=mask)
+      for r, idx in zip(ref_rms, indices):
+        r.update_obs_rms(
+          {k: np.take(v, idx, 2) for k, v in data.items()}, mask=mask)
+    for stats, ref in zip(rms.get_rms_stats().obs, ref_rms):
+      ref = ref.get_rms_stats().obs[0]
+      for k in ['obs', 'global_state']:
+        np.testing.assert_allclose(stats[k].mean, ref[k].mean, rtol=1e-6)
+        np.testing.assert_allclose(stats[k].var, ref[k].var, rtol=1e-6)
+        assert stats[k].count == ref[k].count
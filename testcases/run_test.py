@@ -0,0 +1,82 @@
+import collections
+import numpy as np
+import pytest
+
+from core.typing import dict2AttrDict
+from envs.func import create_env
+from tools.run import run_async
+from tools.tree_ops import tree_flatten
+
+
+def create_config(**kwargs):
+  return dict2AttrDict(dict(
+    env_name='random-rand', 
+    max_episode_steps=3, 
+    uid2aid=[0, 1], 
+    n_envs=5, 
+    seed=0, 
+    **kwargs
+  ))
+
+
+class FakeBuffer:
+  def __init__(self):
+    self.steps = collections.Counter()
+
+  def collect(self, idxes=None, **data):
+    idxes = range(len(data['reset'])) if idxes is None else idxes
+    for k in ['obs', 'next_obs', 'reward', 'discount', 'reset', 'value']:
+      for v in tree_flatten(data[k])[0]:
+        assert len(v) == len(idxes), (k, len(v), len(idxes))
+    # values are the number of steps each env has been acted on
+    np.testing.assert_equal(
+      data['value'][:, 0], [self.steps[i] + 1 for i in idxes])
+    for i in idxes:
+      self.steps[i] += 1
+
+
+class FakeAgent:
+  """ An agent whose memory state counts the steps of each env """
+  def __init__(self, env):
+    self._action = env.random_action()[0]
+    self._state = None
+    self.buffer = FakeBuffer()
+    self.n_episodes = 0
+
+  def __call__(self, env_output):
+    n = len(env_output.reset)
+    if self._state is None:
+      self._state = np.zeros((n, 1), dtype=np.int64)
+    assert self._state.shape[0] == n, (self._state.shape, n)
+    self._state = self._state + 1
+    action = {k: v[:n] for k, v in self._action.items()}
+    return action, {'value': self._state.copy()}
+
+  def get_states(self):
+    return self._state
+
+  def set_states(self, state=None):
+    self._state = state
+
+  def store(self, **kwargs):
+    self.n_episodes += len(kwargs['score'])
+
+
+@pytest.mark.parametrize('vec_env,min_ready', [(None, None), ('subproc', 1)])
+def test_run_async(vec_env, min_ready):
+  env = create_env(create_config(vec_env=vec_env, n_workers=5))
+  try:
+    env_stats = env.stats()
+    agents = [FakeAgent(env) for _ in range(2)]
+    env_output = env.output()
+    n_steps = 4
+    for i in range(2):
+      env_output = run_async(
+        agents, env, env_output, env_stats, n_steps, min_ready=min_ready)
+      assert env_output.reset[0].shape == (5, 1), env_output.reset[0].shape
+      for agent in agents:
+        assert agent.buffer.steps == {eid: (i + 1) * n_steps for eid in range(5)}
+        np.testing.assert_equal(agent.get_states(), (i + 1) * n_steps)
+        assert agent.n_episodes == 5 * ((i + 1) * n_steps // 3)
+  finally:
+    env.close()
@@ -0,0 +1,166 @@
+import collections
+import gc
+import threading
+import numpy as np
+import pytest
+
+from core.typing import AttrDict, dict2AttrDict
+from tools.tree_ops import tree_flatten
+from replay.ac import ACBuffer
+from replay.ds.shared_memory import SharedArrays, SharedMemoryWriter, get_specs
+
+
+LSTMState = collections.namedtuple('LSTMState', 'hidden cell')
+
+env_stats = dict2AttrDict(dict(
+  obs_keys=[['obs']], 
+  use_action_mask=False, 
+  use_sample_mask=False, 
+))
+
+
+def create_buffer(transport, n_runners):
+  config = dict2AttrDict(dict(
+    type='ac', 
+    n_runners=n_runners, 
+    n_envs=2, 
+    n_steps=5, 
+    sample_keys=['obs', 'action', 'reward', 'state'], 
+    transport=transport, 
+  ))
+  return ACBuffer(config, env_stats, None)
+
+
+def create_data(rid):
+  return AttrDict(
+    obs=np.random.normal(size=(2, 5, 3)).astype(np.float32), 
+    action=AttrDict(action=np.random.randint(4, size=(2, 5))), 
+    reward=np.full((2, 5), rid, dtype=np.float32), 
+    state=LSTMState(np.random.normal(size=(2, 4)), np.random.normal(size=(2, 4))), 
+  )
+
+
+class TestClass:
+  def test_shared_arrays(self):
+    specs = [((3, 4), np.float32), ((5,), np.int64), ((2, 0), np.float64)]
+    owner = SharedArrays(specs)
+    for i, x in enumerate(owner.arrays):
+      x[...] = i
+    other = SharedArrays.attach(owner.handle)
+    for x, y in zip(owner.arrays, other.arrays):
+      assert x.shape == y.shape and x.dtype == y.dtype
+      np.testing.assert_equal(x, y)
+    other.arrays[0][1] = 10
+    np.testing.assert_equal(owner.arrays[0][1], 10)
+    other.close()
+    owner.close()
+
+  def test_shared_memory_transport(self):
+    n_runners = 3
+    obj_buf = create_buffer('object', n_runners)
+    shm_buf = create_buffer('shm', n_runners)
+    writers = [SharedMemoryWriter() for _ in range(n_runners)]
+    for _ in range(3):
+      for rid, writer in enumerate(writers):
+        data = create_data(rid)
+        leaves, structure = tree_flatten(data)
+        if not writer.is_connected():
+          writer.connect(shm_buf.get_shared_memory_slots(
+            rid, structure, get_specs(leaves)))
+        obj_buf.merge_data(rid, data, 10)
+        shm_buf.merge_data(rid, writer.write(leaves), 10)
+      assert obj_buf.ready() and shm_buf.ready()
+      expected = obj_buf.sample()
+      sample = shm_buf.sample()
+      # the object transport drops state as there is no model
+      assert set(expected) | {'state'} == set(sample), (set(expected), set(sample))
+      for k in expected:
+        exp_leaves, exp_struct = tree_flatten(expected[k])
+        leaves, struct = tree_flatten(sample[k])
+        assert exp_struct == struct, (k, exp_struct, struct)
+        for x, y in zip(exp_leaves, leaves):
+          np.testing.assert_equal(x, y)
+      assert isinstance(sample.state, LSTMState), type(sample.state)
+    for writer in writers:
+      writer.close()
+    shm_buf.close_shared_memory()
+
+  def test_shared_memory_back_pressure(self):
+    n_runners = 2
+    buf = create_buffer('shm', n_runners)
+    writers = [SharedMemoryWriter() for _ in range(n_runners)]
+    leaves = [None, None]
+    for rid, writer in enumerate(writers):
+      leaves[rid], structure = tree_flatten(create_data(rid))
+      writer.connect(buf.get_shared_memory_slots(
+        rid, structure, get_specs(leaves[rid])))
+    # runner 0 fills its rows of both slots
+    for _ in range(2):
+      buf.merge_data(0, writers[0].write(leaves[0]), 10)
+    ahead = threading.Thread(target=lambda: writers[0].write(
+      [np.full_like(x, -1) for x in leaves[0]]))
+    ahead.start()
+    ahead.join(.1)
+    assert ahead.is_alive()
+    # runner 1 completes slot 0, which releases the rows of runner 0
+    buf.merge_data(1, writers[1].write(leaves[1]), 10)
+    ahead.join(5)
+    assert not ahead.is_alive()
+    sample = buf.sample()
+    # the batch is not affected by writes after it is queued
+    np.testing.assert_equal(sample.reward[:2], 0)
+    np.testing.assert_equal(sample.reward[2:], 1)
+
+    with pytest.raises(AssertionError):
+      bad_leaves = [np.zeros((3, *x.shape[1:]), x.dtype) for x in leaves[0]]
+      buf.get_shared_memory_slots(0, structure, get_specs(bad_leaves))
+    for writer in writers:
+      writer.close()
+    buf.close_shared_memory()
+
+  def test_shared_memory_reset(self):
+    n_runners = 2
+    buf = create_buffer('shm', n_runners)
+    writers = [SharedMemoryWriter() for _ in range(n_runners)]
+    leaves = [None, None]
+    for rid, writer in enumerate(writers):
+      leaves[rid], structure = tree_flatten(create_data(rid))
+      writer.connect(buf.get_shared_memory_slots(
+        rid, structure, get_specs(leaves[rid])))
+    buf.merge_data(0, writers[0].write(leaves[0]), 10)
+    # the slot of runner 1 is still in flight when the buffer is reset
+    stale = writers[1].write(leaves[1])
+    buf.reset()
+    # received rows are released by reset, in-flight rows by their slots
+    np.testing.assert_equal(buf._shm_flags.arrays[0][:, 0], 0)
+    np.testing.assert_equal(buf._shm_flags.arrays[0][0, 1], 1)
+    buf.merge_data(1, stale, 10)
+    np.testing.assert_equal(buf._shm_flags.arrays[0], 0)
+    assert not buf.ready()
+
+    # slots written after reset are merged as usual
+    for rid in [1, 0]:
+      buf.merge_data(rid, writers[rid].write(leaves[rid]), 10)
+    sample = buf.sample()
+    np.testing.assert_equal(sample.reward[:2], 0)
+    np.testing.assert_equal(sample.reward[2:], 1)
+    for writer in writers:
+      writer.close()
+    buf.close_shared_memory()
+
+  def test_shared_memory_release(self):
+    buf = create_buffer('shm', 1)
+    leaves, structure = tree_flatten(create_data(0))
+    info = buf.get_shared_memory_slots(0, structure, get_specs(leaves))
+    buf.close_shared_memory()
+    # segments are unlinked once closed
+    with pytest.raises(FileNotFoundError):
+      SharedArrays.attach(info['handles'][0])
+
+    buf = create_buffer('shm', 1)
+    info = buf.get_shared_memory_slots(0, structure, get_specs(leaves))
+    # or once the buffer is collected
+    del buf
+    gc.collect()
+    with pytest.raises(FileNotFoundError):
+      SharedArrays.attach(info['flags'])
@@ -0,0 +1,74 @@
+import numpy as np
+
+from core.typing import dict2AttrDict
+from envs.func import create_env
+from tools.tree_ops import tree_flatten
+
+
+def create_config(**kwargs):
+  return dict2AttrDict(dict(
+    env_name='random-rand', 
+    max_episode_steps=5, 
+    uid2aid=[0, 1], 
+    n_envs=5, 
+    seed=0, 
+    **kwargs
+  ))
+
+
+class TestClass:
+  def test_subproc_vec_env(self):
+    env = create_env(create_config())
+    subproc_env = create_env(create_config(vec_env='subproc', n_workers=2))
+    try:
+      assert subproc_env.n_workers == 2
+      assert subproc_env.stats().n_envs == env.stats().n_envs
+      for _ in range(2 * env.max_episode_steps):
+        action = env.random_action()
+        out = env.step(action)
+        subproc_out = subproc_env.step(action)
+        leaves, structure = tree_flatten(out)
+        subproc_leaves, subproc_structure = tree_flatten(subproc_out)
+        assert structure == subproc_structure
+        for x, y in zip(leaves, subproc_leaves):
+          assert x.shape == y.shape and x.dtype == y.dtype, (x.shape, y.shape)
+        np.testing.assert_equal(out.reset, subproc_out.reset)
+        for x, y in zip(tree_flatten(env.prev_obs())[0], 
+                        tree_flatten(subproc_env.prev_obs())[0]):
+          assert x.shape == y.shape, (x.shape, y.shape)
+
+        done_env_ids = [i for i, r in enumerate(out.reset[0]) if np.all(r)]
+        if done_env_ids:
+          assert subproc_env.epslen(done_env_ids) == env.epslen(done_env_ids)
+          info = subproc_env.info(done_env_ids)
+          assert len(info) == len(done_env_ids)
+
+      # outputs are not overwritten by later steps
+      out = subproc_env.step(env.random_action())
+      reset = out.reset[0].copy()
+      subproc_env.step(env.random_action())
+      np.testing.assert_equal(out.reset[0], reset)
+
+      out = subproc_env.reset([4, 1])
+      assert out.reset[0].shape[0] == 2
+    finally:
+      subproc_env.close()
+      env.close()
+
+  def test_send_recv(self):
+    env = create_env(create_config(vec_env='subproc', n_workers=5))
+    try:
+      action = env.random_action()
+      env.send(action)
+      env_ids, out = env.recv(min_ready=2)
+      assert len(env_ids) >= 2, env_ids
+      assert out.reset[0].shape == (len(env_ids), 1), out.reset[0].shape
+      # ready envs are stepped again while the others are still stepping
+      env.send([{k: v[env_ids] for k, v in a.items()} for a in action], env_ids)
+      env_ids2, out = env.recv()
+      np.testing.assert_equal(np.sort(env_ids2), np.arange(5))
+      assert out.reset[0].shape == (5, 1), out.reset[0].shape
+      prev_obs = env.prev_obs(env_ids2[:2])
+      assert prev_obs[0].obs.shape[0] == 2, prev_obs[0].obs.shape
+    finally:
+      env.close()
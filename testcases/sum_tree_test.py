@@ -0,0 +1,51 @@
+import numpy as np
+
+from replay.ds.sum_tree import SumTree, VectorizedSumTree
+
+
+class TestClass:
+  def test_vectorized_sum_tree(self):
+    for i in range(10):
+      cap = np.random.randint(10, 50)
+      st1 = SumTree(cap)
+      st2 = VectorizedSumTree(cap)
+
+      # test update
+      sz = np.random.randint(5, cap+1)
+      priorities = np.random.uniform(.1, 1, size=sz)
+      st1.batch_update(np.arange(sz), priorities)
+      st2.batch_update(np.arange(sz), priorities)
+      np.testing.assert_allclose(st1.total_priorities, st2.total_priorities)
+      np.testing.assert_allclose(st2.min_priority, np.min(priorities))
+
+      # test find against prefix sums, as SumTree does not keep 
+      # leaves in order when cap is not a power of two
+      bs = np.random.randint(2, sz)
+      intervals = np.linspace(0, st2.total_priorities, bs+1)
+      values = np.random.uniform(intervals[:-1], intervals[1:])
+      p2, idx2 = st2.batch_find(values)
+      idx1 = np.searchsorted(np.cumsum(priorities), values)
+      np.testing.assert_equal(idx1, idx2)
+      np.testing.assert_allclose(priorities[idx1], p2)
+
+      # values beyond the total never fall into padding leaves
+      p, idx = st2.batch_find(np.array([st2.total_priorities * (1 + 1e-6)]))
+      assert idx[0] < sz and p[0] > 0, (idx, p)
+
+      # test partial updates, including duplicate indices
+      idxes = np.random.randint(sz, size=sz)
+      priorities = np.random.uniform(.1, 1, size=sz)
+      st2.batch_update(idxes, priorities)
+      leaves = st2._sum_tree[st2._n_leaves:]
+      nodes = np.arange(1, st2._n_leaves)
+      np.testing.assert_allclose(st2._sum_tree[nodes], 
+        st2._sum_tree[2*nodes] + st2._sum_tree[2*nodes+1])
+      np.testing.assert_allclose(st2.total_priorities, np.sum(leaves))
+      np.testing.assert_allclose(st2.min_priority, np.min(leaves[:sz]))
+
+      # test stratified find
+      idxes, priorities, is_ratio = st2.stratified_find(bs, beta=.4)
+      assert np.all(idxes < sz), idxes
+      np.testing.assert_allclose(priorities, leaves[idxes])
+      np.testing.assert_allclose(is_ratio, (st2.min_priority / priorities)**.4)
+      assert np.all(is_ratio <= 1), is_ratio
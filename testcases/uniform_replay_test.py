@@ -0,0 +1,87 @@
+import numpy as np
+
+from core.typing import dict2AttrDict
+from replay.uniform import UniformReplay
+from replay.memmap import MemmapReplay
+
+
+env_stats = dict2AttrDict(dict(
+  obs_keys=[['obs']], 
+  use_action_mask=False, 
+  use_sample_mask=False, 
+))
+
+
+def create_buffer(storage, max_size=50, directory=None):
+  config = dict2AttrDict(dict(
+    n_runners=1, 
+    n_envs=4, 
+    max_size=max_size, 
+    min_size=1, 
+    batch_size=8, 
+    n_steps=1, 
+    sample_keys=['obs', 'action', 'reward', 'discount'], 
+    storage=storage, 
+    directory=directory, 
+  ))
+  if storage == 'memmap':
+    return MemmapReplay(config, env_stats, None)
+  return UniformReplay(config, env_stats, None)
+
+
+def add_data(buffers, n):
+  for t in range(n):
+    data = dict(
+      obs=np.random.normal(size=(4, 3)).astype(np.float32), 
+      next_obs=np.random.normal(size=(4, 3)).astype(np.float32), 
+      action=np.random.randint(5, size=4), 
+      reward=np.random.normal(size=4), 
+      discount=np.ones(4), 
+    )
+    for b in buffers:
+      b.add(rid=0, **data)
+
+
+class TestClass:
+  def test_columnar_storage(self):
+    deque_buf = create_buffer('deque')
+    col_buf = create_buffer('columnar')
+    for n in [3, 10, 30]:
+      add_data([deque_buf, col_buf], n)
+      assert len(deque_buf) == len(col_buf)
+      idxes = np.random.randint(len(col_buf), size=16)
+      x = deque_buf._get_samples(idxes, deque_buf._memory)
+      y = col_buf._get_samples(idxes, col_buf._memory)
+      assert set(x) == set(y), (set(x), set(y))
+      for k in x:
+        np.testing.assert_allclose(x[k], y[k])
+      x = deque_buf.range_sample(0, 10)
+      y = col_buf.range_sample(0, 10)
+      for k in x:
+        np.testing.assert_allclose(x[k], y[k])
+
+  def test_columnar_merge_and_pop(self):
+    deque_buf = create_buffer('deque', 10)
+    col_buf = create_buffer('columnar', 10)
+    add_data([deque_buf, col_buf], 2)
+    trajs = [deque_buf._memory[i] for i in range(len(deque_buf))]
+    x = deque_buf.merge_and_pop(trajs)
+    y = col_buf.merge_and_pop(trajs)
+    assert len(x) == len(y) == 6, (len(x), len(y))
+    for xx, yy in zip(x, y):
+      for k in xx:
+        np.testing.assert_allclose(xx[k], yy[k])
+
+  def test_memmap_replay(self, tmp_path):
+    deque_buf = create_buffer('deque')
+    mmap_buf = create_buffer('memmap', directory=str(tmp_path))
+    add_data([deque_buf, mmap_buf], 20)
+    mmap_buf.save()
+    del mmap_buf
+    mmap_buf = create_buffer('memmap', directory=str(tmp_path))
+    assert len(deque_buf) == len(mmap_buf), (len(deque_buf), len(mmap_buf))
+    idxes = np.random.randint(len(mmap_buf), size=16)
+    x = deque_buf._get_samples(idxes, deque_buf._memory)
+    y = mmap_buf._get_samples(idxes, mmap_buf._memory)
+    for k in x:
+      np.testing.assert_allclose(x[k], y[k])
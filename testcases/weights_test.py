@@ -0,0 +1,124 @@
+import threading
+import numpy as np
+import ray
+
+from core.names import MODEL
+from core.typing import ModelPath
+from distributed.common.weights import WeightSender, WeightSnapshots, \
+  WeightTransfer, compress_model_weights, decompress_model_weights, \
+  resolve_model_weights
+
+
+def _model(iid):
+  return ModelPath('logs', f'test/a0/i{iid}-v0')
+
+
+class TestClass:
+  def test_snapshots(self):
+    ray.init(num_cpus=1, ignore_reinit_error=True)
+    try:
+      self._test_snapshots()
+    finally:
+      ray.shutdown()
+
+  def _test_snapshots(self):
+    snapshots = WeightSnapshots(WeightTransfer.FP16, max_snapshots=2)
+    weights = {MODEL: {'w': np.ones(3, np.float32)}}
+    mid = snapshots.put(_model(0), weights)
+    # snapshots are reused while values of weights are the same objects
+    assert snapshots.put(_model(0), dict(weights)) is mid
+    assert snapshots.get_version(_model(0)) == 1
+    weights = {MODEL: {'w': np.full(3, 2, np.float32)}}
+    mid = snapshots.put(_model(0), weights)
+    assert snapshots.get_version(_model(0)) == 2
+    model_weights = ray.get(mid)
+    assert model_weights.model == _model(0)
+    w = resolve_model_weights(model_weights.weights[MODEL], WeightTransfer.FP16)
+    np.testing.assert_equal(w['w'], 2)
+    assert w['w'].dtype == np.float32
+
+    # versions keep increasing after snapshots are evicted
+    snapshots.put(_model(1), weights)
+    snapshots.put(_model(2), weights)
+    assert _model(0) not in snapshots._snapshots
+    assert snapshots.get_version(_model(0)) == 2
+    assert snapshots.put(_model(0), weights) is not mid
+    assert snapshots.get_version(_model(0)) == 3
+    assert list(snapshots._snapshots) == [_model(2), _model(0)]
+    stats = snapshots.get_stats()
+    assert stats['publish/n_reused'] == 1
+    assert stats['publish/n_published'] == 5
+
+  def test_fp16_round_trip(self):
+    weights = {
+      'w': np.linspace(-1, 1, 10, dtype=np.float32), 
+      'step': np.arange(3, dtype=np.int64),
+    }
+    compressed = compress_model_weights(weights, WeightTransfer.FP16)
+    assert compressed['w'].dtype == np.float16
+    assert compressed['step'].dtype == np.int64
+    decompressed = decompress_model_weights(compressed, WeightTransfer.FP16)
+    assert decompressed['w'].dtype == np.float32
+    np.testing.assert_allclose(decompressed['w'], weights['w'], atol=1e-3)
+    np.testing.assert_equal(decompressed['step'], weights['step'])
+    assert compress_model_weights(weights, WeightTransfer.FULL) is weights
+
+  def test_sender_coalescing(self):
+    sent = []
+    sending = threading.Event()
+    release = threading.Event()
+    def send(weights):
+      sending.set()
+      release.wait()
+      sent.append(weights)
+      return {'publish/time': 0}
+
+    sender = WeightSender(send)
+    sender.start()
+    sender.put(0)
+    sending.wait()
+    # weights put while sending replace each other
+    for i in range(1, 5):
+      sender.put(i)
+    release.set()
+    sender.stop()
+    assert sent == [0, 4], sent
+    assert sender.stats == {
+      'publish/time': 0, 'publish/n_coalesced': 3, 'publish/n_errors': 0}
+
+  def test_sender_shutdown(self):
+    sent = []
+    sending = threading.Event()
+    release = threading.Event()
+    def send(weights):
+      sending.set()
+      release.wait()
+      sent.append(weights)
+
+    sender = WeightSender(send)
+    sender.start()
+    sender.put(0)
+    sending.wait()
+    sender.put(1)
+    # the last weights are delivered before the sender stops
+    threading.Timer(.05, release.set).start()
+    sender.stop()
+    assert sent == [0, 1], sent
+
+  def test_sender_errors(self):
+    sent = []
+    def send(weights):
+      if weights == 0:
+        raise RuntimeError('unreachable parameter server')
+      sent.append(weights)
+
+    sender = WeightSender(send)
+    sender.start()
+    sender.put(0)
+    # the sender keeps working after a failure
+    while sender.stats.get('publish/n_errors') != 1:
+      pass
+    sender.put(1)
+    sender.stop()
+    assert sent == [1], sent
+    assert sender.stats['publish/n_errors'] == 1
@@ -1,10 +1,11 @@
 from functools import partial
 import numpy as np
+import torch
 
 from core.typing import AttrDict, dict2AttrDict
 from tools.display import print_dict_info
 from tools.utils import flatten_dict, prefix_name
-from tools.tree_ops import tree_map
+from tools.tree_ops import tree_flatten, tree_map
 from th.elements.trainer import Trainer as TrainerBase, create_trainer
 from th.elements import optimizer
 from th.tools.th_utils import to_tensor, to_numpy
@@ -67,19 +68,23 @@ class Trainer(TrainerBase):
         lambda x: x.reshape(self.config.n_mbs, -1, *x.shape[2:]), data)
 
     self.model.train()
+    # tensors are created once and mini-batches are views of them
+    tensors = to_tensor(data, self.tpdv)
+    n_mbs = self.config.n_mbs
     all_stats = AttrDict()
-    v_target = None
     for e in range(self.config.n_epochs):
-      stats = self.theta_train(data=data)
-      v_target = stats.raw_v_target
-      # print_dict_info(stats)
-      if e == self.config.n_epochs-1:
-        all_stats.update(**prefix_name(stats, name=f'group_last_epoch'))
-      elif e == 0:
-        all_stats.update(**prefix_name(stats, name=f'group_first_epoch'))
+      v_target = []
+      for i, mb in enumerate(self._iterate_mini_batches(tensors, n_mbs)):
+        stats = self.theta_train(data=mb)
+        v_target.append(stats.raw_v_target)
+        # print_dict_info(stats)
+        if e == 0 and i == 0:
+          all_stats.update(**prefix_name(stats, name=f'group_first_epoch'))
+        if e == self.config.n_epochs-1 and i == n_mbs - 1:
+          all_stats.update(**prefix_name(stats, name=f'group_last_epoch'))
 
     if self.config.popart:
-      self.model.vnorm.update(to_numpy(v_target))
+      self.model.vnorm.update(to_numpy(torch.cat(v_target)))
     all_stats = to_numpy(all_stats)
     data = flatten_dict(
       {k: v for k, v in data.items() if v is not None}, prefix='data')
@@ -88,27 +93,59 @@ class Trainer(TrainerBase):
     return all_stats
 
   def theta_train(self, data):
-    data = to_tensor(data, self.tpdv)
+    """ Accumulates gradients over n_grad_accum micro-batches of data
+    before updating, which reduces the peak memory of a mini-batch """
     if self.config.get('theta_opt'):
-      actor_loss, value_loss, stats = self.loss.loss(data)
-      loss = actor_loss + value_loss
-      norm = optimizer.optimize(
-        self.opts.theta, loss, self.model.theta, self.clip_norm
-      )
-      stats.norm = norm
+      opt_params = dict(theta=(self.opts.theta, self.model.theta))
     else:
-      policy_loss, value_loss, stats = self.loss.loss(data)
-      policy_norm = optimizer.optimize(
-        self.opts.policy, policy_loss, self.model.theta.policy, self.clip_norm
-      )
-      value_norm = optimizer.optimize(
-        self.opts.value, value_loss, self.model.theta.value, self.clip_norm
+      opt_params = dict(
+        policy=(self.opts.policy, self.model.theta.policy),
+        value=(self.opts.value, self.model.theta.value),
       )
-      stats.policy_norm = policy_norm
-      stats.value_norm = value_norm
-      
+    for opt, _ in opt_params.values():
+      opt.zero_grad()
+
+    n_accum = self.config.get('n_grad_accum', 1)
+    batch_size = _get_batch_size(data)
+    v_target = []
+    for mb in self._iterate_mini_batches(data, n_accum, shuffle=False):
+      actor_loss, value_loss, stats = self.loss.loss(mb)
+      # losses are averaged over micro-batches
+      weight = _get_batch_size(mb) / batch_size
+      ((actor_loss + value_loss) * weight).backward()
+      v_target.append(stats.raw_v_target)
+
+    for k, (opt, params) in opt_params.items():
+      norm = optimizer.clip_and_step(opt, params, self.clip_norm)
+      stats[f'{k}_norm' if k != 'theta' else 'norm'] = norm
+    if n_accum > 1:
+      stats.raw_v_target = torch.cat(v_target)
+
     return stats
 
+  def _iterate_mini_batches(self, data, n, shuffle=True):
+    """ Yields n mini-batches of whole sequences along the batch axis
+
+    With shuffling, data are permuted once, after which every
+    mini-batch is a view of a contiguous range of the permuted data.
+    Sequences are never split, so RNN states stay valid for BPTT.
+    """
+    batch_size = _get_batch_size(data)
+    assert n <= batch_size, (n, batch_size)
+    if n == 1:
+      yield data
+      return
+    if shuffle:
+      perm = torch.from_numpy(np.random.permutation(batch_size))
+      data = tree_map(lambda x: x[perm.to(x.device)], data)
+    bounds = np.linspace(0, batch_size, n+1).astype(np.int64)
+    for start, end in zip(bounds[:-1], bounds[1:]):
+      yield tree_map(lambda x: x[start:end], data)
+
+
+def _get_batch_size(data):
+  return next(x for x in tree_flatten(data)[0] if x is not None).shape[0]
+
 
 create_trainer = partial(create_trainer,
   name='ppo', trainer_cls=Trainer
@@ -28,6 +28,11 @@ def build_optimizer(
 def optimize(opt, loss, params, clip_norm):
   opt.zero_grad()
   loss.backward()
+  return clip_and_step(opt, params, clip_norm)
+
+
+def clip_and_step(opt, params, clip_norm):
+  """ Applies gradients accumulated in params, e.g., over micro-batches """
   norm = torch.nn.utils.clip_grad_norm_(params, clip_norm)
   opt.step()
   return norm
@@ -1,5 +1,6 @@
 import torch
 
+from tools.advantage import reverse_scan
 from th.tools import th_math, th_utils
 
 
@@ -105,12 +106,7 @@ def retrace(
   else:
     discounted_ratio = discount[1:] * next_c
   
-  err = 0.
-  errors = []
-  for i in reversed(range(delta.shape[0])):
-    err = delta[i] + discounted_ratio[i] * err
-    errors.append(err)
-  errors = torch.tensor(errors[::-1])
+  errors = reverse_scan(delta, discounted_ratio, axis=0)
 
   target = errors + q
 
@@ -144,13 +140,7 @@ def gae(
   # Adjust discount based on reset
   discount = (discount if reset is None else (1 - reset)) * gae_discount
 
-  err = 0.
-  advs = []
-  # Compute advantages in a reversed order loop
-  for i in reversed(range(delta.shape[0])):
-    err = delta[i] + discount[i] * err
-    advs.append(err)
-  advs = torch.stack(advs[::-1])
+  advs = reverse_scan(delta, discount, axis=0)
   vs = advs + value
 
   vs, advs = th_utils.undo_time_major(vs, advs, dims=dims, axis=axis)
@@ -238,12 +228,7 @@ def v_trace_from_ratio(
   else:
     discounted_ratio = discount * clipped_c
   
-  err = 0.
-  errors = []
-  for i in reversed(range(delta.shape[0])):
-    err = delta[i] + discounted_ratio[i] * err
-    errors.append(err)
-  advs = torch.tensor(errors[::-1])
+  advs = reverse_scan(delta, discounted_ratio, axis=0)
   vs = advs + value
 
   if rho_clip_pg is None:
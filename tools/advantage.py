@@ -0,0 +1,130 @@
+import numpy as np
+
+
+def reverse_scan(x, discount, axis=0):
+  """ Computes y_t = x_t + discount_t * y_{t+1} backwards along axis
+
+  This is the recursion shared by GAE, V-trace and other lambda-returns,
+  where discount folds in the reset and done masks. Both NumPy arrays and
+  torch tensors are supported. y has the dtype of x, and the torch
+  backend keeps the autograd graph and the device of x.
+  """
+  if isinstance(x, np.ndarray):
+    return _np_reverse_scan(x, discount, axis)
+  return _th_reverse_scan(x, discount, axis)
+
+
+def compute_gae(reward, discount, value, gamma, gae_discount,
+                next_value=None, reset=None, axis=1):
+  """ Computes GAE advantages and value targets along the time axis
+
+  If next_value is None, value contains one more step than reward.
+  If next_value is the value of the last step only, i.e., it has no
+  time dimension, it is appended to value[1:] along axis.
+  """
+  if next_value is None:
+    value, next_value = _split_last(value, axis)
+  elif next_value.ndim < value.ndim:
+    next_value = np.expand_dims(next_value, axis)
+    next_value = np.concatenate([_split_last(value, axis)[1], next_value], axis)
+  assert reward.shape == discount.shape == value.shape == next_value.shape, (reward.shape, discount.shape, value.shape, next_value.shape)
+
+  delta = (reward + discount * gamma * next_value - value).astype(np.float32)
+  discount = (discount if reset is None else (1 - reset)) * gae_discount
+
+  advs = reverse_scan(delta, discount, axis=axis)
+  traj_ret = advs + value
+
+  return advs, traj_ret
+
+
+""" Implementation """
+def _split_last(x, axis):
+  n = x.shape[axis]
+  idx = [slice(None)] * x.ndim
+  idx[axis] = slice(None, n-1)
+  first = x[tuple(idx)]
+  idx[axis] = slice(1, None)
+  return first, x[tuple(idx)]
+
+
+def _np_reverse_scan(x, discount, axis):
+  y = np.empty_like(x)
+  # time-major views
+  xt = np.moveaxis(x, axis, 0)
+  yt = np.moveaxis(y, axis, 0)
+  discount = np.moveaxis(np.broadcast_to(discount, x.shape), axis, 0)
+  next_y = 0
+  for i in reversed(range(xt.shape[0])):
+    yt[i] = next_y = xt[i] + discount[i] * next_y
+  return y
+
+
+def _th_reverse_scan(x, discount, axis):
+  import torch
+  discount = torch.as_tensor(discount, dtype=x.dtype, device=x.device)
+  discount = torch.broadcast_to(discount, x.shape)
+  x = torch.movedim(x, axis, 0)
+  discount = torch.movedim(discount, axis, 0)
+  y = x[-1]
+  ys = [y]
+  for i in range(x.shape[0]-2, -1, -1):
+    y = torch.addcmul(x[i], discount[i], y)
+    ys.append(y)
+  return torch.movedim(torch.stack(ys[::-1]), 0, axis)
+
+
+if __name__ == '__main__':
+  import time
+
+  def legacy_gae(reward, discount, value, gamma, gae_discount, next_value):
+    delta = (reward + discount * gamma * next_value - value).astype(np.float32)
+    discount = discount * gae_discount
+    next_adv = 0
+    advs = np.zeros_like(reward, dtype=np.float32)
+    for i in reversed(range(advs.shape[1])):
+      advs[:, i] = next_adv = (delta[:, i] + discount[:, i] * next_adv)
+    return advs, advs + value
+
+  def legacy_th_scan(x, discount):
+    err = 0.
+    errs = []
+    for i in reversed(range(x.shape[0])):
+      err = x[i] + discount[i] * err
+      errs.append(err)
+    return torch.stack(errs[::-1])
+
+  def benchmark(name, fn, n=10):
+    fn()
+    start = time.perf_counter()
+    for _ in range(n):
+      fn()
+    print(f'{name}: {(time.perf_counter() - start) / n * 1e3:.2f}ms')
+
+  n_envs, T, n_units = 256, 400, 10
+  shape = (n_envs, T, n_units)
+  reward = np.random.normal(size=shape).astype(np.float32)
+  discount = (np.random.uniform(size=shape) > .01).astype(np.float32)
+  value = np.random.normal(size=(n_envs, T+1, n_units)).astype(np.float32)
+  value, next_value = value[:, :-1], value[:, 1:]
+
+  adv, ret = compute_gae(reward, discount, value, .99, .95, next_value=next_value)
+  legacy_adv, legacy_ret = legacy_gae(reward, discount, value, .99, .95, next_value)
+  np.testing.assert_allclose(adv, legacy_adv, rtol=1e-4, atol=1e-4)
+  np.testing.assert_allclose(ret, legacy_ret, rtol=1e-4, atol=1e-4)
+  benchmark('legacy numpy gae',
+    lambda: legacy_gae(reward, discount, value, .99, .95, next_value))
+  benchmark('numpy gae',
+    lambda: compute_gae(reward, discount, value, .99, .95, next_value=next_value))
+
+  try:
+    import torch
+  except ImportError:
+    torch = None
+  if torch is not None:
+    delta = torch.from_numpy(reward).transpose(0, 1)
+    disc = torch.from_numpy(discount).transpose(0, 1) * .95
+    torch.testing.assert_close(
+      reverse_scan(delta, disc), legacy_th_scan(delta, disc))
+    benchmark('legacy torch scan', lambda: legacy_th_scan(delta, disc))
+    benchmark('torch scan', lambda: reverse_scan(delta, disc))
@@ -34,6 +34,68 @@ def combine_rms(rms1, rms2):
   return StatsWithVarCount(new_mean, new_var, total_count)
 
 
+def combine_rms_list(rms_list):
+  """ Combines a list of StatsWithVarCount in one vectorized call, 
+  which is equivalent to combining them one after another """
+  rms_list = [rms for rms in rms_list if rms.count > 0]
+  if len(rms_list) == 0:
+    return None
+  if len(rms_list) == 1:
+    return StatsWithVarCount(*rms_list[0])
+  means = np.stack([rms.mean for rms in rms_list])
+  vars = np.stack([rms.var for rms in rms_list])
+  counts = np.array([rms.count for rms in rms_list], dtype=np.float64)
+  return merge_moments(means, vars, counts)
+
+
+def merge_moments(means, vars, counts):
+  """ Merges moments stacked along the first axis, where counts has 
+  shape [n] or the leading shape of means """
+  total_count = np.sum(counts, 0)
+  weights = expand_dims_match(counts / np.maximum(total_count, 1), means)
+  mean = np.sum(weights * means, 0)
+  # no minus one here to be consistent with np.std
+  var = np.sum(weights * (vars + np.square(means - mean)), 0)
+  assert np.all(np.isfinite(var)), f'var: {var}'
+  return StatsWithVarCount(mean, var, total_count)
+
+
+def compute_moments(x, axis, mask=None):
+  """ Computes the mean, variance and count of x over the leading axes
+
+  Moments are accumulated in the floating type of x, e.g., float32, 
+  without casting x as a whole. The variance is computed from centered 
+  data in a second pass, which is numerically stable without float64. 
+  Masked sums are contractions of the flattened mask with x, so no 
+  masked copy of x is materialized. Only the count is in float64.
+  """
+  x = np.asarray(x)
+  if x.dtype.kind != 'f':
+    x = x.astype(np.float32)
+  n = len(axis)
+  assert tuple(axis) == tuple(range(n)), axis
+  lead_shape = x.shape[:n]
+  x = x.reshape(-1, *x.shape[n:])
+  if mask is None:
+    count = float(x.shape[0])
+    mean = np.mean(x, 0)
+    d = x - mean
+    np.square(d, out=d)
+    var = np.mean(d, 0)
+  else:
+    assert mask.ndim == n, (mask.shape, axis)
+    mask = np.broadcast_to(mask, lead_shape).reshape(-1).astype(x.dtype)
+    count = float(np.sum(mask, dtype=np.float64))
+    if count == 0:
+      return 0, 0, 0
+    mean = np.tensordot(mask, x, axes=1) / x.dtype.type(count)
+    d = x - mean
+    np.square(d, out=d)
+    var = np.tensordot(mask, d, axes=1) / x.dtype.type(count)
+
+  return mean, var, count
+
+
 def denormalize(x, mean, std, zero_center=True, mask=None, 
         dim_mask=None, np=np):
   """ Denormalize x using mean and std
@@ -166,41 +228,46 @@ class RunningMeanStd:
       else:
         return StatsWithVar(self._mean, self._var)
 
-  def update(self, x, mask=None, feature_mask=None, axis=None):
-    x = x.astype(np.float64)
+  def compute_moments(self, x, mask=None, feature_mask=None, axis=None):
+    """ Computes the moments of a batch, the input to update_from_moments """
     if axis is None:
       axis = self._axis
-      shape_slice = self._shape_slice
-    else:
-      if isinstance(axis, int):
-        axis = (axis,)
-      shape_slice = np.s_[:max(axis)+1]
+    elif isinstance(axis, int):
+      axis = (axis,)
     if axis is None:
       assert mask is None, mask
-      batch_mean, batch_var, batch_count = x, np.zeros_like(x), 1
+      batch_mean = np.asarray(x, dtype=np.float64)
+      batch_var, batch_count = np.zeros_like(batch_mean), 1
     else:
-      batch_mean, batch_var = moments(x, axis, mask)
-      batch_count = np.prod(x.shape[shape_slice]) \
-        if mask is None else np.sum(mask)
-    if feature_mask is not None:
+      batch_mean, batch_var, batch_count = compute_moments(x, axis, mask)
+    if feature_mask is not None and batch_count > 0:
       assert feature_mask.shape[-1] == batch_mean.shape[-1], (feature_mask.shape, batch_mean.shape)
       assert feature_mask.shape[-1] == batch_var.shape[-1], (feature_mask.shape, batch_var.shape)
       batch_mean = np.where(feature_mask, batch_mean, 0)
       batch_var = np.where(feature_mask, batch_var, 1)
+    return batch_mean, batch_var, batch_count
+
+  def update(self, x, mask=None, feature_mask=None, axis=None):
+    batch_mean, batch_var, batch_count = self.compute_moments(
+      x, mask=mask, feature_mask=feature_mask, axis=axis)
     if batch_count > 0:
       if self._ndim is not None:
         assert batch_mean.ndim == self._ndim, (batch_mean.shape, self._ndim)
-      self.update_from_moments(batch_mean, batch_var, batch_count)
+      # variances computed from centered data are nonnegative
+      self._update_from_moments(batch_mean, batch_var, batch_count)
 
   def update_from_moments(self, batch_mean, batch_var, batch_count):
     if batch_count == 0:
       return
     assert np.all(batch_var >= 0), batch_var[batch_var < 0]
+    self._update_from_moments(batch_mean, batch_var, batch_count)
+
+  def _update_from_moments(self, batch_mean, batch_var, batch_count):
     if self._count == 0:
       self._mean = np.zeros_like(batch_mean, 'float64')
       self._var = np.ones_like(batch_var, 'float64')
-    assert self._mean.shape == batch_mean.shape
-    assert self._var.shape == batch_var.shape
+    assert self._mean.shape == np.shape(batch_mean), (self._mean.shape, np.shape(batch_mean))
+    assert self._var.shape == np.shape(batch_var), (self._var.shape, np.shape(batch_var))
 
     new_mean, new_var, total_count = combine_rms(
       StatsWithVarCount(self._mean, self._var, self._count), 
@@ -6,6 +6,7 @@ import numpy as np
 from core.typing import dict2AttrDict
 from tools.log import do_logging
 from tools.store import StateStore
+from tools.tree_ops import tree_flatten, tree_map, tree_slice
 from tools.utils import batch_dicts
 from envs.typing import EnvOutput
 from envs.func import create_env
@@ -29,6 +30,8 @@ def concat_along_unit_dim(x):
 class RunnerWithState:
   def __init__(self, env_config, seed_interval=1000):
     self._env_config = dict2AttrDict(env_config, to_copy=True)
+    # envs are stepped asynchronously if min_ready is specified, see run_async
+    self._min_ready = self._env_config.pop('min_ready', None)
     self._seed_interval = seed_interval
     self.build_env(for_self=True)
   
@@ -91,13 +94,23 @@ class RunnerWithState:
         return self._run(agents, **kwargs)
 
   def _run(self, agents, **kwargs):
-    self.env_output = run(
-      agents, 
-      self.env, 
-      self.env_output, 
-      self._env_stats, 
-      **kwargs
-    )
+    if self._min_ready is None:
+      self.env_output = run(
+        agents, 
+        self.env, 
+        self.env_output, 
+        self._env_stats, 
+        **kwargs
+      )
+    else:
+      self.env_output = run_async(
+        agents, 
+        self.env, 
+        self.env_output, 
+        self._env_stats, 
+        min_ready=self._min_ready, 
+        **kwargs
+      )
     return self.env_output
 
   def get_steps_per_run(self, n_steps):
@@ -112,8 +125,11 @@ def run(
   n_steps, 
   store_info=True, 
   collect_data=True, 
-  eps_callbacks=[]
+  eps_callbacks=[], 
+  train_steps=None, 
 ):
+  """ Runs agents for n_steps steps. If train_steps is given, the train 
+  step of the policy acting for each agent is stored with its data """
   for _ in range(n_steps):
     agent_env_outputs = divide_env_output(env_output)
     actions, stats = zip(*[a(o) for a, o in zip(agents, agent_env_outputs)])
@@ -134,29 +150,148 @@ def run(
           reset=new_agent_env_outputs[i].reset,
         )
         data.update(stats[i])
+        if train_steps is not None:
+          data['train_step'] = train_steps[i] * np.ones_like(data['reset'])
         agent.buffer.collect(**data)
 
     env_output = new_env_output
     done_env_ids = [i for i, r in enumerate(env_output.reset[0]) if np.all(r)]
     if done_env_ids:
-      if store_info:
-        info = env.info(done_env_ids)
-        stats = collections.defaultdict(list)
-        for i in info:
-          for k, v in i.items():
-            stats[k].append(v)
-        for aid, uids in enumerate(env_stats.aid2uids):
-          agent_info = {k: [vv[uids] for vv in v]
-              if isinstance(v[0], np.ndarray) else v 
-              for k, v in stats.items()}
-          agents[aid].store(**agent_info)
-
-      for callback in eps_callbacks:
-        callback(info=info)
+      _store_episode_info(
+        agents, env, env_stats, done_env_ids, store_info, eps_callbacks)
+
+  return env_output
+
+
+def run_async(
+  agents: Tuple, 
+  env, 
+  env_output, 
+  env_stats, 
+  n_steps, 
+  min_ready=None, 
+  store_info=True, 
+  collect_data=True, 
+  eps_callbacks=[], 
+  train_steps=None, 
+):
+  """ Runs agents until every env takes n_steps steps, where envs are 
+  stepped asynchronously by env.send and env.recv
+
+  Agents act on whichever envs are ready, i.e., at least min_ready 
+  of them, so slow envs do not hold back the others. Data are 
+  collected with the ids of the envs, so that each env fills its own 
+  rows of the buffers. Memory states of agents are kept for all envs 
+  and sliced for the ready ones. Envs that have taken n_steps steps 
+  wait for the others, so every rollout ends with no env stepping.
+  """
+  n_envs = env.n_envs
+  env_output = tree_map(np.copy, env_output)
+  states = [a.get_states() for a in agents]
+  # observations, actions and stats of envs being stepped
+  sent = [None for _ in agents]
+  env_steps = np.zeros(n_envs, dtype=np.int64)
+  n_stepping = 0
+  env_ids = np.arange(n_envs)
+  ready_output = env_output
+
+  try:
+    while True:
+      to_act = env_steps[env_ids] < n_steps
+      if np.any(to_act):
+        env_ids = env_ids[to_act]
+        agent_env_outputs = divide_env_output(tree_slice(ready_output, to_act))
+        actions, stats = [], []
+        for aid, (agent, o) in enumerate(zip(agents, agent_env_outputs)):
+          if states[aid] is not None:
+            agent.set_states(tree_slice(states[aid], env_ids))
+          a, s = agent(o)
+          states[aid] = _scatter(states[aid], env_ids, agent.get_states())
+          actions.append(a)
+          stats.append(s)
+        env.send(actions, env_ids)
+        if collect_data:
+          for aid, (o, a, s) in enumerate(zip(agent_env_outputs, actions, stats)):
+            sent[aid] = _scatter(sent[aid], env_ids, (o.obs, a, s), n_envs)
+        env_steps[env_ids] += 1
+        n_stepping += len(env_ids)
+      if n_stepping == 0:
+        break
+
+      env_ids, ready_output = env.recv(min_ready)
+      n_stepping -= len(env_ids)
+      env_output = _scatter(env_output, env_ids, ready_output)
+      new_agent_env_outputs = divide_env_output(ready_output)
+
+      if collect_data:
+        next_obs = env.prev_obs(env_ids)
+        for aid, agent in enumerate(agents):
+          obs, action, stats = tree_slice(sent[aid], env_ids)
+          data = dict(
+            obs=obs, 
+            action=action, 
+            reward=new_agent_env_outputs[aid].reward, 
+            discount=new_agent_env_outputs[aid].discount, 
+            next_obs=next_obs[aid], 
+            reset=new_agent_env_outputs[aid].reset,
+          )
+          data.update(stats)
+          if train_steps is not None:
+            data['train_step'] = train_steps[aid] * np.ones_like(data['reset'])
+          agent.buffer.collect(idxes=env_ids, **data)
+
+      done_env_ids = [int(eid) for eid, r in 
+        zip(env_ids, ready_output.reset[0]) if np.all(r)]
+      if done_env_ids:
+        _store_episode_info(
+          agents, env, env_stats, done_env_ids, store_info, eps_callbacks)
+  finally:
+    for agent, state in zip(agents, states):
+      agent.set_states(state)
 
   return env_output
 
 
+def _scatter(tree, idxes, part, n=None):
+  """ Writes part into rows idxes of tree. A copy of part is returned 
+  if tree is None, in which case part must cover all n rows """
+  if tree is None:
+    assert n is None or len(idxes) == n, (len(idxes), n)
+    return part if n is None else tree_map(np.copy, part)
+  leaves, _ = tree_flatten(tree)
+  part_leaves, _ = tree_flatten(part)
+  assert len(leaves) == len(part_leaves), (len(leaves), len(part_leaves))
+  for x, v in zip(leaves, part_leaves):
+    if x is not None:
+      x[idxes] = v
+  return tree
+
+
+def store_episode_info(agents, env_stats, info):
+  """ Stores the info of finished episodes into agents """
+  stats = collections.defaultdict(list)
+  for i in info:
+    for k, v in i.items():
+      stats[k].append(v)
+  for aid, uids in enumerate(env_stats.aid2uids):
+    agent_info = {k: [vv[uids] for vv in v]
+        if isinstance(v[0], np.ndarray) else v 
+        for k, v in stats.items()}
+    agents[aid].store(**agent_info)
+
+
+def _store_episode_info(
+    agents, env, env_stats, done_env_ids, store_info, eps_callbacks):
+  if not store_info and not eps_callbacks:
+    return
+  info = env.info(done_env_ids)
+  if store_info:
+    store_episode_info(agents, env_stats, info)
+
+  for callback in eps_callbacks:
+    callback(info=info)
+
+
 class Runner:
   def __init__(self, env, agent, step=0, nsteps=None, 
         run_mode=RunMode.NSTEPS, record_envs=None, info_func=None):
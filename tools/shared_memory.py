@@ -0,0 +1,66 @@
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+
+def get_specs(leaves):
+  return [(v.shape, v.dtype) for v in map(np.asarray, leaves)]
+
+
+def _attach(name):
+  try:
+    return shared_memory.SharedMemory(name=name, track=False)
+  except TypeError:
+    # Python < 3.13 registers attached blocks with the resource tracker,
+    # which would unlink them when the attaching process exits
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args, **kwargs: None
+    try:
+      return shared_memory.SharedMemory(name=name)
+    finally:
+      resource_tracker.register = register
+
+
+def _align(n, alignment=64):
+  return (n + alignment - 1) // alignment * alignment
+
+
+class SharedArrays:
+  """ A list of arrays laid out in a single shared memory block
+
+  The block is created by the owner from a list of (shape, dtype) specs
+  and attached by other processes on the same node through its handle,
+  i.e., (name, specs). Attaching does not register the block with the
+  resource tracker, so only the owner unlinks it.
+  """
+  def __init__(self, specs, name=None):
+    self.specs = [(tuple(shape), np.dtype(dtype)) for shape, dtype in specs]
+    offsets = []
+    size = 0
+    for shape, dtype in self.specs:
+      offsets.append(size)
+      size += _align(int(np.prod(shape)) * dtype.itemsize)
+    self.is_owner = name is None
+    if self.is_owner:
+      self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    else:
+      self._shm = _attach(name)
+    self.arrays = [
+      np.ndarray(shape, dtype=dtype, buffer=self._shm.buf, offset=offset)
+      for (shape, dtype), offset in zip(self.specs, offsets)
+    ]
+
+  @property
+  def handle(self):
+    return self._shm.name, self.specs
+
+  @classmethod
+  def attach(cls, handle):
+    name, specs = handle
+    return cls(specs, name=name)
+
+  def close(self):
+    # arrays must be released before the underlying buffer
+    self.arrays = []
+    self._shm.close()
+    if self.is_owner:
+      self._shm.unlink()
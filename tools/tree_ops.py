@@ -26,7 +26,7 @@ def tree_unflatten(structure, leaves):
       return leaves[0], leaves[1:]
     elif isinstance(structure, tuple):
       type_, sub_structures = structure
-      if isinstance(type_(), (list, tuple)):
+      if issubclass(type_, (list, tuple)):
         unflattened = []
         for sub_structure in sub_structures:
           subtree, leaves = _tree_unflatten(sub_structure, leaves)
@@ -35,7 +35,7 @@ def tree_unflatten(structure, leaves):
           return type_(*unflattened), leaves
         else:
           return type_(unflattened), leaves
-      elif isinstance(type_(), dict):
+      elif issubclass(type_, dict):
         unflattened = {}
         for key, sub_structure in sub_structures.items():
           subtree, leaves = _tree_unflatten(sub_structure, leaves)